@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key
+from out_of_core import LazyDataset
+
+# The analysis pipeline of a rerun (dataset -> filter -> projection/NA-drop ->
+# sample -> test -> post-hoc) as a DAG of memoized nodes. Each node is keyed
+# by its name, its function, the keys of its input nodes and its parameters,
+# so a rerun only evaluates the nodes whose inputs changed; the others are
+# taken from a cache shared by every session. Cached values are shared and
+# must not be modified. Every evaluation is recorded as a cache hit or miss
+# for the performance panel.
+
+# Memory kept by the node cache, whose values include filtered and projected frames
+NODE_CACHE_MB = int(os.environ.get('DATA_EXPRESS_PIPELINE_CACHE_MB', 512))
+
+
+# Approximate memory of a node value in bytes
+def value_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+_node_cache = DatasetCache(max_entries=32, max_bytes=NODE_CACHE_MB * 2**20, sizeof=value_size)
+
+
+# Fingerprint of a node input or parameter
+def fingerprint(value):
+    if isinstance(value, Node):
+        return value.key
+    if isinstance(value, pd.DataFrame):
+        return 'frame:' + dataset_key(value)
+    if isinstance(value, LazyDataset):
+        return f'lazy:{value.key}:{value.filter_text}'
+    if isinstance(value, (list, tuple)):
+        return '(' + ','.join(fingerprint(item) for item in value) + ')'
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{key!r}:{fingerprint(item)}' for key, item in sorted(value.items(), key=repr)) + '}'
+    return repr(value)
+
+
+class Node:
+    def __init__(self, name, key, value):
+        self.name = name
+        self.key = key
+        self.value = value
+
+
+class AnalysisDAG:
+    def __init__(self, cache=_node_cache):
+        self.cache = cache
+        # (node, 'source' / 'hit' / 'miss', seconds) in evaluation order
+        self.report = []
+
+    # A pipeline input, keyed by its fingerprint
+    def source(self, name, value):
+        self.report.append((name, 'source', 0.0))
+        return Node(name, fingerprint(value), value)
+
+    # fn(*inputs, **params) with node inputs replaced by their values, from the cache when possible
+    def node(self, name, fn, *inputs, **params):
+        parts = [name, f'{fn.__module__}.{fn.__qualname__}'] + [fingerprint(item) for item in inputs] \
+            + [f'{key}={fingerprint(value)}' for key, value in sorted(params.items())]
+        key = hashlib.blake2b('\x1f'.join(parts).encode(), digest_size=16).hexdigest()
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.report.append((name, 'hit', 0.0))
+            return Node(name, key, value)
+        start = time.perf_counter()
+        value = fn(*[item.value if isinstance(item, Node) else item for item in inputs], **params)
+        self.cache.put(key, value)
+        self.report.append((name, 'miss', time.perf_counter() - start))
+        return Node(name, key, value)
+
+    # Node of one item of a node's tuple value, e.g. one of two returned frames
+    def item(self, node, index):
+        return Node(f'{node.name}[{index}]', f'{node.key}[{index}]', node.value[index])
+
+    def hits(self):
+        return [name for name, state, _ in self.report if state == 'hit']
+
+    def misses(self):
+        return [name for name, state, _ in self.report if state == 'miss']
+
+    def report_table(self):
+        return pd.DataFrame(self.report, columns=['node', 'cache', 'seconds'])
+
+
+_MISSING = object()
@@ -0,0 +1,550 @@
+import os
+import math
+import hashlib
+import tempfile
+import numpy as np
+from scipy import stats
+import scikit_posthocs as sp
+from filter_engine import filter_data, dataset_key, set_dataset_key, detect_date_columns
+from out_of_core import LazyDataset
+from readers import read_file, read_many
+from sketches import SKETCH_MIN_ROWS, dataset_sketch
+from anova import cell_statistics, cells_from_aggregates, two_way_anova_table
+import moments
+import relationships
+import contingency
+import duplicates
+import tuning
+import explanations
+from dataset_cache import DatasetCache
+from instrumentation import span, set_size
+
+# Analysis core shared by the Streamlit apps and the command line (analyze.py).
+# Plain data in, structured results out: no st.* calls here, so the same
+# functions can be batch-run over many files in worker processes.
+# Datasets are pandas DataFrames or out-of-core LazyDatasets.
+
+# Level of significance used by every test
+ALPHA = 0.05
+
+# Columns with up to this many distinct values are treated as categorical
+MAX_CATEGORIES = 8
+
+# Trained models and their explanations, one file per training job
+MODEL_DIR = os.environ.get('DATA_EXPRESS_MODEL_DIR', os.path.join(tempfile.gettempdir(), 'data_express_models'))
+
+# Rows sampled per combination of groups for the two-way post-hoc tests of out-of-core datasets
+TWO_WAY_POSTHOC_SAMPLES = 5000
+
+# Column classifications per (filtered) dataset, shared by every session
+_classification_cache = DatasetCache(max_entries=64)
+
+# Names of the tests chosen by the test selection
+TEST_NAMES = {'ttest_rel': 'Paired t-test',
+              'wilcoxon': 'Wilcoxon Signed Rank test',
+              'ttest_ind': 'Independent t-test',
+              'mannwhitneyu': 'Mann Whitney U test',
+              'f_oneway': 'one-way ANOVA',
+              'kruskal': 'Kruskal-Wallis test'}
+
+
+## ===============================================
+## Loading, filtering and column classification
+## ===============================================
+
+# Read a dataset file of any supported format (a path or an uploaded file object) into a DataFrame
+def read_data(source, sheet_name=0, header=0):
+    data = read_file(source, sheet_name, header)
+    # Fingerprint the dataset once so filter indexes can be cached against it,
+    # and parse its date columns once for date filters
+    dataset_key(data)
+    detect_date_columns(data)
+    return data
+
+
+# Read several files, or several sheets of a workbook, into one DataFrame
+# with a source column (see readers.read_many for read_parts)
+def read_datasets(sources, sheet_names=None, header=0, read_parts=None):
+    data = read_many(sources, sheet_names, header, read_parts=read_parts)
+    dataset_key(data)
+    detect_date_columns(data)
+    return data
+
+
+# Open a file from disk, in memory or as an out-of-core dataset
+def open_dataset(path, out_of_core=False, sheet_name=0, header=0):
+    with span('load_data') as record:
+        data = LazyDataset(path) if out_of_core else read_data(path, sheet_name, header)
+        set_size(record, data)
+    return data
+
+
+# Apply the SQLite WHERE clause typed by the user
+def filter_dataset(data, filter_text):
+    if filter_text.strip() == '':
+        return data
+    with span('filter') as record:
+        new_data = data.filtered(filter_text) if isinstance(data, LazyDataset) else filter_data(data, filter_text)
+        set_size(record, new_data)
+    return new_data
+
+
+# Categorical (few distinct values) and numeric columns of the dataset.
+# Large datasets use the distinct counts of their sketch, which are exact
+# for columns with few distinct values.
+def classify_columns(data, max_categories=MAX_CATEGORIES):
+    if isinstance(data, LazyDataset):
+        key = (data.key, data.filter_text, max_categories)
+    else:
+        key = (dataset_key(data), max_categories)
+    cached = _classification_cache.get(key)
+    if cached is not None:
+        return list(cached[0]), list(cached[1])
+
+    with span('classify_columns') as record:
+        set_size(record, data)
+        if isinstance(data, LazyDataset):
+            categorical_cols = [col for col, n in data.distinct_counts().items() if n <= max_categories]
+            numerical_cols = data.numeric_columns()
+        else:
+            if len(data) >= SKETCH_MIN_ROWS:
+                distinct_counts = dataset_sketch(data).distinct_counts()
+            else:
+                distinct_counts = {col: data[col].nunique() for col in data.columns}
+            categorical_cols = [col for col in data.columns if distinct_counts[col] <= max_categories]
+            numerical_cols = [col for col in data.select_dtypes(include=['float', 'int'])]
+    _classification_cache.put(key, (categorical_cols, numerical_cols))
+    return list(categorical_cols), list(numerical_cols)
+
+
+def clear_classification_cache():
+    _classification_cache.clear()
+
+
+# Experiments that can run on the given column classification
+def available_experiments(categorical_cols, numerical_cols):
+    experiments = []
+    if len(numerical_cols) >= 2:
+        experiments.append('paired')
+    if len(categorical_cols) >= 1 and len(numerical_cols) >= 1:
+        experiments.append('independent')
+    if len(categorical_cols) >= 2 and len(numerical_cols) >= 1:
+        experiments.append('two_way_anova')
+    if len(categorical_cols) >= 2:
+        experiments.append('categorical_association')
+    return experiments
+
+
+## ===============================================
+## Assumption checks
+## ===============================================
+
+def _normality_text(p_value_normality, colname):
+    if p_value_normality < ALPHA:
+        return f'- p-value for {colname}: {p_value_normality:.10f} >> Reject null hypothesis (The data is not normally distributed)'
+    return f'- p-value for {colname}: {p_value_normality:.10f} >> Fail to reject null hypothesis (The data is normally distributed)'
+
+
+def _variance_text(p_value_var):
+    if p_value_var < ALPHA:
+        return f'- p-value: {p_value_var:.10f} >> Reject null hypothesis (The variances of the samples are different)'
+    return f'- p-value: {p_value_var:.10f} >> Fail to reject null hypothesis (The variances of the samples are same)'
+
+
+def check_normality(data, colname):
+    with span('hypothesis_test.normality', rows=len(data)):
+        test_stat_normality, p_value_normality = stats.normaltest(data)
+    return p_value_normality, _normality_text(p_value_normality, colname)
+
+
+def check_variance_homogeneity(groups):
+    with span('hypothesis_test.levene', rows=sum(len(group) for group in groups)):
+        test_stat_var, p_value_var = stats.levene(*groups)
+    return p_value_var, _variance_text(p_value_var)
+
+
+def _assumption_results(normality, p_value_var):
+    variance = {'pvalue': p_value_var, 'text': _variance_text(p_value_var)}
+    is_parametric = all(check['pvalue'] > ALPHA for check in normality) and p_value_var > ALPHA
+    return normality, variance, is_parametric
+
+
+# Normality of each group and homogeneity of variance between them
+def check_assumptions(groups, colnames):
+    normality = []
+    for values, colname in zip(groups, colnames):
+        pvalue, text = check_normality(values, colname)
+        normality.append({'column': colname, 'pvalue': pvalue, 'text': text})
+    p_value_var, _ = check_variance_homogeneity(groups)
+    return _assumption_results(normality, p_value_var)
+
+
+# (group keys, values) chunks of the rows without missing values: the two
+# columns stacked for a paired test, or the values of var_2 keyed by var_1
+def _keyed_chunks(data, var_1, var_2, paired):
+    chunks = data.chunks(columns=[var_1, var_2]) if isinstance(data, LazyDataset) else [data[[var_1, var_2]]]
+    for chunk in chunks:
+        chunk = chunk.dropna()
+        if paired:
+            keys = np.repeat(np.array([var_1, var_2], dtype=object), len(chunk))
+            yield keys, np.concatenate([chunk[var_1].to_numpy(dtype='float64'), chunk[var_2].to_numpy(dtype='float64')])
+        else:
+            yield chunk[var_1].to_numpy(), chunk[var_2].to_numpy(dtype='float64')
+
+
+def _medians(data, var_1, var_2, paired):
+    if isinstance(data, LazyDataset):
+        return data.medians([var_1, var_2]) if paired else data.group_medians(var_1, var_2)
+    frame = data[[var_1, var_2]].dropna()
+    return frame.median() if paired else frame.groupby(var_1)[var_2].median()
+
+
+# The assumption checks on every row instead of the samples: one pass
+# accumulates the moments of each column/group for D'Agostino and Pearson's
+# test, and a second pass the deviations from the group medians for Levene's test.
+# Works in chunks for out-of-core datasets.
+def check_assumptions_full(data, var_1, var_2, paired):
+    with span('hypothesis_test.full_assumptions', rows=len(data)):
+        column_moments = moments.accumulate(_keyed_chunks(data, var_1, var_2, paired))
+        centers = _medians(data, var_1, var_2, paired)
+        deviations = moments.accumulate((keys, np.abs(values - centers.reindex(keys).to_numpy(dtype='float64')))
+                                        for keys, values in _keyed_chunks(data, var_1, var_2, paired))
+        _, p_values_normality = moments.normaltest(column_moments)
+        _, p_value_var = moments.levene(deviations)
+
+    normality = []
+    p_values_normality = dict(zip(column_moments.index, p_values_normality))
+    for key in ([var_1, var_2] if paired else column_moments.index):
+        p_value_normality = p_values_normality[key]
+        colname = key if paired else f'{var_2} ({key})'
+        normality.append({'column': colname, 'pvalue': p_value_normality,
+                          'text': _normality_text(p_value_normality, colname)})
+    return _assumption_results(normality, p_value_var)
+
+
+## ===============================================
+## Hypothesis tests
+## ===============================================
+
+# The columns of an analysis without the rows missing any of them. Out-of-core
+# datasets are left as they are: their sampling and aggregate queries skip nulls.
+def project(data, columns):
+    if isinstance(data, LazyDataset):
+        return data
+    with span('hypothesis_test.project', rows=len(data), cols=len(columns)):
+        return data[list(columns)].dropna()
+
+
+# Random sample of rows with no missing values in the two columns
+def sample_pairs(data, var_1, var_2, count, random_state=None):
+    with span('hypothesis_test.sample', rows=len(data)):
+        if isinstance(data, LazyDataset):
+            # Only the sampled rows of the two columns are fetched from the file
+            return data.sample([var_1, var_2], count)
+        sample = data.dropna(subset=[var_1, var_2], axis=0)
+        return sample.sample(n=count, random_state=random_state)
+
+
+# Values of a numeric column per group of a categorical column, up to count samples per group
+def sample_groups(data, var_1, var_2, count, random_state=None):
+    with span('hypothesis_test.sample', rows=len(data)):
+        if isinstance(data, LazyDataset):
+            # Only up to the requested samples per group are fetched from the file
+            data = data.group_sample([var_1], [var_1, var_2], count)
+        else:
+            data = data.dropna(subset=[var_1, var_2], axis=0)
+        groups = {}
+        for column_val, group in data.groupby(var_1):
+            groups[column_val] = group.sample(n=min(count, len(group)), random_state=random_state)[var_2].to_numpy()
+    return groups
+
+
+def _test_result(test, statistic, pvalue):
+    return {'test': test, 'test_name': TEST_NAMES[test], 'statistic': statistic, 'pvalue': pvalue,
+            'significant': pvalue < ALPHA}
+
+
+# Paired t-test when the assumptions hold, Wilcoxon Signed Rank test otherwise.
+# The assumptions are checked on the sample unless given (see check_assumptions_full).
+def paired_samples_test(sample, var_1, var_2, assumptions=None):
+    values = [sample[var_1].to_numpy(), sample[var_2].to_numpy()]
+    normality, variance, is_parametric = assumptions or check_assumptions(values, [var_1, var_2])
+    test = 'ttest_rel' if is_parametric else 'wilcoxon'
+    with span(f'hypothesis_test.{test}', rows=len(sample)):
+        statistic, pvalue = getattr(stats, test)(*values)  # alternative default two sided
+    result = {'experiment': 'paired', 'columns': [var_1, var_2], 'n': len(sample),
+              'normality': normality, 'variance': variance, 'is_parametric': is_parametric}
+    result.update(_test_result(test, statistic, pvalue))
+    return result
+
+
+# Pairwise Mann Whitney U tests with Bonferroni correction, labelled by group
+def posthoc_mannwhitney(value_groups, group_names, span_name='hypothesis_test.posthoc'):
+    with span(span_name, rows=sum(len(group) for group in value_groups)):
+        posthoc_df = sp.posthoc_mannwhitney(value_groups, p_adjust='bonferroni')
+    posthoc_df.columns = group_names
+    posthoc_df.index = group_names
+    return posthoc_df
+
+
+# Pairwise post-hoc tests of more than two groups (None for two groups)
+def independent_posthoc(groups):
+    group_names = list(groups.keys())
+    if len(group_names) == 2:
+        return None
+    return posthoc_mannwhitney([groups[column_val] for column_val in group_names], group_names)
+
+
+# t-test or Mann Whitney U test for two groups, one-way ANOVA or Kruskal-Wallis
+# test with pairwise post-hoc tests for more groups (unless posthoc is False)
+def independent_samples_test(groups, var_2, assumptions=None, posthoc=True):
+    group_names = list(groups.keys())
+    value_groups = [groups[column_val] for column_val in group_names]
+    normality, variance, is_parametric = assumptions or check_assumptions(value_groups, [var_2] * len(value_groups))
+    if len(group_names) == 2:
+        test = 'ttest_ind' if is_parametric else 'mannwhitneyu'
+    else:
+        test = 'f_oneway' if is_parametric else 'kruskal'
+    with span(f'hypothesis_test.{test}', rows=sum(len(group) for group in value_groups)):
+        statistic, pvalue = getattr(stats, test)(*value_groups)
+    result = {'experiment': 'independent', 'column': var_2, 'groups': {name: len(groups[name]) for name in group_names},
+              'normality': normality, 'variance': variance, 'is_parametric': is_parametric}
+    result.update(_test_result(test, statistic, pvalue))
+    result['posthoc'] = independent_posthoc(groups) if posthoc else None
+    return result
+
+
+## ===============================================
+## Two-way ANOVA
+## ===============================================
+
+# The three columns without missing values and the count of values per combination of groups.
+# Out-of-core datasets stay on disk: the counts are an aggregate query on the file.
+def prepare_two_way(data, var_1, var_2, var_3):
+    if isinstance(data, LazyDataset):
+        return data, data.group_aggregates([var_1, var_2], var_3)[[var_1, var_2, 'count']]
+    data = data.dropna(subset=[var_1, var_2, var_3], axis=0)
+    return data, data[[var_1, var_2]].value_counts().reset_index(name='count')
+
+
+# Sentences interpreting the p-values of the main and interaction effects
+def interpret_two_way(anova_df, var_1, var_2, var_3):
+    sentences = []
+    for row, var in [(0, var_1), (1, var_2)]:
+        pvalue = anova_df.iloc[row, 3]
+        if math.isnan(pvalue):
+            sentences.append(f'The p-value for {var} nor its significance can be determined.')
+        elif pvalue < ALPHA:
+            sentences.append(f'The p-value for {var} is {pvalue:.10f} (< 0.05) >> {var} has a statistically significant effect on {var_3}.')
+        else:
+            sentences.append(f'The p-value for {var} is {pvalue:.10f} (>= 0.05) >> {var} has no statistically significant effect on {var_3}.')
+
+    pvalue = anova_df.iloc[2, 3]
+    if math.isnan(pvalue):
+        sentences.append('The p-value for the interaction effect nor its significance can be determined.')
+    elif pvalue < ALPHA:
+        sentences.append(f'The p-value for the interaction effect is {pvalue:.10f} (< 0.05) >> There is a significant interaction effect between {var_1} and {var_2} on {var_3}.')
+    else:
+        sentences.append(f'The p-value for the interaction effect is {pvalue:.10f} (>= 0.05) >> There is no significant interaction effect between {var_1} and {var_2} on {var_3}.')
+    return sentences
+
+
+# Type II two-way ANOVA with interaction, and pairwise post-hoc tests per combination of groups.
+# The cell statistics of out-of-core datasets come from one aggregate query.
+def two_way_anova(data, groups_count, var_1, var_2, var_3, posthoc=True):
+    n = int(groups_count['count'].sum())
+    with span('two_way_anova.fit', rows=n, cols=3):
+        if isinstance(data, LazyDataset):
+            cells = cells_from_aggregates(data.group_aggregates([var_1, var_2], var_3), var_1, var_2)
+        else:
+            cells = cell_statistics(data, var_1, var_2, var_3)
+        anova_df = two_way_anova_table(cells, var_1, var_2)
+    return {'experiment': 'two_way_anova', 'columns': [var_1, var_2, var_3], 'n': n,
+            'groups_count': groups_count, 'anova': anova_df,
+            'interpretation': interpret_two_way(anova_df, var_1, var_2, var_3),
+            'posthoc': two_way_posthoc(data, groups_count, var_1, var_2, var_3) if posthoc else None}
+
+
+# Pairwise post-hoc tests between the combinations of groups, on samples of
+# up to TWO_WAY_POSTHOC_SAMPLES rows per combination for out-of-core datasets
+def two_way_posthoc(data, groups_count, var_1, var_2, var_3):
+    if isinstance(data, LazyDataset):
+        data = data.group_sample([var_1, var_2], [var_1, var_2, var_3], TWO_WAY_POSTHOC_SAMPLES)
+    value_groups = []
+    group_names = []
+    for _, row in groups_count.iterrows():
+        group_names.append(f'{row[var_1]}, {row[var_2]}')
+        value_groups.append(data[(data[var_1] == row[var_1]) & (data[var_2] == row[var_2])][var_3].to_numpy())
+    return posthoc_mannwhitney(value_groups, group_names, 'two_way_anova.posthoc')
+
+
+## ===============================================
+## Categorical association
+## ===============================================
+
+# Contingency tables of every pair of the categorical columns, cached per (filtered) dataset and pair
+def contingency_tables(data, columns):
+    with span('hypothesis_test.contingency') as record:
+        set_size(record, data)
+        return contingency.pair_tables(data, columns)
+
+
+# Chi-square or Fisher's exact test and Cramer's V of every pair, with p-values
+# corrected for the number of pairs (see contingency.CORRECTIONS)
+def categorical_association(tables, correction='Holm'):
+    with span('hypothesis_test.association'):
+        tests = contingency.association_tests(tables, correction, ALPHA)
+    result = {'experiment': 'categorical_association', 'columns': list(tests['cramers_v'].columns)}
+    result.update(tests)
+    return result
+
+
+## ===============================================
+## Profiling and AutoML
+## ===============================================
+
+# The report is computed lazily, when it is rendered or saved
+def profile_report(data, **kwargs):
+    from ydata_profiling import ProfileReport
+    return ProfileReport(data, orange_mode=True, explorative=True, sample=None, **kwargs)
+
+
+# Profile report rendered to HTML with the settings of st_profile_report, so it
+# can be computed in a worker process and displayed in the app
+def profile_html(data, navbar=True):
+    report = profile_report(data, progress_bar=False)
+    report.config.html.inline = True
+    report.config.html.minify_html = True
+    report.config.html.use_local_assets = True
+    report.config.html.navbar_show = navbar
+    report.config.html.full_width = True
+    return report.to_html()
+
+
+# Stand-in for a ProfileReport whose HTML was already rendered (see profile_html)
+class RenderedProfile:
+    def __init__(self, html):
+        self.html = html
+
+    def set_variable(self, key, value):
+        pass
+
+    def to_html(self):
+        return self.html
+
+
+# Approximate summary of every column from the dataset's sketch
+def sketch_summary(data):
+    with span('profiling.sketch') as record:
+        set_size(record, data)
+        sketch = dataset_sketch(data)
+    return sketch, sketch.summary()
+
+
+# Pearson, Spearman, Cramer's V and eta matrices, cached per (filtered) dataset
+def relationship_matrices(data):
+    with span('profiling.relationships') as record:
+        set_size(record, data)
+        return relationships.relationships(data)
+
+
+# Exact duplicate rows and near-duplicates of the text columns, cached per (filtered) dataset
+def duplicate_report(data, text_columns=(), threshold=duplicates.THRESHOLD):
+    with span('profiling.duplicates') as record:
+        set_size(record, data)
+        return duplicates.duplicates(data, text_columns, threshold)
+
+
+# The most repeated rows with their number of copies
+def duplicate_rows(data, report, limit=20):
+    if isinstance(data, LazyDataset):
+        return data.duplicate_rows(limit)
+    groups = report.exact_groups(limit)
+    rows = data.iloc[groups['first_row']].reset_index(drop=True)
+    rows['copies'] = groups['count'].to_numpy()
+    return rows
+
+
+# The dataset without the rows repeating an earlier row: exact duplicates over
+# every column, or near-duplicates of the text of the given columns
+def exclude_duplicates(data, text_columns=(), threshold=duplicates.THRESHOLD):
+    report = duplicate_report(data, text_columns, threshold)
+    rows = np.flatnonzero(~(report.near if text_columns else report.exact))
+    if len(rows) == len(data):
+        return data
+    new_data = data.take(rows).reset_index(drop=True)
+    digest = hashlib.blake2b(dataset_key(data).encode(), digest_size=16)
+    digest.update(rows.tobytes())
+    set_dataset_key(new_data, digest.hexdigest())
+    detect_date_columns(new_data)
+    return new_data
+
+
+# Compute the profile report and save it as an HTML file
+def save_profile(data, path):
+    with span('profiling') as record:
+        set_size(record, data)
+        profile_report(data, progress_bar=False).to_file(path)
+
+
+# Path of the model file of a training job, named after the job key: sessions
+# training other datasets or settings never overwrite it, and a session
+# asking for the same job finds the model (and its explanations) again
+def model_path(name, key):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    return os.path.join(MODEL_DIR, f'{name}-{digest}.pkl')
+
+
+# Experiment types available for AutoML on the dataset
+def automl_experiments(data):
+    categorical_cols, numerical_cols = classify_columns(data)
+    experiments = []
+    if categorical_cols:    experiments.append('Classification')
+    if numerical_cols:      experiments.append('Regression')
+    return experiments
+
+
+# Train and compare PyCaret models, optionally tune the best one within a time
+# budget (in seconds), and save it to model_path
+def train_automl(data, target, experiment, model_path='best_model.pkl', tune=False, time_budget=tuning.TIME_BUDGET):
+    if experiment == 'Classification':
+        from pycaret.classification import ClassificationExperiment
+        exp = ClassificationExperiment()
+    else:
+        from pycaret.regression import RegressionExperiment
+        exp = RegressionExperiment()
+
+    with span('automl.setup') as record:
+        set_size(record, data)
+        exp.setup(data, target=target)
+    setup_df = exp.pull()
+    with span('automl.compare_models'):
+        best_model = exp.compare_models()
+    compare_df = exp.pull()
+
+    result = {'setup': setup_df, 'comparison': compare_df}
+    if tune:
+        with span('automl.tune'):
+            tuned = tuning.tune(exp, best_model, experiment, f'{dataset_key(data)}-{target}', time_budget)
+        # The tuned model replaces the compared one only when its cross-validated score is better
+        metric, _ = tuning.METRICS[experiment]
+        tuned['improved'] = tuned['params'] is not None and tuned['score'] > compare_df[metric].iloc[0]
+        if tuned['improved']:
+            with span('automl.create_model'):
+                best_model = exp.create_model(tuned['model_id'], **tuned['params'])
+            tuned['scores'] = exp.pull()
+        result['tuning'] = tuned
+
+    with span('automl.save_model'):
+        exp.save_model(best_model, model_path.removesuffix('.pkl'))
+    result.update({'model': best_model, 'model_path': model_path})
+    return result
+
+
+# Approximate feature importance of the model saved at model_path (TreeSHAP or
+# permutation importance on samples), saved next to it and reused (see explanations)
+def explain_model(data, target, experiment, model_path='best_model.pkl'):
+    with span('automl.explain') as record:
+        set_size(record, data)
+        return explanations.explain_model(data, target, experiment, model_path)
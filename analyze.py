@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
+import pandas as pd
+import analysis_engine as engine
+from job_scheduler import BATCH, JobRejected, JobScheduler, default_memory_ceiling
+from readers import READ_MEMORY_FACTOR
+from instrumentation import start_run
+
+# Batch runs of the analysis engine without the Streamlit UI.
+# Every file is loaded, filtered and run through the requested hypothesis
+# tests (and optionally profiled) as a batch job of the job scheduler, so
+# files whose memory estimate does not fit under the ceiling wait for
+# running jobs or are refused; one JSON line per file is written with the
+# results.
+#
+#   python analyze.py data/*.csv --filter "year >= 2015" \
+#       --test independent:fuelType:price --test two_way_anova:fuelType:transmission:price \
+#       --test association:fuelType:transmission:model \
+#       --profile-dir profiles --workers 8 --output results.jsonl
+
+# Columns expected by each test, in the order given on the command line;
+# association tests every pair of 2 or more categorical columns
+TEST_COLUMNS = {'paired': ['interval/ratio column 1', 'interval/ratio column 2'],
+                'independent': ['categorical column', 'interval/ratio column'],
+                'two_way_anova': ['categorical column 1', 'categorical column 2', 'interval/ratio column'],
+                'association': ['categorical column 1', 'categorical column 2']}
+
+
+# Parse KIND:COLUMN[:COLUMN...] test specifications
+def parse_test(spec):
+    kind, *columns = spec.split(':')
+    if kind not in TEST_COLUMNS:
+        raise argparse.ArgumentTypeError(f'Unknown test {kind!r}, expected one of {", ".join(TEST_COLUMNS)}')
+    if len(columns) != len(TEST_COLUMNS[kind]) and not (kind == 'association' and len(columns) > 2):
+        raise argparse.ArgumentTypeError(f'{kind} expects {len(TEST_COLUMNS[kind])} columns: {", ".join(TEST_COLUMNS[kind])}')
+    return kind, columns
+
+
+def run_test(data, kind, columns, samples, seed, full_assumptions=False):
+    if kind == 'paired':
+        var_1, var_2 = columns
+        if var_1 == var_2:
+            raise ValueError('The two interval/ratio columns must be different.')
+        sample = engine.sample_pairs(data, var_1, var_2, min(samples, len(data)), random_state=seed)
+        assumptions = engine.check_assumptions_full(data, var_1, var_2, paired=True) if full_assumptions else None
+        return engine.paired_samples_test(sample, var_1, var_2, assumptions)
+    if kind == 'independent':
+        var_1, var_2 = columns
+        groups = engine.sample_groups(data, var_1, var_2, samples, random_state=seed)
+        assumptions = engine.check_assumptions_full(data, var_1, var_2, paired=False) if full_assumptions else None
+        return engine.independent_samples_test(groups, var_2, assumptions)
+    if kind == 'association':
+        if len(set(columns)) < len(columns):
+            raise ValueError('The categorical columns must be different.')
+        return engine.categorical_association(engine.contingency_tables(data, columns))
+    var_1, var_2, var_3 = columns
+    if var_1 == var_2:
+        raise ValueError('The two categorical columns must be different.')
+    anova_data, groups_count = engine.prepare_two_way(data, var_1, var_2, var_3)
+    return engine.two_way_anova(anova_data, groups_count, var_1, var_2, var_3)
+
+
+# Load, filter, test and profile one file; errors are reported in the result
+def analyze_file(path, settings):
+    run = start_run()
+    result = {'file': path, 'tests': []}
+    try:
+        data = engine.open_dataset(path, settings['out_of_core'], settings['sheet'], settings['header'])
+        new_data = engine.filter_dataset(data, settings['filter'])
+        result['rows'], result['filtered_rows'] = len(data), len(new_data)
+        categorical_cols, numerical_cols = engine.classify_columns(new_data)
+        result['categorical_columns'], result['numerical_columns'] = categorical_cols, numerical_cols
+
+        for kind, columns in settings['tests']:
+            try:
+                result['tests'].append(run_test(new_data, kind, columns, settings['samples'], settings['seed'],
+                                                settings['full_assumptions']))
+            except Exception as e:
+                result['tests'].append({'experiment': kind, 'columns': columns, 'error': f'{type(e).__name__}: {e}'})
+
+        if settings['profile_dir']:
+            if not isinstance(new_data, pd.DataFrame):
+                new_data = new_data.materialize(limit=settings['profile_max_rows'])
+            profile_path = os.path.join(settings['profile_dir'], os.path.splitext(os.path.basename(path))[0] + '.html')
+            engine.save_profile(new_data, profile_path)
+            result['profile'] = profile_path
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['spans'] = run.spans
+    return jsonable(result)
+
+
+# Convert results to JSON-compatible values; DataFrames use the split layout
+def jsonable(value):
+    if isinstance(value, pd.DataFrame):
+        value = value.astype(object).where(value.notna(), None)
+        return {'columns': [jsonable(col) for col in value.columns], 'index': [jsonable(i) for i in value.index],
+                'data': jsonable(value.values.tolist())}
+    if isinstance(value, dict):
+        return {str(jsonable(key)): jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run Data Express analyses over many files without the Streamlit UI.')
+    parser.add_argument('files', nargs='+', help='csv, compressed csv, xlsx, parquet, feather/arrow or jsonl files (csv or parquet with --out-of-core)')
+    parser.add_argument('--filter', default='', help='SQLite WHERE clause applied to every file')
+    parser.add_argument('--test', dest='tests', type=parse_test, action='append', default=[],
+                        help='KIND:COLUMN[:COLUMN...] with KIND one of ' + ', '.join(TEST_COLUMNS) + '; repeatable')
+    parser.add_argument('--samples', type=int, default=100, help='Samples (per group), as in the app')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--full-assumptions', action='store_true',
+                        help='Check normality and homogeneity of variance on all rows instead of the samples')
+    parser.add_argument('--profile-dir', default=None, help='Write an HTML profile report per file to this directory')
+    parser.add_argument('--profile-max-rows', type=int, default=100_000,
+                        help='Rows sampled for the profile in out-of-core mode')
+    parser.add_argument('--out-of-core', action='store_true', help='Query the files from disk with DuckDB')
+    parser.add_argument('--sheet', default=0, help='Sheet name of xlsx files')
+    parser.add_argument('--header', type=int, default=0, help='Header row of xlsx files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='-', help='JSON lines output file, - for stdout')
+    args = parser.parse_args(argv)
+
+    if args.profile_dir:
+        os.makedirs(args.profile_dir, exist_ok=True)
+    settings = {key: getattr(args, key) for key in ['filter', 'tests', 'samples', 'seed', 'full_assumptions', 'profile_dir',
+                                                    'profile_max_rows', 'out_of_core', 'sheet', 'header']}
+
+    # Every worker may run a job, the files are read in memory unless out-of-core
+    scheduler = JobScheduler(max_workers=args.workers, jobs_per_user=args.workers, memory_ceiling=default_memory_ceiling())
+    jobs = []
+    for path in args.files:
+        try:
+            memory = 0 if args.out_of_core else os.path.getsize(path) * READ_MEMORY_FACTOR
+            jobs.append(scheduler.submit(analyze_file, path, settings, priority=BATCH, memory=memory))
+        except (JobRejected, OSError) as e:
+            jobs.append({'file': path, 'tests': [], 'error': f'{type(e).__name__}: {e}'})
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    failed = 0
+    try:
+        for path, job in zip(args.files, jobs):
+            if isinstance(job, dict):
+                result = job
+            else:
+                job.wait()
+                result = job.result if job.error is None else \
+                    {'file': path, 'tests': [], 'error': f'{type(job.error).__name__}: {job.error}'}
+            failed += 'error' in result
+            print(f'{result["file"]}: {result.get("error", "ok")}', file=sys.stderr)
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Two-way factorial ANOVA with interaction from grouped cell statistics.
+# The sums of squares only depend on the count, mean and within-cell sum of
+# squares of each combination of groups, so they are computed from one
+# groupby instead of fitting an OLS model with a dense design matrix.
+# Results match sm.stats.anova_lm(ols(...).fit(), typ=2), including for
+# unbalanced designs, and column names need not be valid formula terms.
+
+
+# Count, mean and within-cell sum of squares per combination of groups
+def cell_statistics(data, var_1, var_2, var_3):
+    data = data[[var_1, var_2, var_3]].dropna()
+    cells = data.groupby([var_1, var_2], observed=True, sort=True)[var_3].agg(['count', 'mean', 'var'])
+    cells['ss'] = (cells['count'] - 1) * cells['var'].fillna(0)
+    return cells[['count', 'mean', 'ss']].reset_index()
+
+
+# Cell statistics from per-group count, mean and sample standard deviation
+# (e.g. the aggregates of an out-of-core dataset)
+def cells_from_aggregates(aggregates, var_1, var_2):
+    cells = aggregates[[var_1, var_2, 'count', 'mean']].copy()
+    cells['ss'] = (cells['count'] - 1) * aggregates['std'].fillna(0) ** 2
+    return cells.sort_values([var_1, var_2]).reset_index(drop=True)
+
+
+# Weighted residual sum of squares of the cell means around a model with the
+# given indicator columns, and the rank of the model
+def _fit(design, means, weights):
+    root = np.sqrt(weights)
+    coefs, _, rank, _ = np.linalg.lstsq(design * root[:, None], means * root, rcond=None)
+    residuals = means - design @ coefs
+    return float(np.sum(weights * residuals ** 2)), int(rank)
+
+
+# Type II ANOVA table with the same layout as anova_lm(typ=2):
+# rows C(var_1), C(var_2), C(var_1):C(var_2), Residual and columns sum_sq, df, F, PR(>F)
+def two_way_anova_table(cells, var_1, var_2):
+    cells = cells[cells['count'] > 0]
+    counts = cells['count'].to_numpy(dtype='float64')
+    means = cells['mean'].to_numpy(dtype='float64')
+    codes_1, _ = pd.factorize(cells[var_1], sort=True)
+    codes_2, _ = pd.factorize(cells[var_2], sort=True)
+
+    # Indicator columns of each factor level, one row per non-empty cell
+    intercept = np.ones((len(cells), 1))
+    levels_1 = np.eye(codes_1.max() + 1)[codes_1][:, 1:]
+    levels_2 = np.eye(codes_2.max() + 1)[codes_2][:, 1:]
+
+    # Residual of the full model is the pooled within-cell sum of squares
+    ss_within = float(cells['ss'].sum())
+    df_resid = counts.sum() - len(cells)
+    rss_1, rank_1 = _fit(np.hstack([intercept, levels_1]), means, counts)
+    rss_2, rank_2 = _fit(np.hstack([intercept, levels_2]), means, counts)
+    rss_12, rank_12 = _fit(np.hstack([intercept, levels_1, levels_2]), means, counts)
+
+    sum_sq = [rss_2 - rss_12, rss_1 - rss_12, rss_12, ss_within]
+    df = [rank_12 - rank_2, rank_12 - rank_1, len(cells) - rank_12, df_resid]
+    table = pd.DataFrame({'sum_sq': sum_sq, 'df': np.array(df, dtype='float64')},
+                         index=[f'C({var_1})', f'C({var_2})', f'C({var_1}):C({var_2})', 'Residual'])
+    mean_sq_resid = ss_within / df_resid if df_resid > 0 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_values = (table['sum_sq'] / table['df']) / mean_sq_resid
+    table['F'] = f_values.where(table['df'] > 0)
+    table['PR(>F)'] = stats.f.sf(table['F'], table['df'], df_resid)
+    table.loc['Residual', ['F', 'PR(>F)']] = np.nan
+    return table
@@ -1,19 +1,24 @@
+import os
 import sys
 import streamlit as st
 import pandas as pd
-from pandasql import sqldf
+from table_preview import PAGE_SIZES, column_summary, view_rows, page, page_count
+from out_of_core import LazyDataset, spill_upload
+from readers import UPLOAD_TYPES, PARALLEL_MIN_BYTES, READ_MEMORY_FACTOR, read_part, part_size
+from instrumentation import SECTIONS, span, set_size, start_run, run_table, spans_json, prometheus_text, profile_outputs, write_metrics_file, merge_job
+import analysis_engine as engine
+from sketches import SKETCH_MIN_ROWS, dataset_sketch
+from job_scheduler import INTERACTIVE, BATCH, JobRejected, get_scheduler, estimate_memory
+from warmup import PROFILE_MEMORY_FACTOR, profile_source, start_warm_up
+from analysis_dag import AnalysisDAG
+import data_sources
+from export import EXPORT_FORMATS, DOWNLOAD_MAX_MB, export_file, export_name, downloadable
+import incremental_ml
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import numpy as np
 from streamlit_ydata_profiling import st_profile_report
-from ydata_profiling import ProfileReport
 import openpyxl
 from pygwalker.api.streamlit import StreamlitRenderer
-from scipy import stats
-import scikit_posthocs as sp
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
-import math
-from pycaret.classification import ClassificationExperiment
-from pycaret.regression import RegressionExperiment
 
 # Setting up web app page
 st.set_page_config(page_title='Exploratory Data Analysis App', page_icon=None, layout="wide")
@@ -29,23 +34,136 @@ def load_data(file_path,sh,h):
     if file_path and file_path.name.endswith('.xlsx'):
         try:
             #Reading the excel file
-            data = pd.read_excel(file_path,header=h,sheet_name=sh,engine='openpyxl')
+            data = engine.read_data(file_path, sheet_name=sh, header=h)
         except:
             st.info("File is not recognised as an Excel file.")
             sys.exit()
 
-    elif file_path and file_path.name.endswith('.csv'):
+    elif file_path:
         try:
-            #Reading the csv file
-            data = pd.read_csv(file_path)
+            #Reading the csv, compressed csv, Parquet, Feather/Arrow or JSON Lines file
+            data = engine.read_data(file_path)
         except:
-            st.info("File is not recognised as a csv file.")
+            st.info("File could not be read. Please ensure that its extension matches its format.")
             sys.exit()
     else:
-        data = pd.read_csv('students.csv')
-    
+        data = engine.read_data('students.csv')
+
+    # Sketch large datasets in the same pass so profiling and column classification can use it
+    if len(data) >= SKETCH_MIN_ROWS:
+        dataset_sketch(data)
     return data
 
+# Caching function to combine several files, or several sheets of a workbook, into one dataset
+@st.cache_data(experimental_allow_widgets=True)
+def load_combined(files, sheets, h):
+    try:
+        # Large inputs are parsed in parallel jobs of the shared worker pool
+        data = engine.read_datasets(files, sheet_names=sheets, header=h or 0, read_parts=read_parts)
+    except:
+        st.info("The files could not be read and combined. Please ensure that their extensions match their formats.")
+        sys.exit()
+
+    if len(data) >= SKETCH_MIN_ROWS:
+        dataset_sketch(data)
+    return data
+
+# Caching function to open a file on disk in out-of-core mode
+@st.cache_resource
+def load_lazy_data(path, modified_time):
+    return LazyDataset(path)
+
+# Rows materialized from out-of-core datasets for views that need the data in memory
+OUT_OF_CORE_SAMPLE_ROWS = 100000
+
+# Run a heavy job in the shared worker pool and wait for it, showing its place in the queue.
+# Returns None if the job was refused or failed.
+def run_job(label, fn, *args, priority=INTERACTIVE, memory=0, key=None):
+    results = run_jobs(label, [(fn, args, memory, key)], priority=priority)
+    return None if results is None else results[0]
+
+# Run several jobs given as (fn, args, memory, key) and wait for all of them.
+# Returns their results in order, or None if a job was refused or failed.
+def run_jobs(label, jobs, priority=INTERACTIVE):
+    ctx = get_script_run_ctx()
+    scheduler = get_scheduler()
+    try:
+        submitted = [scheduler.submit(fn, *args, user=ctx.session_id if ctx else None, priority=priority,
+                                      memory=memory, key=key) for fn, args, memory, key in jobs]
+    except JobRejected as e:
+        st.info(f"{label} was not started: {e} Try filtering the dataset first.")
+        return None
+    # Results finished before this rerun were timed when they ran
+    ran_here = [not job.done for job in submitted]
+
+    status = st.empty()
+    while not all(job.wait(0.5) for job in submitted):
+        positions = [scheduler.position(job) for job in submitted if not job.done]
+        if positions and all(positions):
+            status.info(f"{label} is queued at position {min(positions)}. It will start when a worker is free.")
+        else:
+            status.info(f"{label} is running...")
+    status.empty()
+    for job in submitted:
+        if job.error is not None:
+            st.info(f"{label} failed: {job.error}")
+            return None
+    for job, ran in zip(submitted, ran_here):
+        if ran:
+            merge_job(job.spans, job.profile_stats)
+    return [job.result for job in submitted]
+
+# Parts of a combined dataset, parsed in jobs of the shared worker pool when they add up to a large input
+def read_parts(parts):
+    if len(parts) == 1 or sum(part_size(part) for part in parts) < PARALLEL_MIN_BYTES:
+        return [read_part(*part) for part in parts]
+    frames = run_jobs("Reading the files", [(read_part, part, part_size(part) * READ_MEMORY_FACTOR, None) for part in parts])
+    if frames is None:
+        raise RuntimeError("The files could not be read.")
+    return frames
+
+# Download buttons of a result table in every export format, written in chunks to export files.
+# Buttons rather than a format selector, which would rerun the script and hide the results.
+def export_table(table, name, key, index=True):
+    for col, fmt in zip(st.columns(len(EXPORT_FORMATS) + 2), EXPORT_FORMATS):
+        with col:
+            with open(export_file(table, fmt, name, index=index), 'rb') as f:
+                st.download_button(f"Download {fmt}", f, export_name(name, fmt), EXPORT_FORMATS[fmt][1], key=f'{key}_{fmt}')
+
+# Explanations of a trained model run as a batch job in the background, shared by the sessions
+# through the job key; the session keeps the job to show its state until the result is saved
+def submit_explanations(data, target, experiment, model_path):
+    ctx = get_script_run_ctx()
+    try:
+        st.session_state['explanation_job'] = get_scheduler().submit(
+            engine.explain_model, data, target, experiment, model_path, user=ctx.session_id if ctx else None,
+            priority=BATCH, memory=estimate_memory(data, 4), key=('explain', engine.explanations.model_digest(model_path)))
+    except JobRejected as e:
+        st.info(f"The model explanations were not started: {e}")
+
+# Feature importance saved next to the model file, or the state of the job computing it
+def show_explanations(model_path):
+    explanations = engine.explanations.cached_explanations(model_path)
+    job = st.session_state.get('explanation_job')
+    if explanations is None and (job is None or job.done and job.error is None):
+        return
+    st.markdown('##### Feature importance of the best model')
+    if explanations is None:
+        if job.done:
+            st.info(f"The model explanations failed: {job.error}")
+        else:
+            st.info("The model explanations are being computed in the background.")
+            st.button("Refresh explanations")
+        return
+    background = f" against a background sample of {explanations['background_rows']} rows" if explanations['background_rows'] else ''
+    st.write(f"{explanations['method']} of the {explanations['model']} model predicting {explanations['target']}, \
+             measured on {explanations['rows']} sampled rows{background} ({explanations['seconds']:.1f} s). \
+             Features are the columns after preprocessing, e.g. one column per level of a categorical column.")
+    table = explanations['importance']
+    st.dataframe(table, hide_index=True, column_config={'importance': st.column_config.ProgressColumn(
+        min_value=0.0, max_value=max(float(table['importance'].max()), 1e-12), format='%.4f')})
+    export_table(table, 'feature_importance', 'importance', index=False)
+
 # Dialog for SQL filter help
 @st.experimental_dialog("Filter help", width="large")
 def open_help_dialog():
@@ -62,25 +180,82 @@ def open_help_dialog():
         - `LIKE '%text%'`: Searches string values containg the text. Surround the text with `%` characters then with `'` characters.
         - `column IN (value1, value2 [, value3, ...])`: Filters values in a `column` that are in the list of values (at least two) separated by commas inside the parenthesis `()`. 
         - Dates are in the form `YYYY-MM-DD` or `YYYY-MM-DD HH:MM:SS` to match the ISO 8601 Standard.
-        - `strftime('%Y', datetime)` extracts and returns the year of the date. Replacing `%Y` with `%m`, `%d`, `%w` extracts 
-            the month, day, and day of week (0-Sunday to 6-Saturday) part of the date.
+        - `strftime('%Y', datetime)` extracts and returns the year of the date as text. Replacing `%Y` with `%m`, `%d`, `%w` extracts 
+            the month, day, and day of week (0-Sunday to 6-Saturday) part of the date. Compare it with zero-padded text such as `'2024'` or `'03'`.
+            In out-of-core mode, `strftime` takes only these two arguments (no modifiers such as `'start of month'`).
                 
-        Example: `` score BETWEEN 50 AND 100 AND name = 'Wayne' AND strftime('%Y', `start date`) = 2024 ``: Filters for records 
+        Example: `` score BETWEEN 50 AND 100 AND name = 'Wayne' AND strftime('%Y', `start date`) = '2024' ``: Filters for records 
             with `score` from 50 to 100, `name` of 'Wayne' and `start date` with the year 2024.
     ''')
 
 
-# Creating dynamic file upload option in sidebar
-uploaded_file = st.sidebar.file_uploader("*Upload file*", type=['csv', 'xlsx'])
+# Creating dynamic file upload option in sidebar; several files are combined into one dataset
+uploaded_files = st.sidebar.file_uploader("*Upload file(s)*", type=UPLOAD_TYPES, accept_multiple_files=True,
+                                          help="CSV (also .csv.gz, .csv.bz2, .csv.zst), Excel, Parquet, Feather/Arrow IPC or JSON Lines. \
+                                          Several files are combined into one dataset with a source column.")
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+combined_files = uploaded_files if len(uploaded_files) > 1 else []
+sheets = None
 
 # Creating option to use sample dataset
 sample_checked = st.sidebar.checkbox("Load sample dataset")
 
+# Creating option to query large CSV/Parquet files from disk instead of loading them into memory
+out_of_core = st.sidebar.checkbox("Out-of-core mode (large CSV/Parquet files)")
+large_file_path = st.sidebar.text_input("*Local file path (optional):*") if out_of_core else ''
+
+# Creating option to follow a folder of new files or a SQLite table, ingesting only the new rows on refresh
+source_config = None
+if st.sidebar.checkbox("Incrementally refreshed source (folder or SQLite table)"):
+    source_kind = st.sidebar.radio("*Source type:*", ["Watched folder", "SQLite table"], horizontal=True)
+    if source_kind == "Watched folder":
+        folder_path = st.sidebar.text_input("*Folder path:*")
+        if folder_path != '':
+            if not os.path.isdir(folder_path):
+                st.info("The folder does not exist.")
+                sys.exit()
+            source_config = ('folder', folder_path)
+    else:
+        database_path = st.sidebar.text_input("*SQLite database path:*")
+        if database_path != '':
+            try:
+                tables = data_sources.sqlite_tables(database_path)
+            except:
+                st.info("The file could not be opened as a SQLite database.")
+                sys.exit()
+            table = st.sidebar.selectbox("*Table:*", tables)
+            key_column = st.sidebar.text_input("*Increasing key column (default: rowid):*")
+            if table is not None:
+                source_config = ('sqlite', database_path, table, key_column)
+
+# Creating option to precompute summaries, indexes and the profile in the background after loading
+warm_up = st.sidebar.checkbox("Warm up caches in the background")
+
+# Creating option to show timings of each stage and profile a section with cProfile
+show_performance = st.sidebar.checkbox("Show performance panel")
+profile_section = st.sidebar.selectbox("*Profile section with cProfile:*", ['(none)'] + SECTIONS) if show_performance else '(none)'
+start_run(None if profile_section == '(none)' else profile_section)
+
+# Memoized analysis pipeline of this rerun, reporting the stages taken from the cache
+pipeline = AnalysisDAG()
+
 
-if uploaded_file is not None or sample_checked:
+if uploaded_file is not None or combined_files or sample_checked or large_file_path != '' or source_config is not None:
 
-    if sample_checked:
+    if sample_checked or source_config is not None:
         uploaded_file = None
+        combined_files = []
+        file_path = None
+        sh = None
+        h = None
+
+    elif combined_files:
+        file_path = None
+        sh = None
+        h = None
+
+    elif uploaded_file is None:
+        # Out-of-core mode with a local file path only
         file_path = None
         sh = None
         h = None
@@ -89,15 +264,22 @@ if uploaded_file is not None or sample_checked:
         try:
             file_path = uploaded_file
             sample_checked = False
-            # User prompt to select sheet name in uploaded Excel
-            sh = st.sidebar.selectbox("*Select sheet name:*",pd.ExcelFile(file_path).sheet_names)
+            # User prompt to select sheet names in uploaded Excel; several sheets are combined into one dataset
+            sheet_names = pd.ExcelFile(file_path).sheet_names
+            sheets = st.sidebar.multiselect("*Select sheet names:*", sheet_names, default=sheet_names[:1])
             # User prompt to define row with column names if they aren't in the header row in the uploaded Excel
             h = st.sidebar.number_input("*Select row number for header names:*",0,10)
         except:
             st.info("File is not recognised as an Excel file")
             sys.exit()
+        if len(sheets) == 0:
+            st.info("Select at least one sheet.")
+            sys.exit()
+        sh = sheets[0]
+        if len(sheets) > 1:
+            combined_files = [uploaded_file]
     
-    elif uploaded_file.name.endswith('.csv'):
+    else:
         try:
             file_path = uploaded_file
             sample_checked = False
@@ -107,7 +289,75 @@ if uploaded_file is not None or sample_checked:
             st.info("File is not recognised as a csv file.")
             sys.exit()
 
-    data = load_data(file_path,sh,h)
+    if out_of_core and combined_files:
+        st.sidebar.caption("Several files or sheets are combined in memory, out-of-core mode only opens single files.")
+        out_of_core = False
+
+    if source_config is not None and not sample_checked:
+        # New files or rows are appended to the source's columnar store, at most every few seconds
+        source = data_sources.get_source(source_config)
+        try:
+            refreshed = source.refresh(force=st.sidebar.button("Refresh now"))
+            with span('load_data') as record:
+                data = data_sources.open_store(source) if out_of_core else data_sources.load_frame(source)
+                set_size(record, data)
+        except Exception as e:
+            st.info(f"The source could not be read: {e}")
+            sys.exit()
+        if refreshed['rows'] or refreshed['rejected']:
+            st.session_state['source_refresh'] = (source.id, refreshed)
+        refresh_id, refreshed = st.session_state.get('source_refresh', (None, None))
+        if refresh_id == source.id:
+            st.sidebar.caption(f"Last refresh: {refreshed['rows']} new rows"
+                               + (f" from {', '.join(refreshed['files'])}" if refreshed['files'] else "")
+                               + f" in {refreshed['seconds']:.2f} s.")
+            for label, reason in refreshed['rejected'].items():
+                st.sidebar.caption(f"{label} was skipped: {reason}.")
+        st.sidebar.caption(f"{source.state['rows']} rows in the source's store.")
+    elif out_of_core:
+        try:
+            # The file stays on disk; uploads are written to a spill file first
+            if large_file_path != '':
+                path = large_file_path
+            elif sample_checked:
+                path = 'students.csv'
+            else:
+                path = spill_upload(uploaded_file)
+            with span('load_data') as record:
+                data = load_lazy_data(path, os.path.getmtime(path))
+                set_size(record, data)
+        except:
+            st.info("File could not be opened in out-of-core mode. Only csv (optionally .gz or .zst compressed) and parquet files are supported.")
+            sys.exit()
+    else:
+        with span('load_data') as record:
+            if combined_files:
+                data = load_combined(combined_files, sheets, h)
+            else:
+                data = load_data(file_path,sh,h)
+            set_size(record, data)
+
+    # Creating option to exclude duplicate rows from every section
+    duplicate_modes = ["Keep duplicate rows", "Exclude exact duplicates", "Exclude near-duplicates of text columns"]
+    duplicate_mode = st.sidebar.selectbox("*Duplicate rows:*", duplicate_modes)
+    if duplicate_mode != duplicate_modes[0]:
+        if out_of_core:
+            st.sidebar.caption("Duplicate rows can only be excluded from datasets loaded in memory.")
+        else:
+            text_columns = []
+            if duplicate_mode == duplicate_modes[2]:
+                text_columns = st.sidebar.multiselect("*Text columns compared:*", engine.duplicates.text_columns(data))
+            if duplicate_mode == duplicate_modes[1] or text_columns:
+                rows_before = len(data)
+                data = engine.exclude_duplicates(data, text_columns)
+                st.sidebar.caption(f"{rows_before - len(data)} duplicate rows excluded.")
+
+    # Precompute what the sections need while the user looks around
+    if warm_up:
+        ctx = get_script_run_ctx()
+        warmup = start_warm_up(data, OUT_OF_CORE_SAMPLE_ROWS, user=ctx.session_id if ctx else None)
+        done, total = warmup.progress()
+        st.sidebar.caption(f"Warm-up: {done}/{total} steps done" + ("" if warmup.done else "..."))
 
     # Select which section to show
     selected = st.sidebar.radio( "****MENU****", 
@@ -133,7 +383,7 @@ if uploaded_file is not None or sample_checked:
             # Logic for filter text
             if filter_text != '':
                 try:
-                    new_data = sqldf('SELECT * FROM data WHERE ' + filter_text)
+                    new_data = engine.filter_dataset(data, filter_text)
 
                 except:
                     st.write("There is an error in your query. Click the help button for guide.")
@@ -151,10 +401,70 @@ if uploaded_file is not None or sample_checked:
             try:
                 # View the dataframe in streamlit
                 st.markdown(f'Total rows in display: **{len(new_data)}** of **{len(data)}** ({round(len(new_data)/len(data)*100,2)}%)')
-                st.write('Tip: Drag the edges of the columns to increase its size. Click on a column to sort the table by its values.')
+                st.write('Tip: Drag the edges of the columns to increase its size. Use the options above the table to sort or search the whole dataset.')
                 if sample_checked:
                     st.markdown('See details about the sample dataset in [this paper](https://www.mdpi.com/2306-5729/4/3/124).')
-                st.dataframe(new_data, use_container_width=True)
+
+                # Column statistics come from a cached summary of the dataset
+                with st.expander("Column summary"):
+                    st.dataframe(new_data.summary() if out_of_core else column_summary(new_data), use_container_width=True, hide_index=True)
+
+                # The export file is written in chunks on the server, then offered for download
+                with st.expander("Export the filtered dataset"):
+                    col_1, col_2 = st.columns([1,3])
+                    with col_1:
+                        export_format = st.selectbox("*Format:*", list(EXPORT_FORMATS))
+                    export_id = ((new_data.key, new_data.filter_text) if out_of_core else engine.dataset_key(new_data), export_format)
+                    if st.button("Prepare export"):
+                        with st.spinner("Writing the export file..."):
+                            st.session_state['export'] = (export_id, export_file(new_data, export_format, 'filtered_data'))
+                    if st.session_state.get('export', (None,))[0] == export_id:
+                        export_path = st.session_state['export'][1]
+                        if downloadable(export_path):
+                            with open(export_path, 'rb') as f:
+                                st.download_button("Download the filtered dataset", f, export_name('filtered_data', export_format),
+                                                   EXPORT_FORMATS[export_format][1])
+                        else:
+                            st.write(f'The export ({os.path.getsize(export_path) / 2**20:,.0f} MB) is larger than the download limit of \
+                                     {DOWNLOAD_MAX_MB} MB. It was written on the server to `{export_path}`.')
+
+                # Sorting, searching and paging run on the server, only the visible page is sent to the browser
+                col_1, col_2, col_3 = st.columns([2,1,2])
+                with col_1:
+                    sort_column = st.selectbox("*Sort by:*", ['(original order)'] + list(new_data.columns))
+                with col_2:
+                    sort_direction = st.selectbox("*Order:*", ['Ascending', 'Descending'])
+                with col_3:
+                    search_text = st.text_input("*Search values:*")
+
+                col_1, col_2, col_3 = st.columns([1,1,3])
+                with col_1:
+                    page_size = st.selectbox("*Rows per page:*", PAGE_SIZES, index=1)
+
+                if out_of_core:
+                    n_matches = new_data.matches(search_text)
+                else:
+                    rows = view_rows(new_data,
+                                     sort_column = None if sort_column == '(original order)' else sort_column,
+                                     ascending = sort_direction == 'Ascending',
+                                     search_text = search_text)
+                    n_matches = len(rows)
+
+                with col_2:
+                    page_number = st.number_input(f"*Page (of {page_count(n_matches, page_size)}):*", 1, page_count(n_matches, page_size))
+
+                if n_matches > 0:
+                    if out_of_core:
+                        # Each page is a query with ORDER BY / LIMIT / OFFSET on the file
+                        page_df = new_data.page(sort_column = None if sort_column == '(original order)' else sort_column,
+                                                ascending = sort_direction == 'Ascending',
+                                                offset = (page_number - 1) * page_size, limit = page_size,
+                                                search_text = search_text)
+                    else:
+                        page_df = page(new_data, rows, page_number, page_size)
+                    st.dataframe(page_df, use_container_width=True)
+                else:
+                    st.write("No record matches the search text.")
             except:
                 st.info("Error reading file. Please ensure that the input parameters are correctly defined.")
                 sys.exit()
@@ -178,7 +488,7 @@ if uploaded_file is not None or sample_checked:
             # Logic for filter text
             if filter_text != '':
                 try:
-                    new_data = sqldf('SELECT * FROM data WHERE ' + filter_text)
+                    new_data = engine.filter_dataset(data, filter_text)
 
                 except:
                     st.write("There is an error in your query. Click the help button for guide.")
@@ -195,9 +505,71 @@ if uploaded_file is not None or sample_checked:
         if len(new_data) > 0:
             try:
                 # View the profiling
-                profile = ProfileReport(new_data, orange_mode=True, explorative=True, sample=None)
                 st.markdown(f'Total rows in analysis: **{len(new_data)}** of **{len(data)}** ({round(len(new_data)/len(data)*100,2)}%)')
-                st_profile_report(profile, height=800, navbar=True)  
+                report_type = st.radio("****Report type:****", ["Full profile report", "Approximate summary (sketches)",
+                                                                "Relationships (correlation matrices)", "Duplicate rows"],
+                                       index = 1 if len(new_data) >= SKETCH_MIN_ROWS else 0, horizontal=True)
+
+                if report_type == "Approximate summary (sketches)":
+                    # Distinct counts, quantiles and frequent values from mergeable sketches built in one pass
+                    sketch, summary_df = engine.sketch_summary(new_data)
+                    st.write('Distinct counts have about 2% error, quantiles about 1% rank error, and counts of frequent values are lower bounds. \
+                             Columns with up to 64 distinct values have exact distinct counts.')
+                    st.dataframe(summary_df, use_container_width=True, hide_index=True)
+                    top_column = st.selectbox("*Most frequent values of:*", list(sketch.columns))
+                    st.dataframe(sketch.top_values(top_column), hide_index=True)
+                elif report_type == "Relationships (correlation matrices)":
+                    # Matrices from a few matrix products over all rows, without the profile report
+                    if out_of_core:
+                        if len(new_data) > OUT_OF_CORE_SAMPLE_ROWS:
+                            st.write(f'Out-of-core mode: the matrices are computed on a random sample of {OUT_OF_CORE_SAMPLE_ROWS} rows.')
+                        new_data = new_data.sample_rows(OUT_OF_CORE_SAMPLE_ROWS)
+                    matrices = engine.relationship_matrices(new_data)
+                    matrix_names = {"Pearson (numeric columns)": 'pearson', "Spearman (numeric columns)": 'spearman',
+                                    "Cramér's V (categorical columns)": 'cramers_v',
+                                    "Correlation ratio η (categorical rows, numeric columns)": 'eta'}
+                    matrix_name = st.selectbox("*Matrix:*", list(matrix_names))
+                    matrix = matrices[matrix_names[matrix_name]]
+                    st.write(f'Each pair of columns uses the rows where both are present. Categorical columns have up to {engine.relationships.MAX_CATEGORIES} distinct values.')
+                    if matrix.empty:
+                        st.write("No columns of the required type.")
+                    else:
+                        st.dataframe(matrix.style.background_gradient(cmap='RdBu_r', vmin=-1, vmax=1).format('{:.3f}'),
+                                     use_container_width=True)
+                elif report_type == "Duplicate rows":
+                    # Row hashes and MinHash signatures from one pass over chunks of rows, without the profile report
+                    col_1, col_2 = st.columns([3,1])
+                    with col_1:
+                        text_columns = st.multiselect("*Text columns compared for near-duplicates:*",
+                                                      engine.duplicates.text_columns(new_data))
+                    with col_2:
+                        threshold = st.slider("*Similarity threshold:*", 0.5, 1.0, engine.duplicates.THRESHOLD, 0.05)
+                    report = engine.duplicate_report(new_data, text_columns, threshold)
+                    col_1, col_2 = st.columns(2)
+                    col_1.metric("Exact duplicate rows", f"{report.exact_count:,}")
+                    if text_columns:
+                        col_2.metric("Near-duplicate rows (text)", f"{report.near_count:,}")
+                    st.write('Rows repeating an earlier row are counted as duplicates; the first row of each group is not. \
+                             Near-duplicates have text whose estimated similarity (Jaccard index of 3-character shingles) \
+                             to an earlier row reaches the threshold. Use the *Duplicate rows* option in the sidebar to exclude them.')
+                    if report.exact_count:
+                        st.markdown('##### Most repeated rows')
+                        st.dataframe(engine.duplicate_rows(new_data, report), use_container_width=True, hide_index=True)
+                    if text_columns and len(report.near_groups()):
+                        st.markdown('##### Groups of similar texts')
+                        st.dataframe(report.near_groups(), use_container_width=True, hide_index=True)
+                else:
+                    if out_of_core and len(new_data) > OUT_OF_CORE_SAMPLE_ROWS:
+                        st.write(f'Out-of-core mode: the profile is computed on a random sample of {OUT_OF_CORE_SAMPLE_ROWS} rows.')
+                    # The report is computed in the shared worker pool, once per (filtered) dataset;
+                    # out-of-core datasets are profiled on one fixed sample per file and filter
+                    profile_data, profile_key = profile_source(new_data, OUT_OF_CORE_SAMPLE_ROWS)
+                    with span('profiling') as record:
+                        set_size(record, profile_data)
+                        html = run_job("The profile report", engine.profile_html, profile_data, priority=INTERACTIVE,
+                                       memory=estimate_memory(profile_data, PROFILE_MEMORY_FACTOR), key=profile_key)
+                    if html is not None:
+                        st_profile_report(engine.RenderedProfile(html), height=800, navbar=True)
             except:
                 st.info("Error reading file. Please ensure that the input parameters are correctly defined.")
                 sys.exit()
@@ -212,8 +584,14 @@ if uploaded_file is not None or sample_checked:
         st.write( '### 3. Interactive visual exploration')
         st.markdown('Use the interactive interface below to experiment with different visualization. Refer to the [documentation](https://docs.kanaries.net/graphic-walker/data-viz/create-data-viz) for guide.')
 
-        pyg_app = StreamlitRenderer(data, appearance="light")
-        pyg_app.explorer()
+        with span('visual_exploration') as record:
+            if out_of_core:
+                st.write(f'Out-of-core mode: exploring a random sample of up to {OUT_OF_CORE_SAMPLE_ROWS} rows.')
+                pyg_app = StreamlitRenderer(data.sample_rows(OUT_OF_CORE_SAMPLE_ROWS), appearance="light")
+            else:
+                pyg_app = StreamlitRenderer(data, appearance="light")
+            set_size(record, data)
+            pyg_app.explorer()
 
     ## ===============================================
     ## 4. Statistical experimentation 
@@ -222,6 +600,9 @@ if uploaded_file is not None or sample_checked:
 
         st.write( '### 4. Statistical experimentation')
 
+        # Dataset -> filter -> projection/NA-drop -> sample -> test -> post-hoc, each stage
+        # recomputed only when its inputs change
+        filtered = pipeline.source('dataset', data)
         st.write("Enter a custom filter for your dataset (Use SQLite syntax)...")
         col1, col2 = st.columns([4,1])
         with col1:
@@ -229,12 +610,10 @@ if uploaded_file is not None or sample_checked:
             # Logic for filter text
             if filter_text != '':
                 try:
-                    new_data = sqldf('SELECT * FROM data WHERE ' + filter_text)
+                    filtered = pipeline.node('filter', engine.filter_dataset, filtered, filter_text)
                 except:
                     st.write("There is an error in your query. Click the help button for guide.")
-                    new_data = data
-            else:
-                new_data = data
+            new_data = filtered.value
         with col2:
             # Button for help dialog
             if st.button("Help", type='secondary'):
@@ -246,30 +625,10 @@ if uploaded_file is not None or sample_checked:
         else:
             st.write("Error: No record found!")
 
-        # Prepare functions
-        def check_normality(data, colname):
-            test_stat_normality, p_value_normality=stats.normaltest(data)
-            if p_value_normality <0.05:
-                to_print = f'- p-value for {colname}: {p_value_normality:.10f} >> Reject null hypothesis (The data is not normally distributed)'
-            else:
-                to_print = f'- p-value for {colname}: {p_value_normality:.10f} >> Fail to reject null hypothesis (The data is normally distributed)'
-
-            return p_value_normality, to_print
-
-        def check_variance_homogeneity(groups):
-            test_stat_var, p_value_var= stats.levene(*groups)
-            if p_value_var <0.05:
-                to_print = f'- p-value: {p_value_var:.10f} >> Reject null hypothesis (The variances of the samples are different)'
-            else:
-                to_print = f'- p-value: {p_value_var:.10f} >> Fail to reject null hypothesis (The variances of the samples are same)'
-
-            return p_value_var, to_print
-
         # Get categorical and numeric variables
-        categorical_cols =  [col for col in new_data.columns if new_data[col].nunique() <= 8]
-        numerical_cols =    [col for col in new_data.select_dtypes(include=['float','int'])]
+        categorical_cols, numerical_cols = engine.classify_columns(new_data)
 
-        if len(numerical_cols) >= 2 or (len(categorical_cols) >= 1 and len(numerical_cols) >= 1):
+        if len(numerical_cols) >= 2 or (len(categorical_cols) >= 1 and len(numerical_cols) >= 1) or len(categorical_cols) >= 2:
 
             st.write('Experiment with various hypothesis testing metrics to verify statistical \
                      significance of the differences between various groups of data. \
@@ -280,18 +639,58 @@ if uploaded_file is not None or sample_checked:
                      (i.e. car brands, year values). You may also utilize the filter to control your other variables.')
             
             # Initialize experiment options
-            experiments = []
-            if len(numerical_cols) >= 2: 
-                experiments.append("Paired samples test (requires 2 similar internal/ratio variables from all rows)")
-            if len(categorical_cols) >= 1 and len(numerical_cols) >= 1:
-                experiments.append("Independent samples test (requires 1 categorical variable and 1 interval/ratio variable)")
-            if len(categorical_cols) >= 2 and len(numerical_cols) >= 1:
-                experiments.append("Two-way ANOVA test (requires 2 categorical variables and 1 interval/ratio variable)")
+            experiment_labels = {'paired': "Paired samples test (requires 2 similar internal/ratio variables from all rows)",
+                                 'independent': "Independent samples test (requires 1 categorical variable and 1 interval/ratio variable)",
+                                 'two_way_anova': "Two-way ANOVA test (requires 2 categorical variables and 1 interval/ratio variable)",
+                                 'categorical_association': "Categorical association (requires 2 or more categorical variables)"}
+            experiments = [experiment_labels[kind] for kind in engine.available_experiments(categorical_cols, numerical_cols)]
 
             experiment = st.radio("****Select experiment type to perform:****", experiments)
 
+            # Samples are drawn with a seed kept per session, so analyzing again reuses the
+            # cached samples and results until new samples are asked for
+            if 'sample_seed' not in st.session_state:
+                st.session_state['sample_seed'] = int(np.random.default_rng().integers(2**32))
+
+            def analyze_buttons():
+                analyze = st.button('Analyze', type='primary')
+                if st.button('Analyze with new samples'):
+                    st.session_state['sample_seed'] = int(np.random.default_rng().integers(2**32))
+                    analyze = True
+                return analyze
+
+            def show_pipeline_reuse():
+                st.caption(f"Reused from cache: {', '.join(pipeline.hits()) or 'nothing'} | "
+                           f"Computed: {', '.join(pipeline.misses()) or 'nothing'}")
+
+            def show_assumption_checks(result):
+                st.markdown('''
+                    ##### Assumption check 1: Normality of distribution (D'Agostino and Pearson's test)
+                    $H_0$: The data is normally distributed.
+                    $H_1$: The data is not normally distributed.
+                ''')
+                for check in result['normality']:
+                    st.write(check['text'])
+
+                st.write('')
+                st.markdown('''
+                    ##### Assumption check 2: Homogeneity of variance (Levene's test)
+                    $H_0$: The variances of the samples are the same.
+                    $H_1$: The variances of the samples are different.
+                ''')
+                st.write(result['variance']['text'])
+                st.write('')
+
+            def show_posthoc(posthoc_df):
+                st.write('')
+                st.markdown('##### Performing Mann Whitney U test for pairwise comparison between groups ')
+                st.write('The generated matrix shows the p-value results for each pairwise comparisons. \
+                         p-values below 0.05 indicate the means for each pair of groups are significantly different.')
+                st.dataframe(posthoc_df)
+                export_table(posthoc_df, 'posthoc_matrix', 'posthoc')
+
             # Show columns to select
-            if experiment == 'Paired samples test (requires 2 similar internal/ratio variables from all rows)':
+            if experiment == experiment_labels['paired']:
                 col_1, col_2, col_3 = st.columns([1,1,1])
 
                 with col_1:
@@ -305,75 +704,41 @@ if uploaded_file is not None or sample_checked:
                                             min_value=10, step=1, 
                                             max_value=len(new_data), value = min(100,len(new_data)))
                     
-                if st.button('Analyze', type='primary'):
+                # Assumption checks on every row use streaming moments instead of the samples
+                full_checks = st.checkbox("Check assumptions on all rows (not only the samples)", key='full_checks_paired')
+
+                if analyze_buttons():
                     # Check if repeated columns
                     if var_1 == var_2:
                         st.write('Error: The two interval/ratio columns must be different.')
                     else:
-                        # Drop rows with NA values
-                        new_data.dropna(subset=[var_1,var_2],axis=0,inplace=True)
-                        # Sample
-                        new_data = new_data.sample(n=count)
+                        projected = pipeline.node('projection', engine.project, filtered, [var_1, var_2])
+                        sample = pipeline.node('sample', engine.sample_pairs, projected, var_1, var_2, count,
+                                               random_state=st.session_state['sample_seed'])
+                        assumptions = pipeline.node('assumptions', engine.check_assumptions_full, projected, var_1, var_2,
+                                                    paired=True) if full_checks else None
+                        result = pipeline.node('test', engine.paired_samples_test, sample, var_1, var_2, assumptions).value
 
                         # Assumption checks
-                        is_parametric = True
-                        st.markdown('''
-                            ##### Assumption check 1: Normality of distribution (D'Agostino and Pearson's test)
-                            $H_0$: The data is normally distributed.
-                            $H_1$: The data is not normally distributed.
-                        ''')
-
-                        for var in [var_1, var_2]:
-                            pval, text = check_normality(new_data[var].to_numpy(), var)
-                            is_parametric = is_parametric and pval > 0.05
-                            st.write(text)
-
-                        st.write('')
-                        st.markdown('''
-                            ##### Assumption check 2: Homogeneity of variance (Levene's test)
-                            $H_0$: The variances of the samples are the same.
-                            $H_1$: The variances of the samples are different.
-                        ''')
-
-                        pval, text = check_variance_homogeneity([new_data[var_1].to_numpy(),new_data[var_2].to_numpy()])
-                        is_parametric = is_parametric and pval > 0.05
-                        st.write(text)
-                        st.write('')
+                        show_assumption_checks(result)
 
                         # Test selection
-                        if is_parametric:
-                            # Main test: Paired t-test
-                            st.markdown('''
-                                ##### Assumptions are satisfied, performing Paired t-test
-                                $H_0$: The true mean difference is zero.
-                                $H_1$: The true mean difference is greater or less than zero.
-                            ''')
-                            test,pvalue = stats.ttest_rel(new_data[var_1],new_data[var_2]) ##alternative default two sided
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} Reject null hypothesis \
-                                             ##### Conclusion: There is a significant difference between the two groups.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} Fail to reject null hypothesis \
-                                             ##### Conclusion: There is a significant difference between the two groups.')
-
+                        st.markdown(f'''
+                            ##### Assumptions are {'' if result['is_parametric'] else 'not '}satisfied, performing {result['test_name']}
+                            $H_0$: The true mean difference is zero.
+                            $H_1$: The true mean difference is greater or less than zero.
+                        ''')
+                        if result['significant']:
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Reject null hypothesis")
+                            st.markdown('##### Conclusion: There is a significant difference between the two groups.')
                         else:
-                            # Main test: Wilcoxon Signed Rank test
-                            st.markdown('''
-                                ##### Assumptions are not satisfied, performing Wilcoxon Signed Rank test
-                                $H_0$: The true mean difference is zero.
-                                $H_1$: The true mean difference is greater or less than zero.
-                            ''')
-                            test,pvalue = stats.wilcoxon(new_data[var_1],new_data[var_2]) ##alternative default two sided
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} >> Reject null hypothesis')
-                                st.markdown('##### Conclusion: There is a significant difference between the two groups.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} >> Fail to reject null hypothesis')
-                                st.markdown('##### Conclusion: There is no significant difference between the two groups.')
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Fail to reject null hypothesis")
+                            st.markdown('##### Conclusion: There is no significant difference between the two groups.')
 
                         st.write('')
+                        show_pipeline_reuse()
                     
-            elif experiment == 'Independent samples test (requires 1 categorical variable and 1 interval/ratio variable)':
+            elif experiment == experiment_labels['independent']:
                 col_1, col_2, col_3 = st.columns([1,1,1])
                 with col_1:
                     var_1 = st.selectbox( "****Select categorical column:****", 
@@ -386,138 +751,59 @@ if uploaded_file is not None or sample_checked:
                                             min_value=10, step=1, 
                                             max_value=len(new_data), value = min(100,len(new_data)))
                 
-                if st.button('Analyze', type='primary'):
-                    # Drop rows with NA values
-                    new_data.dropna(subset=[var_1,var_2],axis=0,inplace=True)
-                    # Split new_data per unique categorical value
-                    dfs = dict(tuple(new_data.groupby(var_1)))
-                    st.write(f'Number of groups: {len(list(dfs.keys()))}')
-
-                    # Sample in each subgroup
-                    for column_val in list(dfs.keys()):
-                        dfs[column_val] = dfs[column_val].sample(n=min(count,len(dfs[column_val])))
-                        st.markdown(f"- {column_val} - {len(dfs[column_val])} samples")
+                # Assumption checks on every row use streaming moments instead of the samples
+                full_checks = st.checkbox("Check assumptions on all rows (not only the samples)", key='full_checks_independent')
+
+                if analyze_buttons():
+                    projected = pipeline.node('projection', engine.project, filtered, [var_1, var_2])
+                    groups = pipeline.node('sample', engine.sample_groups, projected, var_1, var_2, count,
+                                           random_state=st.session_state['sample_seed'])
+                    st.write(f'Number of groups: {len(groups.value)}')
+                    for column_val, values in groups.value.items():
+                        st.markdown(f"- {column_val} - {len(values)} samples")
+
+                    assumptions = pipeline.node('assumptions', engine.check_assumptions_full, projected, var_1, var_2,
+                                                paired=False) if full_checks else None
+                    result = pipeline.node('test', engine.independent_samples_test, groups, var_2, assumptions,
+                                           posthoc=False).value
 
                     # Assumption checks
-                    is_parametric = True
-                    st.markdown('''
-                        ##### Assumption check 1: Normality of distribution (D'Agostino and Pearson's test)
-                        $H_0$: The data is normally distributed.
-                        $H_1$: The data is not normally distributed.
-                    ''')
-
-                    for column_val in list(dfs.keys()):
-                        pval, text = check_normality(dfs[column_val][var_2].to_numpy(), var_2)
-                        is_parametric = is_parametric and pval > 0.05
-                        st.write(text)
-
-                    st.write('')
-                    st.markdown('''
-                        ##### Assumption check 2: Homogeneity of variance (Levene's test)
-                        $H_0$: The variances of the samples are the same.
-                        $H_1$: The variances of the samples are different.
-                    ''')
-
-                    pval, text = check_variance_homogeneity([dfs[column_val][var_2].to_numpy() for column_val in list(dfs.keys())])
-                    is_parametric = is_parametric and pval > 0.05
-                    st.write(text)
-                    st.write('')
+                    show_assumption_checks(result)
 
                     # Test selection
-                    if len(list(dfs.keys())) == 2: # Independent T test or nonparametric equivalent
-                        if is_parametric:
-                            st.markdown('''
-                                ##### Assumptions are satisfied, performing Independent t-test
-                                $H_0$: The true mean difference is zero.
-                                $H_1$: The true mean difference is greater or less than zero.
-                            ''')
-                            value_groups = [dfs[column_val][var_2].to_numpy() for column_val in list(dfs.keys())]
-                            test,pvalue = stats.ttest_ind(*value_groups)                            
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} Reject null hypothesis')
-                                st.markdown('##### Conclusion: There is a significant difference between the two groups.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} Fail to reject null hypothesis')
-                                st.markdown('##### Conclusion: There is no significant difference between the two groups.')
-
+                    if len(groups.value) == 2: # Independent T test or nonparametric equivalent
+                        st.markdown(f'''
+                            ##### Assumptions are {'' if result['is_parametric'] else 'not '}satisfied, performing {result['test_name']}
+                            $H_0$: The true mean difference is zero.
+                            $H_1$: The true mean difference is greater or less than zero.
+                        ''')
+                        if result['significant']:
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Reject null hypothesis")
+                            st.markdown('##### Conclusion: There is a significant difference between the two groups.')
                         else:
-                            st.markdown('''
-                                ##### Assumptions are not satisfied, performing Mann Whitney U test
-                                $H_0$: The true mean difference is zero.
-                                $H_1$: The true mean difference is greater or less than zero.
-                            ''')
-                            value_groups = [dfs[column_val][var_2].to_numpy() for column_val in list(dfs.keys())]
-                            test,pvalue = stats.mannwhitneyu(*value_groups) 
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} >> Reject null hypothesis')
-                                st.markdown('##### Conclusion: There is a significant difference between the two groups.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} >> Fail to reject null hypothesis')
-                                st.markdown('##### Conclusion: There is no significant difference between the two groups.')
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Fail to reject null hypothesis")
+                            st.markdown('##### Conclusion: There is no significant difference between the two groups.')
 
                     else: # ANOVA or nonparametric equivalent
-                        if is_parametric:
-
-                            # Main test: ANOVA
-                            st.markdown('''
-                                ##### Assumptions are satisfied, performing one-way ANOVA:
-                                $H_0$: The means of the groups are the same.
-                                $H_1$: At least one of the groups' means is different.
-                            ''')
-                            value_groups = [dfs[column_val][var_2].to_numpy() for column_val in list(dfs.keys())]
-                            test,pvalue = stats.f_oneway(*value_groups) 
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} Reject null hypothesis')
-                                st.markdown('##### Conclusion: At least one of the groups\' means are different.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} Fail to reject null hypothesis')
-                                st.markdown('##### Conclusion: There is no significant difference between the groups.')
-
-                            # Post-hoc tests
-                            st.write('')
-                            st.markdown('##### Performing Mann Whitney U test for pairwise comparison between groups ')
-                            posthoc_df = sp.posthoc_mannwhitney(value_groups, p_adjust = 'bonferroni')
-                            group_names= list(dfs.keys())
-                            posthoc_df.columns= group_names
-                            posthoc_df.index= group_names
-                            
-                            st.write('The generated matrix shows the p-value results for each pairwise comparisons. \
-                                     p-values below 0.05 indicate the means for each pair of groups are significantly different.')
-                            st.dataframe(posthoc_df)
-                        
+                        st.markdown(f'''
+                            ##### Assumptions are {'' if result['is_parametric'] else 'not '}satisfied, performing {result['test_name']}
+                            $H_0$: The means of the groups are the same.
+                            $H_1$: At least one of the groups' means is different.
+                        ''')
+                        if result['significant']:
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Reject null hypothesis")
+                            st.markdown('##### Conclusion: At least one of the groups\' means are different.')
                         else:
-                            # Main test: Keuskal-Wallis test
-                            st.markdown('''
-                                ##### Assumptions are not satisfied, performing Kruskal-Wallis test
-                                $H_0$: The means of the groups are the same.
-                                $H_1$: At least one of the sample' means is different.
-                            ''')
-                            value_groups = [dfs[column_val][var_2].to_numpy() for column_val in list(dfs.keys())]
-                            test,pvalue = stats.kruskal(*value_groups) 
-                            if pvalue < 0.05:
-                                st.markdown(f'- p-value: {pvalue:.10f} Reject null hypothesis')
-                                st.markdown('##### Conclusion: At least one of the groups\' means are different.')
-                            else:
-                                st.markdown(f'- p-value: {pvalue:.10f} Fail to reject null hypothesis')
-                                st.markdown('##### Conclusion: There is no significant difference between the groups.')                            # Post-hoc tests
-                            
-                            # Post-hoc tests
-                            st.write('')
-                            st.markdown('##### Performing Mann Whitney U test for pairwise comparison between groups ')
-                            posthoc_df = sp.posthoc_mannwhitney(value_groups, p_adjust = 'bonferroni')
-                            group_names= list(dfs.keys())
-                            posthoc_df.columns= group_names
-                            posthoc_df.index= group_names
-          
-                            st.write('The generated matrix shows the p-value results for each pairwise comparisons. \
-                                     p-values below 0.05 indicate the means for each pair of groups are significantly different.')
-                            st.dataframe(posthoc_df)
+                            st.markdown(f"- p-value: {result['pvalue']:.10f} >> Fail to reject null hypothesis")
+                            st.markdown('##### Conclusion: There is no significant difference between the groups.')
 
-                    st.write('')
+                        # Post-hoc tests
+                        show_posthoc(pipeline.node('post-hoc', engine.independent_posthoc, groups).value)
 
+                    st.write('')
+                    show_pipeline_reuse()
 
-            
-            elif experiment == 'Two-way ANOVA test (requires 2 categorical variables and 1 interval/ratio variable)':
+            elif experiment == experiment_labels['two_way_anova']:
                 col_1, col_2, col_3 = st.columns([1,1,1])
                 with col_1:
                     var_1 = st.selectbox( "****Select categorical column 1:****", 
@@ -528,69 +814,85 @@ if uploaded_file is not None or sample_checked:
                 with col_3:
                     var_3 = st.selectbox( "****Select interval/ratio column:****", 
                                         numerical_cols, key=7)
-                    
-                
             
                 if st.button('Analyze', type='primary'):
                     # Check if repeated columns
                     if var_1 == var_2:
                         st.write('Error: The two categorical columns must be different.')
                     else:
-                        # Drop rows with NA values
-                        new_data.dropna(subset=[var_1,var_2,var_3],axis=0,inplace=True)
-                        
+                        projected = pipeline.node('projection', engine.project, filtered, [var_1, var_2, var_3])
+                        prepared = pipeline.node('groups', engine.prepare_two_way, projected, var_1, var_2, var_3)
+                        anova_data, groups_count = pipeline.item(prepared, 0), pipeline.item(prepared, 1)
+
                         # Count values
                         st.markdown('##### Count of values per combination of groups:')
-                        groups_count = new_data[[var_1,var_2]].value_counts().reset_index(name='count')
-                        st.dataframe(groups_count)
+                        st.dataframe(groups_count.value)
                         
                         # Perform two way ANOVA
                         st.markdown('##### Performing two-way ANOVA')
-                        model = ols(f'{var_3} ~ C({var_1}) + C({var_2}) + C({var_1}):C({var_2})', data=new_data).fit()
-                        anova_df = sm.stats.anova_lm(model, typ=2)
-                        st.dataframe(anova_df)
+                        result = pipeline.node('test', engine.two_way_anova, anova_data, groups_count, var_1, var_2, var_3,
+                                               posthoc=False).value
+                        st.dataframe(result['anova'])
+                        export_table(result['anova'], 'anova_table', 'anova')
 
                         # Interpretations
-                        if math.isnan(anova_df.iloc[0,3]):
-                            st.write(f'The p-value for {var_1} nor its significance can be determined.')
-                        if anova_df.iloc[0,3] < 0.05:
-                            st.write(f'The p-value for {var_1} is {anova_df.iloc[0,3]:.10f} (< 0.05) >> {var_1} has a statistically significant effect on {var_3}.')
-                        else:
-                            st.write(f'The p-value for {var_1} is {anova_df.iloc[0,3]:.10f} (>= 0.05) >> {var_1} has no statistically significant effect on {var_3}.')
-                        
-                        if math.isnan(anova_df.iloc[1,3]):
-                            st.write(f'The p-value for {var_2} nor its significance can be determined.')
-                        elif anova_df.iloc[1,3] < 0.05:
-                            st.write(f'The p-value for {var_2} is {anova_df.iloc[1,3]:.10f} (< 0.05) >> {var_2} has a statistically significant effect on {var_3}.')
-                        else:
-                            st.write(f'The p-value for {var_2} is {anova_df.iloc[1,3]:.10f} (>= 0.05) >> {var_2} has no statistically significant effect on {var_3}.')
-
-                        if anova_df.iloc[2,3] < 0.05:
-                            st.write(f'The p-value for the interaction effect is {anova_df.iloc[2,3]:.10f} (< 0.05) >> There is a significant interaction effect between {var_1} and {var_2} on {var_3}.')
-                        else:
-                            st.write(f'The p-value for the interaction effect is {anova_df.iloc[2,3]:.10f} (>= 0.05) >> There is no significant interaction effect between {var_1} and {var_2} on {var_3}.')
-
+                        for sentence in result['interpretation']:
+                            st.write(sentence)
 
-                         # Post-hoc tests
+                        # Post-hoc tests
                         st.write('')
                         st.markdown('##### Performing Mann Whitney U test for pairwise comparison between groups ')
-                        
-                        # Create df groups per combination of variables
-                        value_groups = []
-                        group_names = []
-                        for i, row in groups_count.iterrows():
-                            # Fetch names
-                            group_names.append(row[0] + ', ' + row[1])
-                            # Fetch filtered values on target column
-                            value_groups.append(new_data[(new_data[var_1] == row[0]) & (new_data[var_2] == row[1])][var_3].to_numpy())
-
-                        posthoc_df = sp.posthoc_mannwhitney(value_groups, p_adjust = 'bonferroni')
-                        posthoc_df.columns= group_names
-                        posthoc_df.index= group_names
-        
                         st.write(f'The generated matrix shows the p-value results for each pairwise comparisons ({var_1} and {var_2}) against the target variable ({var_3}).')
                         st.write('p-values below 0.05 indicate the means for each pair of groups are significantly different.')
+                        if out_of_core:
+                            st.write(f'Out-of-core mode: the post-hoc tests use random samples of up to {engine.TWO_WAY_POSTHOC_SAMPLES} rows per combination of groups.')
+                        posthoc_df = pipeline.node('post-hoc', engine.two_way_posthoc, anova_data, groups_count,
+                                                   var_1, var_2, var_3).value
                         st.dataframe(posthoc_df)
+                        export_table(posthoc_df, 'two_way_posthoc_matrix', 'two_way_posthoc')
+                        show_pipeline_reuse()
+
+            elif experiment == experiment_labels['categorical_association']:
+                col_1, col_2 = st.columns([3,1])
+                with col_1:
+                    association_cols = st.multiselect("****Select categorical columns:****", categorical_cols,
+                                                      default=categorical_cols)
+                with col_2:
+                    correction = st.selectbox("****Multiple-comparison correction:****", list(engine.contingency.CORRECTIONS))
+
+                if st.button('Analyze', type='primary'):
+                    if len(association_cols) < 2:
+                        st.write('Error: Select at least 2 categorical columns.')
+                    else:
+                        # The tables of all pairs are counted in one pass and shared with the relationship views
+                        tables = pipeline.node('tables', engine.contingency_tables, filtered, association_cols)
+                        result = pipeline.node('test', engine.categorical_association, tables, correction).value
+                        pairs_df = result['pairs']
+
+                        st.markdown(f'''
+                            ##### Performing chi-square tests of independence for {len(pairs_df)} pairs of columns
+                            $H_0$: The two columns are independent.
+                            $H_1$: The two columns are associated.
+                        ''')
+                        st.write(f"Fisher's exact test replaces the chi-square test for 2x2 tables with expected counts below 5. \
+                                 p-values are adjusted for the {result['tested']} pairs tested ({correction} correction); \
+                                 adjusted p-values below 0.05 indicate a significant association. Cramér's V measures its \
+                                 strength from 0 (none) to 1. Pairs flagged with low expected counts have more than 20% of \
+                                 their cells expected below 5, so their chi-square p-values are approximate.")
+                        significant = int(pairs_df['significant'].sum())
+                        st.markdown(f'##### Conclusion: {significant} of {len(pairs_df)} pairs of columns are significantly associated.')
+                        st.dataframe(pairs_df, use_container_width=True, hide_index=True)
+                        export_table(pairs_df, 'association_tests', 'association', index=False)
+
+                        st.markdown("##### Cramér's V between the columns")
+                        st.dataframe(result['cramers_v'].style.background_gradient(cmap='Blues', vmin=0, vmax=1).format('{:.3f}'),
+                                     use_container_width=True)
+
+                        # Contingency table of the most significant pair
+                        top = pairs_df.iloc[0]
+                        st.markdown(f"##### Contingency table of {top['column_1']} and {top['column_2']}")
+                        st.dataframe(tables.value[(top['column_1'], top['column_2'])])
+                        show_pipeline_reuse()
             
 
         else:
@@ -608,37 +910,109 @@ if uploaded_file is not None or sample_checked:
         st.write( '### 5. Machine Learning')
         st.markdown('Quickly train a suitable model using the provided dataset. This is powered by PyCaret\'s automated machine learning capabilities ([documentation](https://pycaret.gitbook.io/docs)).')
 
-        # Get categorical and numeric variables
-        categorical_cols =  [col for col in data.columns if data[col].nunique() <= 8]
-        numerical_cols =    [col for col in data.select_dtypes(include=['float','int'])]
+        experiments = st.radio("****Select experiment type to perform:****", engine.automl_experiments(data))
 
-        experiments = []
-        if categorical_cols:    experiments.append('Classification')
-        if numerical_cols:      experiments.append('Regression')
-        experiments = st.radio("****Select experiment type to perform:****", experiments)
+        target = st.selectbox("Choose the Target", data.columns)
 
-        if experiments == 'Classification':
-            exp = ClassificationExperiment()
-        if experiments == 'Regression':
-            exp = RegressionExperiment()
+        # Large datasets are trained incrementally on chunks of rows instead of in memory by PyCaret,
+        # which cannot train on out-of-core datasets at all
+        large = isinstance(data, LazyDataset) or len(data) >= SKETCH_MIN_ROWS
+        automl_mode, incremental_mode = "AutoML (PyCaret, in memory)", "Incremental (chunked, for large datasets)"
+        modes = [incremental_mode] if isinstance(data, LazyDataset) else [automl_mode, incremental_mode]
+        mode = st.radio("****Training mode:****", modes, index=len(modes) - 1 if large else 0, horizontal=True)
+
+        if mode == automl_mode:
+            # Optional tuning of the best model with pruned trials in parallel, continuing earlier tuning runs
+            col_1, col_2 = st.columns(2)
+            with col_1:
+                tune = st.checkbox("Tune the hyperparameters of the best model")
+            with col_2:
+                time_budget = st.number_input("****Tuning time budget (seconds):****", min_value=10, step=10,
+                                              value=engine.tuning.TIME_BUDGET, disabled=not tune)
+            # Each training job saves its model to its own file
+            job_key = ('automl', engine.dataset_key(data), target, experiments, tune, time_budget)
+            model_path = engine.model_path('best_model', job_key)
+            if st.button("Train Model"): 
+                # Training runs as a batch job: interactive jobs such as profile reports start first
+                with span('automl'):
+                    result = run_job("Model training", engine.train_automl, data, target, experiments, model_path,
+                                     tune, time_budget, priority=BATCH,
+                                     memory=estimate_memory(data, 20) * (engine.tuning.TUNING_WORKERS if tune else 1),
+                                     key=job_key)
+                if result is None:
+                    st.stop()
+                st.write('Experiment Setup')
+                st.dataframe(result['setup'])
+                st.dataframe(result['comparison'])
+                export_table(result['comparison'], 'model_comparison', 'comparison')
+
+                if 'tuning' in result:
+                    tuned = result['tuning']
+                    st.write(f"Tuning: {len(tuned['trials'])} trials in this run "
+                             f"({(tuned['trials']['state'] == 'PRUNED').sum()} pruned), "
+                             f"continuing {tuned['previous_trials']} earlier trials")
+                    if tuned['improved']:
+                        st.write(f"The tuned model scores {tuned['score']:.4f} and is the one saved.")
+                        st.dataframe(tuned['scores'])
+                    else:
+                        st.write("Tuning did not improve on the compared model, which is the one saved.")
+                    st.dataframe(tuned['trials'], hide_index=True)
 
-        target = st.selectbox("Choose the Target", data.columns)
-        if st.button("Train Model"): 
-            exp.setup(data, target=target)
-            setup_df = exp.pull()
-            st.write('Experiment Setup')
-            st.dataframe(setup_df)
-            best_model = exp.compare_models()
-            compare_df = exp.pull()
-            exp.save_model(best_model, 'best_model.pkl')
-            st.dataframe(compare_df)
-
-            if st.button("Download Model"): 
-                with open("best_model.pkl", 'rb') as f: 
-                    st.download_button("Download Model", f, "best_model_test.pkl")
+                # The explanations of the saved model are computed in the background and shown below
+                submit_explanations(data, target, experiments, result['model_path'])
+
+                if st.button("Download Model"): 
+                    with open(result['model_path'], 'rb') as f: 
+                        st.download_button("Download Model", f, "best_model_test.pkl")
+
+            show_explanations(model_path)
+
+        else:
+            st.write('Models supporting incremental training (SGD linear models, naive Bayes, mini-batch neural networks) \
+                     are trained on chunks of rows streamed from the dataset, so memory use does not grow with its size. \
+                     A tenth of the rows is held out to score them.')
+            col_1, col_2 = st.columns(2)
+            with col_1:
+                chunk_rows = st.number_input("****Rows per chunk:****", min_value=1000, step=10000, value=incremental_ml.CHUNK_ROWS)
+            with col_2:
+                epochs = st.number_input("****Passes over the data (epochs):****", min_value=1, max_value=20,
+                                         value=incremental_ml.EPOCHS)
+            if st.button("Train Model"):
+                data_id = (data.key, data.filter_text) if isinstance(data, LazyDataset) else engine.dataset_key(data)
+                job_key = ('incremental', data_id, target, experiments, chunk_rows, epochs)
+                with span('automl'):
+                    result = run_job("Incremental training", incremental_ml.train_incremental, incremental_ml.dataset_source(data),
+                                     target, experiments, engine.model_path('incremental_model', job_key), chunk_rows, epochs,
+                                     priority=BATCH, memory=incremental_ml.estimate_memory(data, chunk_rows), key=job_key)
+                if result is None:
+                    st.stop()
+                col_1, col_2, col_3 = st.columns(3)
+                col_1.metric("Training throughput", f"{result['rows_per_second']:,.0f} rows/s")
+                col_2.metric("Rows trained (all epochs)", f"{result['rows']:,}")
+                col_3.metric("Training time", f"{result['train_seconds']:.1f} s")
+                st.dataframe(result['comparison'], hide_index=True)
+                export_table(result['comparison'], 'model_comparison', 'comparison', index=False)
+
+                with open(result['model_path'], 'rb') as f:
+                    st.download_button("Download Model", f, "incremental_model.pkl")
 
 else:
     st.title("Welcome to Data Express!")
-    st.subheader("Import a dataset (CSV/Excel) or use a sample dataset to begin exploring.")
+    st.subheader("Import a dataset (CSV, Excel, Parquet, Arrow or JSON Lines) or use a sample dataset to begin exploring.")
     st.write("")
-    st.markdown("By Wayne Dayata [(Github)](https://github.com/20100215)| June 9, 2024 ")
\ No newline at end of file
+    st.markdown("By Wayne Dayata [(Github)](https://github.com/20100215)| June 9, 2024 ")
+
+# Performance panel with the timings of this rerun
+write_metrics_file()
+if show_performance:
+    with st.sidebar.expander("Performance", expanded=True):
+        st.dataframe(run_table(), hide_index=True)
+        if pipeline.report:
+            st.write("Analysis pipeline (cache hits and misses)")
+            st.dataframe(pipeline.report_table(), hide_index=True)
+        st.download_button("Download metrics (Prometheus)", prometheus_text(), "data_express_metrics.prom")
+        st.download_button("Download span log (JSON lines)", spans_json(), "data_express_spans.jsonl")
+        prof, prof_text = profile_outputs()
+        if prof is not None:
+            st.download_button("Download cProfile stats", prof, f"{profile_section}.prof")
+            st.text(prof_text)
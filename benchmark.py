@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from scipy import stats
+import scikit_posthocs as sp
+import analysis_engine as engine
+from filter_engine import filter_data, clear_index_cache
+from readers import read_file
+
+# Headless benchmark of the app's data paths on synthetic datasets.
+# Datasets are bootstrapped column by column from the two sample files and
+# widened by repeating their columns. Every path is timed through the
+# functions the app calls, and the results are written as JSON for comparison
+# across versions.
+#
+#   python benchmark.py --rows 10000 100000 --schemas toyota students --output bench.json
+
+TEMPLATES = {'toyota': 'toyota.csv', 'students': 'students.csv'}
+
+# Filter, categorical and numeric columns used by each schema's benchmarks
+SCHEMA_SETTINGS = {
+    'toyota':   {'filter': "year BETWEEN 2015 AND 2018",
+                 'refine': " AND transmission = 'Manual'",
+                 'cat_1': 'fuelType', 'cat_2': 'transmission', 'num_1': 'price', 'num_2': 'mileage'},
+    'students': {'filter': "region = 'SEA'",
+                 'refine': " AND age BETWEEN 20 AND 30",
+                 'cat_1': 'stay_cate', 'cat_2': 'academic', 'num_1': 'toas', 'num_2': 'tosc'},
+}
+
+XLSX_MAX_ROWS = 1048575
+
+
+# Bootstrap each template column independently; width > 1 repeats the
+# columns with a numbered suffix to build wide schemas
+def synthesize(template, n_rows, width=1, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for repetition in range(width):
+        for col in template.columns:
+            name = col if repetition == 0 else f'{col}_{repetition}'
+            columns[name] = template[col].to_numpy()[rng.integers(0, len(template), n_rows)]
+    return pd.DataFrame(columns)
+
+
+# Time a function over several runs; setup runs untimed before each run
+def timed(fn, repeat, setup=None):
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+## ===============================================
+## Hypothesis test branches, as run by the app
+## ===============================================
+
+# Every branch of the test selection, run on the prepared samples
+def test_branches(paired, value_groups):
+    two_groups = sorted(value_groups, key=len)[-2:]
+    return {
+        'normality': lambda: [stats.normaltest(values) for values in value_groups],
+        'levene': lambda: stats.levene(*value_groups),
+        'paired_t': lambda: stats.ttest_rel(paired.iloc[:, 0], paired.iloc[:, 1]),
+        'wilcoxon': lambda: stats.wilcoxon(paired.iloc[:, 0], paired.iloc[:, 1]),
+        'independent_t': lambda: stats.ttest_ind(*two_groups),
+        'mann_whitney': lambda: stats.mannwhitneyu(*two_groups),
+        'one_way_anova': lambda: stats.f_oneway(*value_groups),
+        'kruskal': lambda: stats.kruskal(*value_groups),
+        'posthoc': lambda: sp.posthoc_mannwhitney(value_groups, p_adjust='bonferroni'),
+    }
+
+
+# Two-way ANOVA with its post-hoc tests
+def two_way_anova(data, var_1, var_2, var_3):
+    data, groups_count = engine.prepare_two_way(data, var_1, var_2, var_3)
+    engine.two_way_anova(data, groups_count, var_1, var_2, var_3)
+
+
+## ===============================================
+## Runner
+## ===============================================
+
+def benchmark_dataset(schema, data, args, workdir):
+    settings = SCHEMA_SETTINGS[schema]
+    cases = []
+
+    def record(path, fn, setup=None, repeat=args.repeat):
+        try:
+            seconds = timed(fn, repeat, setup)
+            cases.append({'path': path, 'seconds': seconds, 'best': min(seconds),
+                          'mean': sum(seconds) / len(seconds)})
+        except Exception as e:
+            cases.append({'path': path, 'error': f'{type(e).__name__}: {e}'})
+        print(f'  {path}: {cases[-1].get("best", cases[-1].get("error"))}', file=sys.stderr)
+
+    csv_path = os.path.join(workdir, f'{schema}.csv')
+    data.to_csv(csv_path, index=False)
+    record('load_data.csv', lambda: read_file(csv_path))
+
+    if len(data) <= min(args.xlsx_max_rows, XLSX_MAX_ROWS):
+        xlsx_path = os.path.join(workdir, f'{schema}.xlsx')
+        data.to_excel(xlsx_path, index=False, engine='openpyxl')
+        record('load_data.xlsx', lambda: read_file(xlsx_path))
+
+    # Fresh copies so the per-dataset caches start cold
+    def cold_copy():
+        clear_index_cache()
+        holder['data'] = data.copy()
+    holder = {}
+    record('filter.cold', lambda: filter_data(holder['data'], settings['filter']), setup=cold_copy)
+    record('filter.refine', lambda: filter_data(holder['data'], settings['filter'] + settings['refine']),
+           setup=lambda: (cold_copy(), filter_data(holder['data'], settings['filter'])))
+    record('filter.warm', lambda: filter_data(data, settings['filter']),
+           setup=lambda: filter_data(data, settings['filter']))
+
+    # Classifications are cached per dataset, every run starts cold
+    record('classify_columns', lambda: engine.classify_columns(data), setup=engine.clear_classification_cache)
+    record('test.paired.prepare', lambda: engine.sample_pairs(data, settings['num_1'], settings['num_2'], args.samples))
+    record('test.independent.prepare', lambda: engine.sample_groups(data, settings['cat_1'], settings['num_1'], args.samples))
+    paired = engine.sample_pairs(data, settings['num_1'], settings['num_2'], args.samples)[[settings['num_1'], settings['num_2']]]
+    value_groups = list(engine.sample_groups(data, settings['cat_1'], settings['num_1'], args.samples).values())
+    for branch, fn in test_branches(paired, value_groups).items():
+        record(f'test.{branch}', fn)
+    record('test.two_way_anova', lambda: two_way_anova(data, settings['cat_1'], settings['cat_2'], settings['num_1']))
+
+    if len(data) <= args.profile_max_rows:
+        record('profiling', lambda: engine.profile_html(data), repeat=1)
+    return cases
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    import scipy
+    import statsmodels
+    return {'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'versions': {'pandas': pd.__version__, 'numpy': np.__version__,
+                         'scipy': scipy.__version__, 'statsmodels': statsmodels.__version__}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Data Express data paths on synthetic datasets.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--schemas', nargs='+', default=['toyota', 'students'], choices=sorted(TEMPLATES))
+    parser.add_argument('--widths', type=int, nargs='+', default=[1, 4],
+                        help='Repeat the template columns this many times (narrow to wide)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=100, help='Samples per group, as in the app')
+    parser.add_argument('--xlsx-max-rows', type=int, default=100_000)
+    parser.add_argument('--profile-max-rows', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='JSON output file, - for stdout')
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    report = {'environment': environment(), 'settings': vars(args), 'results': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for schema in args.schemas:
+            template = read_file(os.path.join(here, TEMPLATES[schema]))
+            for width in args.widths:
+                for n_rows in args.rows:
+                    data = synthesize(template, n_rows, width, args.seed)
+                    print(f'{schema} x{width}: {n_rows} rows, {data.shape[1]} columns', file=sys.stderr)
+                    report['results'].append({'schema': schema, 'width': width, 'rows': n_rows,
+                                              'columns': data.shape[1],
+                                              'cases': benchmark_dataset(schema, data, args, workdir)})
+
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key
+from out_of_core import LazyDataset, iter_chunks
+
+# Contingency tables of every pair of categorical columns and the tests of
+# association between them:
+# - each column is coded once as integers (-1 for nulls) against its sorted
+#   levels; the tables of all pairs are then counted by one bincount over
+#   flat cell indices (offset of the pair + code_a * levels_b + code_b), a
+#   batch of rows at a time, and out-of-core datasets are streamed in chunks
+# - tables are cached per (filtered) dataset and pair, so the association
+#   tests and the Cramer's V matrix of the relationship views share them and
+#   only count the pairs not seen before
+# - the chi-square test (Fisher's exact test for 2x2 tables with expected
+#   counts below 5) and Cramer's V of the pairs run in threads, and the
+#   p-values are corrected for the number of pairs tested
+
+CHUNK_ROWS = 500_000
+
+# Flat cell indices computed at once: rows per bincount batch are this divided by the number of pairs
+BATCH_CELLS = 4_000_000
+
+# Pairs per thread task for the tests
+PAIRS_PER_TASK = 16
+
+# Expected counts below this make the chi-square approximation unreliable
+MIN_EXPECTED = 5
+
+# Multiple-comparison corrections, as named by statsmodels' multipletests
+CORRECTIONS = {'Holm': 'holm', 'Benjamini-Hochberg (FDR)': 'fdr_bh', 'Bonferroni': 'bonferroni', 'None': None}
+
+_table_cache = DatasetCache(max_entries=16)
+
+
+# Levels and tables counted so far for one (filtered) dataset
+class _TableStore:
+    def __init__(self):
+        self.levels = {}
+        self.tables = {}
+        self.lock = threading.Lock()
+
+
+# Non-null distinct values of a column, sorted when they can be compared
+def _sorted_levels(values):
+    levels = pd.Index(pd.unique(values))
+    levels = levels[levels.notna()]
+    try:
+        return levels.sort_values()
+    except TypeError:
+        return levels
+
+
+def column_levels(data, col):
+    if isinstance(data, LazyDataset):
+        return _sorted_levels(data.distinct_values(col))
+    return _sorted_levels(data[col])
+
+
+def column_codes(series, levels):
+    return pd.Categorical(series, categories=levels).codes.astype(np.int64)
+
+
+# Tables of the given pairs of columns, counted in one pass over the rows.
+# Rows where either column is null are counted in a spare cell past the tables.
+def count_tables(data, pairs, levels, chunk_rows=CHUNK_ROWS):
+    columns = list(dict.fromkeys(col for pair in pairs for col in pair))
+    position = {col: i for i, col in enumerate(columns)}
+    first = np.array([position[a] for a, _ in pairs], dtype=np.int64)
+    second = np.array([position[b] for _, b in pairs], dtype=np.int64)
+    sizes_a = np.array([len(levels[a]) for a, _ in pairs], dtype=np.int64)
+    sizes_b = np.array([len(levels[b]) for _, b in pairs], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes_a * sizes_b)])
+    total = int(offsets[-1])
+    counts = np.zeros(total + 1, dtype=np.int64)
+    batch_rows = max(1, BATCH_CELLS // max(1, len(pairs)))
+
+    for chunk in iter_chunks(data, chunk_rows, columns):
+        codes = np.column_stack([column_codes(chunk[col], levels[col]) for col in columns])
+        for start in range(0, len(codes), batch_rows):
+            batch = codes[start:start + batch_rows]
+            codes_a, codes_b = batch[:, first], batch[:, second]
+            cells = offsets[:-1] + codes_a * sizes_b + codes_b
+            cells[(codes_a < 0) | (codes_b < 0)] = total
+            counts += np.bincount(cells.ravel(), minlength=total + 1)
+
+    return {pair: counts[offsets[i]:offsets[i + 1]].reshape(sizes_a[i], sizes_b[i])
+            for i, pair in enumerate(pairs)}
+
+
+def _dataset_id(data):
+    return (data.key, data.filter_text) if isinstance(data, LazyDataset) else dataset_key(data)
+
+
+# Contingency tables (DataFrames of counts, rows for the levels of the first
+# column) of every pair of the columns, cached per (filtered) dataset
+def pair_tables(data, columns):
+    columns = list(columns)
+    pairs = [(a, b) for i, a in enumerate(columns) for b in columns[i + 1:]]
+    store = _table_cache.get_or_compute(_dataset_id(data), _TableStore)
+    with store.lock:
+        for col in columns:
+            if col not in store.levels:
+                store.levels[col] = column_levels(data, col)
+        missing = [(a, b) for a, b in pairs if (a, b) not in store.tables and (b, a) not in store.tables]
+        if missing:
+            store.tables.update(count_tables(data, missing, store.levels))
+        tables = {}
+        for a, b in pairs:
+            table = store.tables[(a, b)] if (a, b) in store.tables else store.tables[(b, a)].T
+            tables[(a, b)] = pd.DataFrame(table, index=pd.Index(store.levels[a], name=a),
+                                          columns=pd.Index(store.levels[b], name=b))
+    return tables
+
+
+# Table without the levels that never occur with a value of the other column
+def _observed(table):
+    table = np.asarray(table, dtype='float64')
+    return table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+
+
+def _expected(table):
+    return np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+
+
+def cramers_v(table):
+    table = _observed(table)
+    n = table.sum()
+    if n == 0 or min(table.shape) < 2:
+        return np.nan
+    expected = _expected(table)
+    chi2 = ((table - expected) ** 2 / expected).sum()
+    return float(np.sqrt(chi2 / n / (min(table.shape) - 1)))
+
+
+# Chi-square test of independence of one table, or Fisher's exact test for
+# 2x2 tables with small expected counts
+def association_test(table):
+    observed = _observed(table)
+    n = int(observed.sum())
+    result = {'rows': n, 'levels': f'{observed.shape[0]} x {observed.shape[1]}', 'test': None, 'statistic': np.nan,
+              'dof': np.nan, 'pvalue': np.nan, 'cramers_v': np.nan, 'low_expected': False}
+    if n == 0 or min(observed.shape) < 2:
+        return result
+    expected = _expected(observed)
+    chi2 = float(((observed - expected) ** 2 / expected).sum())
+    dof = (observed.shape[0] - 1) * (observed.shape[1] - 1)
+    result.update({'test': 'Chi-square', 'statistic': chi2, 'dof': dof, 'pvalue': float(stats.chi2.sf(chi2, dof)),
+                   'cramers_v': float(np.sqrt(chi2 / n / (min(observed.shape) - 1))),
+                   # Cochran's rule: no more than 20% of the cells expected below 5
+                   'low_expected': bool((expected < MIN_EXPECTED).mean() > 0.2)})
+    if observed.shape == (2, 2) and (expected < MIN_EXPECTED).any():
+        odds_ratio, pvalue = stats.fisher_exact(observed)
+        result.update({'test': 'Fisher exact', 'statistic': float(odds_ratio), 'dof': np.nan, 'pvalue': float(pvalue),
+                       'low_expected': False})
+    return result
+
+
+def _in_threads(fn, items, workers=None):
+    tasks = [items[i:i + PAIRS_PER_TASK] for i in range(0, len(items), PAIRS_PER_TASK)]
+    if len(tasks) > 1:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            return [value for chunk in pool.map(lambda task: [fn(item) for item in task], tasks) for value in chunk]
+    return [fn(item) for item in items]
+
+
+# Tests of every pair of tables (see pair_tables), with p-values adjusted by the
+# correction (a key of CORRECTIONS). Returns the pairs from the strongest
+# evidence of association and the Cramer's V matrix of the columns.
+def association_tests(tables, correction='Holm', alpha=0.05, workers=None):
+    from statsmodels.stats.multitest import multipletests
+    pairs = list(tables)
+    results = pd.DataFrame(_in_threads(lambda pair: association_test(tables[pair].to_numpy()), pairs, workers),
+                           columns=['rows', 'levels', 'test', 'statistic', 'dof', 'pvalue', 'cramers_v', 'low_expected'])
+    results.insert(0, 'column_1', [a for a, _ in pairs])
+    results.insert(1, 'column_2', [b for _, b in pairs])
+
+    tested = results['pvalue'].notna().to_numpy()
+    adjusted = results['pvalue'].to_numpy(dtype='float64', copy=True)
+    method = CORRECTIONS[correction]
+    if method is not None and tested.any():
+        adjusted[tested] = multipletests(adjusted[tested], alpha=alpha, method=method)[1]
+    results.insert(results.columns.get_loc('pvalue') + 1, 'adjusted_pvalue', adjusted)
+    results['significant'] = results['adjusted_pvalue'] < alpha
+    results = results.sort_values(['adjusted_pvalue', 'cramers_v'], ascending=[True, False], na_position='last')
+
+    columns = list(dict.fromkeys(col for pair in pairs for col in pair))
+    matrix = pd.DataFrame(np.eye(len(columns)), index=columns, columns=columns)
+    for (a, b), value in zip(pairs, results.sort_index()['cramers_v']):
+        matrix.loc[a, b] = matrix.loc[b, a] = value
+    return {'pairs': results.reset_index(drop=True), 'cramers_v': matrix, 'correction': correction, 'tested': int(tested.sum())}
@@ -0,0 +1,332 @@
+import os
+import time
+import pickle
+import fnmatch
+import sqlite3
+import hashlib
+import pathlib
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key, set_dataset_key, extend_indexes, detect_date_columns
+from out_of_core import SPILL_DIR, LazyDataset, quote, seed_summary
+from readers import file_format, read_file
+from sketches import DatasetSketch, seed_sketch
+from instrumentation import span, set_size
+
+# Data sources that grow over time, refreshed incrementally:
+# - a watched folder, where every new file holds new rows
+# - a table of a local SQLite database, where new rows have a larger rowid
+#   (or a larger value of an increasing key column)
+# Only the files or rows added since the last refresh are read. They are
+# appended to a columnar store of Parquet part files, and merged into a
+# sketch and column statistics kept with the store, so summaries are never
+# recomputed from all the rows. Datasets loaded in memory grow by appending
+# the new rows, with their cached filter indexes extended instead of rebuilt.
+# Rows changed or deleted at the source after they were ingested are not seen.
+
+SOURCES_DIR = os.environ.get('DATA_EXPRESS_SOURCES_DIR', os.path.join(SPILL_DIR, 'sources'))
+
+# Sources are checked for new data at most this often, unless a refresh is requested
+REFRESH_SECONDS = int(os.environ.get('DATA_EXPRESS_SOURCE_REFRESH_SECONDS', 30))
+
+# Rows read from SQLite at a time, each batch becomes one part file
+CHUNK_ROWS = 500_000
+
+# Files modified more recently than this may still be being written and wait for the next refresh
+SETTLE_SECONDS = 2
+
+PART_PATTERN = 'part-*.parquet'
+KEY_COL = '_dx_source_key'
+
+_sources = DatasetCache(max_entries=16)
+_stores = DatasetCache(max_entries=8)
+# Latest in-memory frame of each source with the number of parts it holds
+_frames = DatasetCache(max_entries=4)
+
+
+## ===============================================
+## Statistics of the store
+## ===============================================
+
+# Sketch, missing values and bounds of every column, merged chunk by chunk
+class StoreStats:
+    def __init__(self):
+        self.sketch = None
+        self.nulls = {}
+        self.minimum = {}
+        self.maximum = {}
+
+    def update(self, chunk):
+        self.sketch = (self.sketch or DatasetSketch(chunk.dtypes)).update(chunk)
+        for col in chunk.columns:
+            valid = chunk[col].dropna()
+            self.nulls[col] = self.nulls.get(col, 0) + len(chunk) - len(valid)
+            if len(valid) == 0:
+                continue
+            try:
+                low, high = valid.min(), valid.max()
+                self.minimum[col] = min(self.minimum.get(col, low), low)
+                self.maximum[col] = max(self.maximum.get(col, high), high)
+            except TypeError:
+                # Values that cannot be ordered have no bounds
+                self.minimum.pop(col, None)
+                self.maximum.pop(col, None)
+
+    # Column summary with the layout of LazyDataset.summary
+    def summary(self, column_types):
+        rows = self.sketch.rows if self.sketch is not None else 0
+        distinct = self.sketch.distinct_counts() if self.sketch is not None else {}
+        return pd.DataFrame([{'column_name': col, 'column_type': column_type,
+                              'min': str(self.minimum[col]) if col in self.minimum else None,
+                              'max': str(self.maximum[col]) if col in self.maximum else None,
+                              'approx_unique': distinct.get(col, 0),
+                              'null_percentage': 100 * self.nulls.get(col, 0) / rows if rows else 0.0}
+                             for col, column_type in column_types.items()])
+
+
+## ===============================================
+## Sources
+## ===============================================
+
+# A source and its store: the part files and a state file with what was
+# ingested so far, the number of rows and the statistics
+class IncrementalSource:
+    def __init__(self, description):
+        self.description = description
+        self.id = hashlib.blake2b(repr(description).encode(), digest_size=16).hexdigest()
+        self.directory = os.path.join(SOURCES_DIR, self.id)
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _state_path(self):
+        return os.path.join(self.directory, 'state.pkl')
+
+    def _load_state(self):
+        if not os.path.exists(self._state_path()):
+            return {'parts': [], 'rows': 0, 'files': {}, 'rejected': {}, 'last_key': None, 'stats': StoreStats()}
+        with open(self._state_path(), 'rb') as f:
+            return pickle.load(f)
+
+    # The state is replaced at once, after the part files it lists are written
+    def _save_state(self, state):
+        with open(self._state_path() + '.part', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(self._state_path() + '.part', self._state_path())
+
+    def part_paths(self):
+        return [os.path.join(self.directory, part) for part in self.state['parts']]
+
+    # New rows as (label, DataFrame, update of the state once they are stored)
+    def _new_chunks(self, state):
+        raise NotImplementedError
+
+    # Rows that cannot be stored stop the refresh, they cannot be skipped
+    def _reject(self, state, label, reason):
+        raise ValueError(f'{label}: {reason}')
+
+    # Table of a chunk with the columns and types of the stored parts
+    def _conform(self, chunk, schema):
+        chunk = chunk.rename(columns=str)
+        if schema is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            # Columns empty in the first chunk are stored as text
+            return table.cast(pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                         for field in table.schema], metadata=table.schema.metadata))
+        if set(chunk.columns) != set(schema.names):
+            raise ValueError('its columns differ from the stored data')
+        try:
+            return pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            raise ValueError(f'its column types differ from the stored data ({e})')
+
+    # Ingest what is new at the source. Returns the rows and files added and
+    # the files rejected in this refresh.
+    def refresh(self, force=False):
+        result = {'rows': 0, 'parts': 0, 'files': [], 'rejected': {}, 'seconds': 0.0}
+        with self._lock:
+            if not force and time.time() - self.checked_at < REFRESH_SECONDS:
+                return result
+            start = time.perf_counter()
+            os.makedirs(self.directory, exist_ok=True)
+            # Read again from disk: the statistics of the current state may be cached and shared
+            state = self._load_state()
+            rejected = dict(state['rejected'])
+            schema = None
+            if state['parts']:
+                schema = pq.read_schema(os.path.join(self.directory, state['parts'][0]))
+            with span('load_data.refresh') as record:
+                for label, chunk, commit in self._new_chunks(state):
+                    if len(chunk):
+                        try:
+                            table = self._conform(chunk, schema)
+                        except ValueError as e:
+                            self._reject(state, label, str(e))
+                            continue
+                        schema = schema or table.schema
+                        part = f'part-{len(state["parts"]):06d}.parquet'
+                        path = os.path.join(self.directory, part)
+                        pq.write_table(table, path + '.part')
+                        os.replace(path + '.part', path)
+                        state['parts'].append(part)
+                        state['rows'] += len(chunk)
+                        # Statistics of the rows as they are read back from the store
+                        state['stats'].update(table.to_pandas())
+                        result['rows'] += len(chunk)
+                        result['parts'] += 1
+                    commit(state)
+                    self._save_state(state)
+                    if label not in result['files'] and label in state['files']:
+                        result['files'].append(label)
+                record['rows'] = result['rows']
+            self._save_state(state)
+            result['rejected'] = {label: reason for label, (version, reason) in state['rejected'].items()
+                                  if rejected.get(label) != (version, reason)}
+            self.state = state
+            self.checked_at = time.time()
+            result['seconds'] = time.perf_counter() - start
+        return result
+
+
+# Files added to a folder (not its subfolders) in any readable format; files
+# already ingested are not read again, even if they changed
+class WatchedFolder(IncrementalSource):
+    def __init__(self, folder, pattern='*'):
+        self.folder = folder
+        self.pattern = pattern
+        self._versions = {}
+        super().__init__(('folder', os.path.abspath(folder), pattern))
+
+    # Files that cannot be read or stored are skipped, and retried once they change
+    def _reject(self, state, label, reason):
+        state['rejected'][label] = (self._versions[label], reason)
+
+    def _new_chunks(self, state):
+        files = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or entry.name.startswith('.') or not fnmatch.fnmatch(entry.name, self.pattern):
+                continue
+            try:
+                file_format(entry.name)
+            except ValueError:
+                continue
+            stat = entry.stat()
+            version = [stat.st_size, stat.st_mtime_ns]
+            if entry.name in state['files'] or state['rejected'].get(entry.name, (None, None))[0] == version \
+                    or time.time() - stat.st_mtime < SETTLE_SECONDS:
+                continue
+            files.append((stat.st_mtime_ns, entry.name, version))
+        # Oldest files first, so rows keep the order they arrived in
+        for _, name, version in sorted(files):
+            self._versions[name] = version
+            try:
+                chunk = read_file(os.path.join(self.folder, name))
+            except Exception as e:
+                self._reject(state, name, f'it could not be read ({e})')
+                continue
+            def commit(state, name=name, version=version):
+                state['files'][name] = version
+                state['rejected'].pop(name, None)
+            yield name, chunk, commit
+
+
+# Rows added to a SQLite table, in batches after the largest key ingested
+class SQLiteTable(IncrementalSource):
+    def __init__(self, database, table, key_column=''):
+        self.database = database
+        self.table = table
+        self.key_column = key_column
+        super().__init__(('sqlite', os.path.abspath(database), table, key_column))
+
+    def _new_chunks(self, state):
+        key = quote(self.key_column) if self.key_column else 'rowid'
+        sql = f'SELECT {key} AS {KEY_COL}, * FROM {quote(self.table)}'
+        params = []
+        if state['last_key'] is not None:
+            sql += f' WHERE {key} > ?'
+            params.append(state['last_key'])
+        sql += f' ORDER BY {key}'
+        con = connect_sqlite(self.database)
+        try:
+            for chunk in pd.read_sql_query(sql, con, params=params, chunksize=CHUNK_ROWS):
+                if chunk.empty:
+                    continue
+                last_key = chunk[KEY_COL].iloc[-1]
+                last_key = last_key.item() if hasattr(last_key, 'item') else last_key
+                def commit(state, last_key=last_key):
+                    state['last_key'] = last_key
+                yield self.table, chunk.drop(columns=KEY_COL), commit
+        finally:
+            con.close()
+
+
+# Read-only connection, so the app never locks or changes the database
+def connect_sqlite(database):
+    return sqlite3.connect(pathlib.Path(database).absolute().as_uri() + '?mode=ro', uri=True)
+
+
+def sqlite_tables(database):
+    con = connect_sqlite(database)
+    try:
+        return [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                              "AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    finally:
+        con.close()
+
+
+# The source of a configuration, ('folder', path) or ('sqlite', database, table, key column),
+# shared by every session
+def get_source(config):
+    def create():
+        if config[0] == 'folder':
+            return WatchedFolder(*config[1:])
+        return SQLiteTable(*config[1:])
+    return _sources.get_or_compute(config, create)
+
+
+## ===============================================
+## Datasets of a source
+## ===============================================
+
+# Out-of-core dataset over the part files, with the summary and sketch of the store
+def open_store(source):
+    if not source.state['parts']:
+        raise ValueError('The source has no rows yet.')
+    def create():
+        data = LazyDataset(os.path.join(source.directory, PART_PATTERN))
+        seed_summary(data, source.state['stats'].summary(data.column_types))
+        seed_sketch(data, source.state['stats'].sketch)
+        return data
+    return _stores.get_or_compute((source.id, len(source.state['parts'])), create)
+
+
+# In-memory dataset of the source. The frame of an earlier refresh is extended
+# with the parts written since, and its cached filter indexes and parsed dates
+# are carried over.
+def load_frame(source):
+    parts = source.part_paths()
+    if not parts:
+        raise ValueError('The source has no rows yet.')
+    cached = _frames.get(source.id)
+    if cached is not None and cached[0] == len(parts):
+        return cached[1]
+
+    with span('load_data') as record:
+        if cached is not None and cached[0] < len(parts):
+            before = cached[1]
+            appended = pd.concat([read_file(part) for part in parts[cached[0]:]], ignore_index=True)
+            data = pd.concat([before, appended], ignore_index=True)
+            key = hashlib.blake2b(f'{dataset_key(before)}|{dataset_key(appended)}'.encode(), digest_size=16).hexdigest()
+            set_dataset_key(data, key)
+            extend_indexes(before, data)
+        else:
+            data = pd.concat([read_file(part) for part in parts], ignore_index=True)
+            dataset_key(data)
+        detect_date_columns(data)
+        set_size(record, data)
+    seed_sketch(data, source.state['stats'].sketch)
+    _frames.put(source.id, (len(parts), data))
+    return data
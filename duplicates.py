@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key
+from out_of_core import LazyDataset, iter_chunks
+
+# Exact and near-duplicate rows, found in one streaming pass over chunks of rows:
+# - exact duplicates from a vectorized 64-bit hash of every row over all columns
+# - near-duplicates from MinHash signatures of the character shingles of the
+#   text of selected columns, matched with banded locality-sensitive hashing
+#   and confirmed by the estimated Jaccard similarity of the signatures
+# Memory holds two 64-bit hashes per row plus a signature, the bucket keys and
+# the beginning of the text per distinct text, never the rows themselves.
+
+CHUNK_ROWS = 200_000
+
+# MinHash permutations, split into LSH bands of ROWS_PER_BAND values. Texts with
+# a Jaccard similarity of s share a band with probability 1 - (1 - s^4)^16,
+# about 0.5 at s = 0.5 and above 0.99 at s = 0.75.
+NUM_PERM = 64
+ROWS_PER_BAND = 4
+BANDS = NUM_PERM // ROWS_PER_BAND
+
+# Shingles are sequences of this many characters
+SHINGLE_SIZE = 3
+
+# Default estimated Jaccard similarity for two texts to be near-duplicates
+THRESHOLD = 0.8
+
+# Shingles hashed at once when computing signatures, bounds the temporary arrays
+SHINGLE_BATCH = 200_000
+
+# Characters of each distinct text kept for the examples
+EXAMPLE_CHARS = 200
+
+_rng = np.random.default_rng(20240609)
+_MULTIPLIERS = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+
+_duplicate_cache = DatasetCache(max_entries=8)
+
+
+# Columns that can be compared as text for near-duplicates
+def text_columns(data):
+    if isinstance(data, LazyDataset):
+        return [col for col, kind in data.column_types.items() if kind == 'VARCHAR']
+    return [col for col in data.columns if ptypes.is_object_dtype(data[col]) or ptypes.is_string_dtype(data[col])]
+
+
+# 64-bit hash of every row over all its columns
+def row_hashes(frame):
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+# Text compared for near-duplicates: the columns joined by spaces, lower-cased,
+# with runs of whitespace collapsed
+def normalized_text(frame, columns):
+    text = frame[columns[0]].astype(str).where(frame[columns[0]].notna(), '')
+    for col in columns[1:]:
+        text = text + ' ' + frame[col].astype(str).where(frame[col].notna(), '')
+    return text.str.lower().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+# MinHash signatures (uint32, NUM_PERM per text) of the character shingles of texts
+def minhash_signatures(texts):
+    signatures = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        shingles, owners, count, end = [], [], 0, start
+        while end < len(texts) and (count < SHINGLE_BATCH or end == start):
+            text = texts[end]
+            grams = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+            shingles.extend(grams)
+            owners.extend([end - start] * len(grams))
+            count += len(grams)
+            end += 1
+        hashes = pd.util.hash_array(np.array(shingles, dtype=object))
+        # Multiply-shift hashing: one random odd multiplier and offset per permutation
+        permuted = ((hashes[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).astype(np.uint32)
+        owners = np.asarray(owners)
+        firsts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        signatures[start:end] = np.minimum.reduceat(permuted, firsts, axis=0)
+        start = end
+    return signatures
+
+
+# One 64-bit key per LSH band of each signature
+def band_keys(signatures):
+    return np.column_stack([pd.util.hash_pandas_object(pd.DataFrame(signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]),
+                                                       index=False).to_numpy() for band in range(BANDS)])
+
+
+# Clusters of similar distinct texts, built as the texts arrive: a new text joins
+# the cluster of the first earlier text sharing a band whose signature agrees on
+# at least threshold of the permutations
+class NearDuplicateIndex:
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.ids = {}
+        self.signatures = []
+        self.texts = []
+        self.cluster = []
+        self.buckets = [{} for _ in range(BANDS)]
+
+    def add(self, text_hashes, texts):
+        seen = np.fromiter(self.ids, dtype=np.uint64, count=len(self.ids))
+        new = pd.unique(text_hashes[~np.isin(text_hashes, seen)])
+        if len(new) == 0:
+            return
+        first = pd.Series(np.arange(len(text_hashes))).groupby(text_hashes).first()
+        new_texts = [texts[i] for i in first.loc[new].to_numpy()]
+        signatures = minhash_signatures(new_texts)
+        keys = band_keys(signatures)
+        for i, text_hash in enumerate(new):
+            distinct_id = len(self.signatures)
+            cluster = None
+            for band in range(BANDS):
+                candidate = self.buckets[band].get(keys[i, band])
+                if candidate is None:
+                    self.buckets[band][keys[i, band]] = distinct_id
+                elif cluster is None and (self.signatures[candidate] == signatures[i]).mean() >= self.threshold:
+                    cluster = self.cluster[candidate]
+            self.ids[text_hash] = distinct_id
+            self.signatures.append(signatures[i])
+            self.texts.append(new_texts[i][:EXAMPLE_CHARS])
+            self.cluster.append(distinct_id if cluster is None else cluster)
+
+    def clusters_of(self, text_hashes):
+        ids = pd.Series(self.ids)
+        return np.asarray(self.cluster)[ids.reindex(text_hashes).to_numpy(dtype=np.int64)]
+
+
+class DuplicateReport:
+    def __init__(self, hashes, clusters=None, index=None, text_columns=()):
+        self.rows = len(hashes)
+        # Rows equal to an earlier row
+        self.exact = pd.Series(hashes).duplicated().to_numpy()
+        # Rows whose text is a near-duplicate (or a copy) of an earlier row's text
+        self.near = None if clusters is None else pd.Series(clusters).duplicated().to_numpy()
+        self.text_columns = list(text_columns)
+        self._hashes = hashes
+        self._clusters = clusters
+        self._index = index
+
+    @property
+    def exact_count(self):
+        return int(self.exact.sum())
+
+    @property
+    def near_count(self):
+        return None if self.near is None else int(self.near.sum())
+
+    # Positions of the first row of each group of exactly equal rows, with the group size, largest first
+    def exact_groups(self, limit=20):
+        hashes = pd.Series(self._hashes)
+        counts = hashes.value_counts()
+        counts = counts[counts > 1].head(limit)
+        firsts = hashes.drop_duplicates()
+        firsts = pd.Series(firsts.index, index=firsts.to_numpy())
+        return pd.DataFrame({'first_row': firsts.loc[counts.index].to_numpy(), 'count': counts.to_numpy()})
+
+    # Clusters of more than one distinct text, largest first: rows, distinct texts and example texts
+    def near_groups(self, limit=20, examples=3):
+        if self._clusters is None:
+            return None
+        rows = pd.Series(self._clusters).value_counts()
+        members = pd.Series(np.arange(len(self._index.cluster))).groupby(np.asarray(self._index.cluster))
+        sizes = members.size()
+        clusters = [cluster for cluster in rows.index if sizes.get(cluster, 0) > 1][:limit]
+        return pd.DataFrame({'rows': rows.loc[clusters].to_numpy(),
+                             'distinct_texts': sizes.loc[clusters].to_numpy(),
+                             'examples': [' | '.join(self._index.texts[i] for i in members.get_group(cluster)[:examples])
+                                          for cluster in clusters]})
+
+
+# Exact duplicates over every column and, when text columns are given, near-duplicates of their text
+def find_duplicates(data, text_columns=(), threshold=THRESHOLD, chunk_rows=CHUNK_ROWS):
+    text_columns = list(text_columns)
+    index = NearDuplicateIndex(threshold) if text_columns else None
+    hashes, text_hashes = [], []
+    for chunk in iter_chunks(data, chunk_rows):
+        hashes.append(row_hashes(chunk))
+        if index is not None:
+            texts = normalized_text(chunk, text_columns).to_numpy(dtype=object)
+            chunk_text_hashes = pd.util.hash_array(texts)
+            index.add(chunk_text_hashes, texts)
+            text_hashes.append(chunk_text_hashes)
+    hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+    clusters = None
+    if index is not None:
+        clusters = index.clusters_of(np.concatenate(text_hashes)) if text_hashes else np.empty(0, dtype=np.int64)
+    return DuplicateReport(hashes, clusters, index, text_columns)
+
+
+# Duplicate report of a (filtered) dataset, cached per dataset, text columns and threshold
+def duplicates(data, text_columns=(), threshold=THRESHOLD):
+    key = (data.key, data.filter_text) if isinstance(data, LazyDataset) else dataset_key(data)
+    return _duplicate_cache.get_or_compute((key, tuple(text_columns), threshold),
+                                           lambda: find_duplicates(data, text_columns, threshold))
@@ -0,0 +1,153 @@
+import os
+import time
+import pickle
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from out_of_core import LazyDataset
+
+# Approximate explanations (global feature importance) of the model saved by
+# AutoML, computed on samples of rows instead of the whole dataset:
+# - tree models get mean absolute SHAP values from TreeSHAP: LightGBM's own
+#   implementation, or the shap package when installed, against a small
+#   background sample of the training rows
+# - other models, or tree models shap cannot handle, get the permutation
+#   importance of each feature on a sample of rows
+# Features are the columns after PyCaret's preprocessing (e.g. one-hot
+# encoded levels). The explanations are saved next to the model file, keyed
+# by a hash of its contents, so they are computed once per trained model.
+
+# Rows the importances are measured on
+EXPLAIN_ROWS = 1000
+
+# Rows of the background sample the SHAP values are taken against
+BACKGROUND_ROWS = 100
+
+# Shuffles of each feature for the permutation importance
+PERMUTATION_REPEATS = 5
+
+SEED = 0
+
+# Scorers of the permutation importance per experiment type (see tuning.METRICS)
+SCORING = {'Classification': 'accuracy', 'Regression': 'r2'}
+
+# Model classes explained with TreeSHAP
+TREE_MODELS = {'DecisionTreeClassifier', 'DecisionTreeRegressor', 'RandomForestClassifier', 'RandomForestRegressor',
+               'ExtraTreesClassifier', 'ExtraTreesRegressor', 'GradientBoostingClassifier', 'GradientBoostingRegressor',
+               'LGBMClassifier', 'LGBMRegressor', 'XGBClassifier', 'XGBRegressor', 'CatBoostClassifier', 'CatBoostRegressor'}
+
+
+def explanations_path(model_path):
+    return model_path.removesuffix('.pkl') + '.explanations.pkl'
+
+
+def model_digest(model_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Saved explanations of the model file, None when missing or made for an earlier model
+def cached_explanations(model_path):
+    path = explanations_path(model_path)
+    if not (os.path.exists(model_path) and os.path.exists(path)):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return saved['explanations'] if saved.get('model_digest') == model_digest(model_path) else None
+
+
+def _save(model_path, digest, explanations):
+    path = explanations_path(model_path)
+    # Written under a temporary name so a reader never sees a partial file
+    partial = f'{path}.{os.getpid()}-{threading.get_ident()}.partial'
+    with open(partial, 'wb') as f:
+        pickle.dump({'model_digest': digest, 'explanations': explanations}, f)
+    os.replace(partial, path)
+
+
+def _sample(data, rows, seed=SEED):
+    if isinstance(data, LazyDataset):
+        return data.sample_rows(rows)
+    return data.sample(n=min(rows, len(data)), random_state=seed) if len(data) > rows else data
+
+
+# Mean absolute SHAP value per feature; multi-class values are averaged over the classes
+def _mean_abs(values, features):
+    values = np.abs(np.asarray(values, dtype='float64'))
+    if values.ndim == 3:
+        # (rows, features, classes) from recent shap releases
+        values = values.mean(axis=2)
+    return pd.Series(values.mean(axis=0), index=features)
+
+
+# TreeSHAP of LightGBM models, from LightGBM's own contributions (no shap package needed)
+def _lightgbm_shap(model, X):
+    contributions = model.booster_.predict(X, pred_contrib=True)
+    # One block of feature contributions plus the expected value per class
+    blocks = contributions.reshape(len(X), -1, X.shape[1] + 1)[:, :, :-1]
+    return pd.Series(np.abs(blocks).mean(axis=(0, 1)), index=X.columns)
+
+
+def _tree_shap(model, X, background):
+    import shap
+    explainer = shap.TreeExplainer(model, data=background, feature_perturbation='interventional')
+    values = explainer.shap_values(X, check_additivity=False)
+    if isinstance(values, list):
+        values = np.stack(values, axis=2)
+    return _mean_abs(values, X.columns)
+
+
+def _permutation(model, X, y, experiment):
+    from sklearn.inspection import permutation_importance
+    result = permutation_importance(model, X, y, scoring=SCORING[experiment], n_repeats=PERMUTATION_REPEATS,
+                                    random_state=SEED)
+    return pd.Series(result.importances_mean, index=X.columns), pd.Series(result.importances_std, index=X.columns)
+
+
+# Feature importance of the PyCaret pipeline saved at model_path, trained to
+# predict target in data, saved next to the model unless already there
+def explain_model(data, target, experiment, model_path):
+    cached = cached_explanations(model_path)
+    if cached is not None:
+        return cached
+    import joblib
+    digest = model_digest(model_path)
+    pipeline = joblib.load(model_path)
+    preprocess, model = pipeline[:-1], pipeline.steps[-1][1]
+
+    start = time.perf_counter()
+    sample = _sample(data, EXPLAIN_ROWS)
+    sample = sample[sample[target].notna()]
+    X, y = preprocess.transform(sample.drop(columns=[target]), sample[target])
+    background = X.sample(n=min(BACKGROUND_ROWS, len(X)), random_state=SEED)
+
+    name = type(model).__name__
+    importance, spread, method = None, None, None
+    if name in TREE_MODELS:
+        try:
+            if name.startswith('LGBM'):
+                importance, method = _lightgbm_shap(model, X), 'TreeSHAP (LightGBM)'
+            else:
+                importance, method = _tree_shap(model, X, background), 'TreeSHAP'
+        except Exception:
+            # shap is not installed or does not support the model
+            importance = None
+    if importance is None:
+        (importance, spread), method = _permutation(model, X, y, experiment), 'Permutation importance'
+
+    table = pd.DataFrame({'feature': importance.index, 'importance': importance.to_numpy()})
+    if spread is not None:
+        table['std'] = spread.to_numpy()
+    table = table.sort_values('importance', ascending=False, ignore_index=True)
+    explanations = {'model': name, 'target': target, 'method': method, 'importance': table, 'rows': len(X),
+                    'background_rows': len(background) if method == 'TreeSHAP' else None,
+                    'seconds': time.perf_counter() - start}
+    _save(model_path, digest, explanations)
+    return explanations
@@ -0,0 +1,201 @@
+import os
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from filter_engine import dataset_key
+from out_of_core import LazyDataset, iter_chunks
+from instrumentation import span, set_size
+
+# Export of the filtered dataset and of result tables to CSV, Parquet or XLSX.
+# The file is produced by a generator of byte blocks, one chunk of rows at a
+# time (from slices of DataFrames, from DuckDB for out-of-core datasets), and
+# written to an export file on the server, so no serialized copy of the whole
+# dataset is held in memory. Export files are named after the dataset, its
+# filter and the format, and reused while they exist.
+
+EXPORT_DIR = os.environ.get('DATA_EXPRESS_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'data_express_exports'))
+
+# Exports larger than this are not offered through the download button, which
+# keeps the file in the server's memory while the session lasts
+DOWNLOAD_MAX_MB = int(os.environ.get('DATA_EXPRESS_EXPORT_DOWNLOAD_MB', 200))
+
+CHUNK_ROWS = 100_000
+
+# Bytes read at once when copying the XLSX file
+BLOCK_BYTES = 1 << 20
+
+# Rows per worksheet in XLSX files (Excel's limit, less the header); larger exports continue on new sheets
+XLSX_MAX_ROWS = 1_048_575
+
+# Format: (file extension, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Excel (XLSX)': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+# Result tables keep their index (group names of post-hoc matrices, factors of ANOVA tables) as columns
+def _prepare(data, index):
+    if index and not isinstance(data, LazyDataset):
+        data = data.reset_index()
+    if isinstance(data, pd.DataFrame):
+        # Column names must be text in Parquet files
+        data = data.rename(columns=str)
+    return data
+
+
+# Writes go to a list of byte blocks the generator drains after each chunk
+class _Sink:
+    def __init__(self):
+        self.blocks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.blocks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.blocks)
+        self.blocks = []
+        return data
+
+
+def _csv_chunks(data, chunk_rows):
+    header = True
+    for chunk in iter_chunks(data, chunk_rows):
+        yield chunk.to_csv(index=False, header=header).encode()
+        header = False
+    if header:
+        # No rows: the header alone
+        yield data.head(0).to_csv(index=False).encode() if isinstance(data, pd.DataFrame) \
+            else ','.join(data.columns).encode() + b'\n'
+
+
+# Schema of a DataFrame from its first chunk; columns missing from the whole
+# chunk take the type of their first present value
+def _frame_schema(data, table):
+    import pyarrow as pa
+    fields = []
+    for field in table.schema:
+        if pa.types.is_null(field.type) and data[field.name].first_valid_index() is not None:
+            value = data[field.name].loc[data[field.name].first_valid_index()]
+            field = field.with_type(pa.array([value], from_pandas=True).type)
+        fields.append(field)
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def _parquet_chunks(data, chunk_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = _Sink()
+    if isinstance(data, LazyDataset):
+        # DuckDB's Arrow batches keep one schema for the whole result
+        reader = data.record_batches(chunk_rows)
+        schema = reader.schema
+        tables = (pa.Table.from_batches([batch]) for batch in reader)
+    else:
+        schema = None if len(data) else pa.Schema.from_pandas(data, preserve_index=False)
+        tables = (pa.Table.from_pandas(chunk, preserve_index=False) for chunk in iter_chunks(data, chunk_rows))
+    writer = None if schema is None else pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for table in tables:
+        if writer is None:
+            schema = _frame_schema(data, table)
+            writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+        # Later chunks take the types of the first one, e.g. numbers with missing values
+        writer.write_table(table if table.schema.equals(schema) else table.cast(schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+# Cell values openpyxl can write: missing values become empty cells, time zones are dropped
+def _xlsx_values(chunk):
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if isinstance(chunk[col].dtype, pd.DatetimeTZDtype):
+            chunk[col] = chunk[col].dt.tz_localize(None)
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def _xlsx_chunks(data, chunk_rows):
+    import openpyxl
+    # Write-only worksheets keep their rows in temporary files, not in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet, sheet_rows = None, XLSX_MAX_ROWS
+    for chunk in iter_chunks(data, chunk_rows):
+        for row in _xlsx_values(chunk):
+            if sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f'Sheet{len(workbook.worksheets) + 1}')
+                sheet.append([str(col) for col in data.columns])
+                sheet_rows = 0
+            sheet.append([value.item() if isinstance(value, np.generic) else value for value in row])
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet('Sheet1').append([str(col) for col in data.columns])
+    # The workbook is a zip archive, assembled in a temporary file and read back in blocks
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            block = f.read(BLOCK_BYTES)
+            if not block:
+                break
+            yield block
+
+
+# Byte blocks of the export file of a DataFrame or an out-of-core dataset
+def export_chunks(data, fmt, chunk_rows=CHUNK_ROWS, index=False):
+    data = _prepare(data, index)
+    writers = {'CSV': _csv_chunks, 'Parquet': _parquet_chunks, 'Excel (XLSX)': _xlsx_chunks}
+    for block in writers[fmt](data, chunk_rows):
+        if block:
+            yield block
+
+
+def export_name(name, fmt):
+    return f'{name}.{EXPORT_FORMATS[fmt][0]}'
+
+
+# Path of the export file of a dataset or table, written from export_chunks unless it already exists
+def export_file(data, fmt, name='data', chunk_rows=CHUNK_ROWS, index=False):
+    if isinstance(data, LazyDataset):
+        key = f'{data.key}|{data.filter_text}'
+    else:
+        key = dataset_key(data.reset_index() if index else data)
+    digest = hashlib.blake2b(f'{key}|{fmt}|{index}'.encode(), digest_size=16).hexdigest()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f'{name}-{digest}.{EXPORT_FORMATS[fmt][0]}')
+    if os.path.exists(path):
+        return path
+
+    with span('export') as record:
+        set_size(record, data)
+        # Written under a temporary name so an interrupted export is not reused
+        partial = f'{path}.{os.getpid()}-{threading.get_ident()}.partial'
+        try:
+            with open(partial, 'wb') as f:
+                for block in export_chunks(data, fmt, chunk_rows, index):
+                    f.write(block)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return path
+
+
+def downloadable(path):
+    return os.path.getsize(path) <= DOWNLOAD_MAX_MB * 2**20
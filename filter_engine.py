@@ -0,0 +1,631 @@
+import re
+import bisect
+import hashlib
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+from pandasql import sqldf
+from dataset_cache import DatasetCache
+
+# Filter engine for the SQLite WHERE clause typed by the user.
+# Simple conjunctive predicates (=, <>, <, <=, >, >=, BETWEEN, IN) on plain
+# numeric, text or datetime columns are answered from per-column indexes that
+# are built on demand and cached per dataset, and predicates on
+# strftime('%Y', column) from date parts parsed once per dataset and compared
+# as integers. Anything else falls back to pandasql.
+# Results are cached by their set of AND terms, so a filter refined with an
+# extra AND term only evaluates that term over the previous result rows.
+
+ROWID_COL = '_dx_rowid'
+
+# Names of SQLite's implicit row number
+ROWID_NAMES = {'ROWID', '_ROWID_', 'OID'}
+
+# SQLite table of the rows left to filter when only part of the filter runs in SQL
+SUBSET_TABLE = '_dx_rows'
+
+# Date parts of strftime('%X', column) answered from parsed dates, with the
+# width of the zero-padded text SQLite returns for them
+DATE_PARTS = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2, '%w': 1, '%j': 3}
+
+# ISO 8601 dates and times that SQLite's date functions read as written
+_ISO_DATE_RE = r'\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?'
+
+# Text of datetime64 values in the SQLite table built by pandasql
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+_index_cache = DatasetCache(max_entries=128)
+_result_cache = DatasetCache(max_entries=64)
+_date_cache = DatasetCache(max_entries=128)
+
+# Names of the recently indexed columns with their index types, across datasets,
+# so a new version of a dataset has the columns filtered on indexed in advance
+_indexed_columns = DatasetCache(max_entries=64)
+
+_TOKEN_RE = re.compile(r'''
+      (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>`[^`]*`|"(?:[^"]|"")*"|\[[^\]]*\])
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<op><=|>=|<>|!=|==|=|<|>)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<punct>[(),+\-])
+    | (?P<space>\s+)
+    | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'LIKE', 'GLOB', 'IS', 'NULL',
+             'ESCAPE', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'EXISTS', 'SELECT'}
+
+_FLIPPED_OPS = {'=': '=', '<>': '<>', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+# Fingerprint of a dataset, used as the cache key for its indexes.
+# The frame is hashed once and the key is kept in data.attrs together with
+# its shape. pandas copies attrs onto derived frames (dropna, sample, ...),
+# so a key whose shape no longer matches is recomputed.
+def dataset_key(data):
+    key = data.attrs.get('dataset_key')
+    if key is None or data.attrs.get('dataset_shape') != data.shape:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr([(str(c), str(t)) for c, t in data.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        key = digest.hexdigest()
+        set_dataset_key(data, key)
+    return key
+
+
+def set_dataset_key(data, key):
+    data.attrs['dataset_key'] = key
+    data.attrs['dataset_shape'] = data.shape
+
+
+## ===============================================
+## Column indexes
+## ===============================================
+
+# Sorted array of the non-null values of a column with their row ids,
+# answers range predicates with two binary searches
+class SortedIndex:
+    def __init__(self, values):
+        valid = np.flatnonzero(~pd.isna(values))
+        order = np.argsort(values[valid], kind='stable')
+        self.row_ids = valid[order]
+        self.sorted_values = values[self.row_ids]
+
+    def range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        start, stop = 0, len(self.sorted_values)
+        if low is not None:
+            start = np.searchsorted(self.sorted_values, low, side='left' if low_inclusive else 'right')
+        if high is not None:
+            stop = np.searchsorted(self.sorted_values, high, side='right' if high_inclusive else 'left')
+        return self.row_ids[start:max(start, stop)]
+
+    # Index after appending values with row ids from offset on: the new values
+    # are sorted and merged in, after the equal values already indexed
+    def appended(self, values, offset):
+        new = SortedIndex(values)
+        positions = np.searchsorted(self.sorted_values, new.sorted_values, side='right')
+        index = object.__new__(SortedIndex)
+        index.row_ids = np.insert(self.row_ids, positions, new.row_ids + offset)
+        index.sorted_values = np.insert(self.sorted_values, positions, new.sorted_values)
+        return index
+
+
+# Categorical code map of a column: each distinct value points to the
+# contiguous block of its row ids, answers equality and IN predicates
+class HashIndex:
+    def __init__(self, values):
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        valid = np.flatnonzero(codes >= 0)
+        order = np.argsort(codes[valid], kind='stable')
+        self.row_ids = valid[order]
+        counts = np.bincount(codes[valid], minlength=len(uniques))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.codes = {value: code for code, value in enumerate(uniques.tolist())}
+
+    def lookup(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            return self.row_ids[:0]
+        return self.row_ids[self.offsets[code]:self.offsets[code + 1]]
+
+    def lookup_many(self, values):
+        blocks = [self.lookup(value) for value in set(values)]
+        if not blocks:
+            return self.row_ids[:0]
+        return np.sort(np.concatenate(blocks))
+
+    # Index after appending values with row ids from offset on: new distinct
+    # values get the next codes, and the rows of each value go after its block
+    def appended(self, values, offset):
+        local_codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        codes = dict(self.codes)
+        mapping = np.array([codes.setdefault(value, len(codes)) for value in uniques.tolist()], dtype=np.int64)
+        valid = np.flatnonzero(local_codes >= 0)
+        new_codes = mapping[local_codes[valid]]
+        order = np.argsort(new_codes, kind='stable')
+        counts = np.bincount(new_codes, minlength=len(codes))
+        # Old blocks end where they did; blocks of new values start at the end
+        old_counts = np.zeros(len(codes), dtype=np.int64)
+        old_counts[:len(self.offsets) - 1] = np.diff(self.offsets)
+        block_ends = np.full(len(codes), self.offsets[-1])
+        block_ends[:len(self.offsets) - 1] = self.offsets[1:]
+        index = object.__new__(HashIndex)
+        index.row_ids = np.insert(self.row_ids, np.repeat(block_ends, counts), valid[order] + offset)
+        index.offsets = np.concatenate([[0], np.cumsum(old_counts + counts)])
+        index.codes = codes
+        return index
+
+
+# Range of a sorted datetime64 index bounded by text, compared as the text
+# SQLite stores for datetimes. That text grows with the value, so the bounds
+# are found by a binary search formatting only the values it visits.
+def datetime_text_range(index, low=None, high=None, low_inclusive=True, high_inclusive=True):
+    def text(value):
+        return pd.Timestamp(value).strftime(SQLITE_DATETIME_FORMAT)
+    start, stop = 0, len(index.sorted_values)
+    if low is not None:
+        start = (bisect.bisect_left if low_inclusive else bisect.bisect_right)(index.sorted_values, low, key=text)
+    if high is not None:
+        stop = (bisect.bisect_right if high_inclusive else bisect.bisect_left)(index.sorted_values, high, key=text)
+    return index.row_ids[start:max(start, stop)]
+
+
+# Kind of a column as seen by the fast path: 'numeric', 'text', 'datetime' or
+# None when SQLite's comparison rules would differ from numpy's (bools, mixed)
+def column_kind(series):
+    if ptypes.is_datetime64_dtype(series):
+        return 'datetime'
+    if ptypes.is_bool_dtype(series) or not ptypes.is_numeric_dtype(series):
+        if ptypes.is_object_dtype(series) or ptypes.is_string_dtype(series):
+            if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+                return 'text'
+        return None
+    if ptypes.is_complex_dtype(series):
+        return None
+    return 'numeric'
+
+
+def _column_values(series, kind):
+    if kind == 'datetime':
+        return series.to_numpy(dtype='datetime64[ns]')
+    if kind == 'numeric':
+        return series.to_numpy(dtype='float64', na_value=np.nan) if series.hasnans else series.to_numpy()
+    return series.to_numpy(dtype=object)
+
+
+# Fetch a cached index for a column, building it on first use
+def get_index(data, column, index_type):
+    series = data[column]
+    _indexed_columns.put((column, index_type.__name__), index_type)
+    # Python compares str by code point, the same order as SQLite's default
+    # BINARY collation over UTF-8, so text columns sort as SQLite would
+    return _index_cache.get_or_compute((dataset_key(data), column, index_type.__name__),
+                                       lambda: index_type(_column_values(series, column_kind(series))))
+
+
+# Carry the cached indexes and parsed dates of a dataset over to the dataset
+# grown from it by appending rows, extending them with the new rows only.
+# Columns whose kind changed with the new rows are indexed again on demand.
+def extend_indexes(before, after):
+    old_key, new_key, offset = dataset_key(before), dataset_key(after), len(before)
+    for key, index in _index_cache.items():
+        if key[0] != old_key or key[1] not in after.columns:
+            continue
+        kind = column_kind(after[key[1]])
+        if kind != column_kind(before[key[1]]):
+            continue
+        _index_cache.put((new_key,) + key[1:], index.appended(_column_values(after[key[1]].iloc[offset:], kind), offset))
+    for key, dates in _date_cache.items():
+        # Date parts are derived again from the extended dates
+        if key[0] != old_key or len(key) != 2 or key[1] not in after.columns or dates is None:
+            continue
+        new_dates = parse_dates(after[key[1]].iloc[offset:])
+        if new_dates is not None and column_kind(after[key[1]]) == column_kind(before[key[1]]):
+            _date_cache.put((new_key, key[1]), np.concatenate([dates, new_dates]))
+
+
+# (column, index type) of the recently indexed columns present in the dataset
+def indexed_columns(data):
+    return [(key[0], index_type) for key, index_type in _indexed_columns.items() if key[0] in data.columns]
+
+
+def clear_index_cache():
+    _index_cache.clear()
+    _result_cache.clear()
+    _date_cache.clear()
+
+
+## ===============================================
+## Parsed dates
+## ===============================================
+
+# Datetimes of a column as datetime64[ns] with nulls as NaT, for datetime64
+# columns and for text columns holding only ISO 8601 dates that SQLite reads
+# the same way; None for other columns. Invalid calendar dates such as
+# 2024-02-30, which SQLite would roll over, leave the column unparsed.
+def parse_dates(series):
+    kind = column_kind(series)
+    if kind == 'datetime':
+        return series.to_numpy(dtype='datetime64[ns]')
+    if kind != 'text':
+        return None
+    valid = series.dropna()
+    if valid.empty or not re.fullmatch(_ISO_DATE_RE, valid.iloc[0]) or not valid.str.fullmatch(_ISO_DATE_RE).all():
+        return None
+    parsed = pd.to_datetime(series, format='ISO8601', errors='coerce')
+    if parsed.isna().sum() != series.isna().sum():
+        return None
+    return parsed.to_numpy(dtype='datetime64[ns]')
+
+
+# Parsed datetimes of a column, parsed once per dataset
+def date_values(data, column):
+    return _date_cache.get_or_compute((dataset_key(data), column), lambda: parse_dates(data[column]))
+
+
+# A date part of a column as integers (-1 for nulls), derived once per dataset and part
+def date_part(data, column, part):
+    def compute():
+        index = pd.DatetimeIndex(date_values(data, column))
+        values = {'%Y': index.year, '%m': index.month, '%d': index.day, '%H': index.hour, '%M': index.minute,
+                  '%S': index.second, '%w': (index.dayofweek + 1) % 7, '%j': index.dayofyear}[part]
+        values = np.asarray(values, dtype='float64')
+        return np.where(np.isnan(values), -1, values).astype(np.int16)
+    return _date_cache.get_or_compute((dataset_key(data), column, part), compute)
+
+
+# Parse the dates of every text column that only holds ISO 8601 dates, so
+# date filters never parse strings again; returns the date columns
+def detect_date_columns(data):
+    return [col for col in data.columns
+            if column_kind(data[col]) in ('text', 'datetime') and date_values(data, col) is not None]
+
+
+## ===============================================
+## Parsing the WHERE clause
+## ===============================================
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group(), match.start(), match.end()))
+    return tokens
+
+
+def _is_word(token, word):
+    return token[0] == 'word' and token[1].upper() == word
+
+
+# Split the filter into its top-level AND terms. A filter with a top-level OR
+# is returned as a single term since AND binds tighter than OR. The ANDs of
+# BETWEEN ... AND and of CASE ... END expressions do not split terms.
+def split_conjuncts(text):
+    tokens = tokenize(text)
+    clauses, current, depth, case_depth, pending_between = [], [], 0, 0, False
+    for token in tokens:
+        if token[1] == '(':
+            depth += 1
+        elif token[1] == ')':
+            depth -= 1
+        elif depth == 0 and _is_word(token, 'CASE'):
+            case_depth += 1
+        elif depth == 0 and case_depth > 0 and _is_word(token, 'END'):
+            case_depth -= 1
+        elif depth > 0 or case_depth > 0:
+            pass
+        elif _is_word(token, 'OR'):
+            return [(text.strip(), tokens)] if tokens else []
+        elif _is_word(token, 'BETWEEN'):
+            pending_between = True
+        elif _is_word(token, 'AND'):
+            if pending_between:
+                pending_between = False
+            else:
+                clauses.append(current)
+                current = []
+                continue
+        current.append(token)
+    clauses.append(current)
+
+    if any(not clause for clause in clauses):
+        # Dangling AND, let SQLite report the syntax error
+        return [(text.strip(), tokens)]
+    return [(text[clause[0][2]:clause[-1][3]], clause) for clause in clauses]
+
+
+def _resolve_column(token, data):
+    kind, text = token[0], token[1]
+    if kind == 'quoted':
+        name = text[1:-1].replace('""', '"') if text[0] == '"' else text[1:-1]
+    elif kind == 'word' and text.upper() not in _KEYWORDS:
+        name = text
+    else:
+        return None
+    if name in data.columns:
+        return name
+    # SQLite identifiers are case-insensitive
+    matches = [col for col in data.columns if str(col).lower() == name.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+# Parse a literal starting at tokens[i], returns (value, next position)
+def _parse_literal(tokens, i):
+    sign = 1
+    if i < len(tokens) and tokens[i][1] in ('-', '+'):
+        sign = -1 if tokens[i][1] == '-' else 1
+        i += 1
+    if i >= len(tokens):
+        return None, i
+    kind, text = tokens[i][0], tokens[i][1]
+    if kind == 'number':
+        value = float(text) if any(c in text for c in '.eE') else int(text)
+        return sign * value, i + 1
+    if kind == 'string' and sign == 1:
+        return text[1:-1].replace("''", "'"), i + 1
+    return None, i
+
+
+# Turn a clause into a predicate the indexes can answer:
+# ('cmp', column, op, value), ('between', column, low, high) or ('in', column, values),
+# and ('part', '%Y', predicate) for the same comparisons on strftime('%Y', column)
+def parse_predicate(tokens, data):
+    if len(tokens) < 3:
+        return None
+
+    if (len(tokens) > 7 and _is_word(tokens[0], 'STRFTIME') and tokens[1][1] == '(' and tokens[2][0] == 'string'
+            and tokens[3][1] == ',' and tokens[5][1] == ')' and _resolve_column(tokens[4], data) is not None):
+        part = tokens[2][1][1:-1]
+        predicate = parse_predicate(tokens[4:5] + tokens[6:], data)
+        if part in DATE_PARTS and predicate is not None:
+            return ('part', part, predicate)
+        return None
+
+    column = _resolve_column(tokens[0], data)
+    if column is not None:
+        head = tokens[1]
+        if head[0] == 'op':
+            value, end = _parse_literal(tokens, 2)
+            if value is not None and end == len(tokens):
+                op = '=' if head[1] == '==' else '<>' if head[1] == '!=' else head[1]
+                return ('cmp', column, op, value)
+        elif _is_word(head, 'BETWEEN'):
+            low, i = _parse_literal(tokens, 2)
+            if low is not None and i < len(tokens) and _is_word(tokens[i], 'AND'):
+                high, end = _parse_literal(tokens, i + 1)
+                if high is not None and end == len(tokens):
+                    return ('between', column, low, high)
+        elif _is_word(head, 'IN') and tokens[2][1] == '(' and tokens[-1][1] == ')':
+            values, i = [], 3
+            while i < len(tokens) - 1:
+                value, i = _parse_literal(tokens, i)
+                if value is None:
+                    return None
+                values.append(value)
+                if tokens[i][1] == ',':
+                    i += 1
+                elif i != len(tokens) - 1:
+                    return None
+            if values:
+                return ('in', column, values)
+        return None
+
+    # Literal on the left hand side, e.g. 50 < score
+    value, i = _parse_literal(tokens, 0)
+    if value is not None and i == len(tokens) - 2 and tokens[i][0] == 'op':
+        column = _resolve_column(tokens[i + 1], data)
+        op = '=' if tokens[i][1] == '==' else '<>' if tokens[i][1] == '!=' else tokens[i][1]
+        if column is not None:
+            return ('cmp', column, _FLIPPED_OPS[op], value)
+    return None
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _literal_matches(kind, values):
+    if kind == 'numeric':
+        return all(isinstance(v, (int, float)) for v in values)
+    if kind == 'text':
+        return all(isinstance(v, str) for v in values)
+    # Datetime columns have NUMERIC affinity in SQLite, which turns numeric
+    # looking text such as '2020' into a number that sorts before all text
+    if kind == 'datetime':
+        return all(isinstance(v, str) and not _is_number(v) for v in values)
+    return False
+
+
+def predicate_values(predicate):
+    if predicate[0] == 'cmp':
+        return [predicate[3]]
+    if predicate[0] == 'between':
+        return [predicate[2], predicate[3]]
+    return predicate[2]
+
+
+## ===============================================
+## Evaluation
+## ===============================================
+
+# Row ids matching a predicate, or None when the fast path does not apply
+def evaluate_predicate(data, predicate):
+    if predicate[0] == 'part':
+        return evaluate_date_part(data, predicate[1], predicate[2])
+
+    column = predicate[1]
+    kind = column_kind(data[column])
+    if not _literal_matches(kind, predicate_values(predicate)):
+        return None
+
+    # Datetimes are compared as the text SQLite stores for them, every
+    # predicate is a range of the sorted index
+    if kind == 'datetime':
+        index = get_index(data, column, SortedIndex)
+        def value_range(**bounds):
+            return datetime_text_range(index, **bounds)
+        if predicate[0] == 'in':
+            blocks = [value_range(low=value, high=value) for value in set(predicate[2])]
+            return np.sort(np.concatenate(blocks))
+        if predicate[0] == 'cmp' and predicate[2] == '=':
+            return np.sort(value_range(low=predicate[3], high=predicate[3]))
+    else:
+        if predicate[0] == 'in':
+            return get_index(data, column, HashIndex).lookup_many(predicate[2])
+        if predicate[0] == 'cmp' and predicate[2] == '=':
+            return get_index(data, column, HashIndex).lookup(predicate[3])
+        index = get_index(data, column, SortedIndex)
+        value_range = index.range
+
+    if predicate[0] == 'between':
+        return np.sort(value_range(low=predicate[2], high=predicate[3]))
+    op, value = predicate[2], predicate[3]
+    if op == '<>':
+        rows = np.concatenate([value_range(high=value, high_inclusive=False),
+                               value_range(low=value, low_inclusive=False)])
+    elif op in ('<', '<='):
+        rows = value_range(high=value, high_inclusive=(op == '<='))
+    else:
+        rows = value_range(low=value, low_inclusive=(op == '>='))
+    return np.sort(rows)
+
+
+# Row ids matching a predicate on strftime(part, column), compared as integers.
+# SQLite returns the part as zero-padded text, so only text literals of the
+# same width compare the same way as the integers; other literals return None.
+def evaluate_date_part(data, part, predicate):
+    width = DATE_PARTS[part]
+    literals = predicate_values(predicate)
+    if not all(isinstance(v, str) and len(v) == width and v.isdigit() and v.isascii() for v in literals):
+        return None
+    if date_values(data, predicate[1]) is None:
+        return None
+
+    values = date_part(data, predicate[1], part)
+    if predicate[0] == 'in':
+        return np.flatnonzero(np.isin(values, [int(v) for v in literals]))
+    if predicate[0] == 'between':
+        return np.flatnonzero((values >= int(predicate[2])) & (values <= int(predicate[3])))
+    op, value = predicate[2], int(predicate[3])
+    # Nulls are -1, below every part value
+    valid = values >= 0
+    mask = {'=': values == value, '<>': valid & (values != value), '<': valid & (values < value),
+            '<=': valid & (values <= value), '>': values > value, '>=': values >= value}[op]
+    return np.flatnonzero(mask)
+
+
+# Evaluate clauses with SQLite over all rows or a subset of rows, returns
+# matching row ids. A subset is registered under a private name and aliased as
+# data, so qualified column names keep working; clauses with subqueries, which
+# must see the whole table as data, are evaluated over all rows (see filter_row_ids).
+def evaluate_sql(data, clauses, row_ids=None):
+    subset = data if row_ids is None else data.take(row_ids)
+    subset = subset.assign(**{ROWID_COL: np.arange(len(data)) if row_ids is None else row_ids})
+    where = ' AND '.join(f'({clause})' for clause in clauses)
+    if row_ids is None:
+        result = sqldf(f'SELECT "{ROWID_COL}" FROM data WHERE {where}', {'data': subset})
+    else:
+        result = sqldf(f'SELECT "{ROWID_COL}" FROM {SUBSET_TABLE} AS data WHERE {where}', {SUBSET_TABLE: subset})
+    return np.sort(result[ROWID_COL].to_numpy(dtype=np.int64))
+
+
+# Terms whose result depends on the whole table rather than on each row alone:
+# subqueries, and SQLite's rowid (unless the dataset has a column of that name),
+# which numbers the rows of the table being filtered
+def _reads_whole_table(tokens, data=None):
+    for token in tokens:
+        if token[0] != 'word':
+            continue
+        word = token[1].upper()
+        if word == 'SELECT' or (word in ROWID_NAMES and (data is None or _resolve_column(token, data) is None)):
+            return True
+    return False
+
+
+def _intersect(row_sets):
+    row_sets = sorted(row_sets, key=len)
+    rows = row_sets[0]
+    for other in row_sets[1:]:
+        rows = np.intersect1d(rows, other, assume_unique=True)
+    return rows
+
+
+# Normalized text of an AND term, so spacing and keyword case do not matter
+def clause_signature(tokens):
+    return ' '.join(t[1].upper() if t[0] == 'word' and t[1].upper() in _KEYWORDS else t[1]
+                    for t in tokens)
+
+
+# Find the cached result of a previous filter whose AND terms are all part of
+# the new filter; the new result can only be a subset of its rows. Filters
+# reading the whole table are only reused when repeated exactly.
+def _find_refinement_base(key, signatures):
+    best = None
+    for (cached_key, cached_signatures), rows in _result_cache.items():
+        if cached_key != key or not cached_signatures <= signatures:
+            continue
+        if cached_signatures != signatures and any(_reads_whole_table(tokenize(signature))
+                                                   for signature in cached_signatures):
+            continue
+        if best is None or len(rows) < len(best[1]):
+            best = (cached_signatures, rows)
+    return best
+
+
+# Row ids (in original order) of the rows matching the filter text
+def filter_row_ids(data, filter_text):
+    key = dataset_key(data)
+    clauses = split_conjuncts(filter_text)
+    signatures = frozenset(clause_signature(tokens) for _, tokens in clauses)
+
+    # Exact repeat or refinement of a cached filter: start from its rows.
+    # A loosened filter has no cached subset of terms and is evaluated in full.
+    base = _find_refinement_base(key, signatures)
+    if base is not None and base[0] == signatures:
+        return base[1]
+    if any(_reads_whole_table(tokens, data) for _, tokens in clauses):
+        # Subqueries and rowid read the whole table: the filter runs as written over all rows
+        rows = evaluate_sql(data, [filter_text])
+        _result_cache.put((key, signatures), rows)
+        return rows
+    rows = base[1] if base is not None else None
+    done = base[0] if base is not None else frozenset()
+
+    indexed, remaining = [], []
+    for clause_text, tokens in clauses:
+        if clause_signature(tokens) in done:
+            continue
+        predicate = parse_predicate(tokens, data)
+        clause_rows = evaluate_predicate(data, predicate) if predicate is not None else None
+        if clause_rows is None:
+            remaining.append(clause_text)
+        else:
+            indexed.append(clause_rows)
+
+    if indexed:
+        rows = _intersect(indexed + ([rows] if rows is not None else []))
+    if remaining and (rows is None or len(rows) > 0):
+        rows = evaluate_sql(data, remaining, rows)
+
+    _result_cache.put((key, signatures), rows)
+    return rows
+
+
+# Apply the user's filter to the dataset, same result rows as
+# sqldf('SELECT * FROM data WHERE ' + filter_text) in the same order
+def filter_data(data, filter_text):
+    if filter_text.strip() == '':
+        return data
+    rows = filter_row_ids(data, filter_text)
+    new_data = data.take(rows).reset_index(drop=True)
+    # The filtered frame is a dataset of its own for the caches
+    digest = hashlib.blake2b(dataset_key(data).encode(), digest_size=16)
+    digest.update(rows.tobytes())
+    set_dataset_key(new_data, digest.hexdigest())
+    return new_data
@@ -0,0 +1,288 @@
+import time
+import pickle
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from pandas.api import types as ptypes
+from out_of_core import LazyDataset, iter_chunks
+from instrumentation import span, set_size
+
+# Incremental model training for datasets larger than memory. Models with
+# partial_fit (linear models trained by SGD, naive Bayes, mini-batch neural
+# networks) are trained over chunks of rows streamed from the dataset (from
+# the columnar cache file of out-of-core datasets, slices of DataFrames), so
+# memory stays bounded by the chunk size whatever the number of rows:
+# - a first pass learns the scaling of numeric columns and the classes
+# - each epoch passes every chunk, shuffled, to every model
+# - a last pass scores the models on held-out rows (a fixed fraction of every chunk)
+# Text columns are hashed into a fixed number of features, so no vocabulary is kept.
+
+CHUNK_ROWS = 50_000
+EPOCHS = 1
+
+# Features of the text columns, shared by all of them
+HASH_FEATURES = 256
+
+# Fraction of the rows held out for scoring, chosen by row position
+HOLDOUT_FRACTION = 0.1
+
+# Classification targets with more distinct values are refused
+MAX_CLASSES = 100
+
+
+def _classifiers():
+    from sklearn.linear_model import SGDClassifier, Perceptron
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.neural_network import MLPClassifier
+    return {'Logistic Regression (SGD)': SGDClassifier(loss='log_loss', random_state=0),
+            'Linear SVM (SGD)': SGDClassifier(loss='hinge', random_state=0),
+            'Perceptron': Perceptron(random_state=0),
+            'Gaussian Naive Bayes': GaussianNB(),
+            'MLP (mini-batch)': MLPClassifier(hidden_layer_sizes=(64,), random_state=0)}
+
+
+def _regressors():
+    from sklearn.linear_model import SGDRegressor
+    from sklearn.neural_network import MLPRegressor
+    return {'Linear Regression (SGD)': SGDRegressor(random_state=0),
+            'Huber Regression (SGD)': SGDRegressor(loss='huber', random_state=0),
+            'MLP (mini-batch)': MLPRegressor(hidden_layer_sizes=(64,), random_state=0)}
+
+
+# Models that only accept dense features
+DENSE_MODELS = {'Gaussian Naive Bayes'}
+
+
+## ===============================================
+## Data sources
+## ===============================================
+
+# What is sent to a job worker: a DataFrame, or the path and filter of an
+# out-of-core dataset (its DuckDB connection cannot be pickled)
+def dataset_source(data):
+    if isinstance(data, LazyDataset):
+        return ('lazy', data.path, data.filter_text)
+    return data
+
+
+def open_source(source):
+    if isinstance(source, tuple) and source[0] == 'lazy':
+        _, path, filter_text = source
+        data = LazyDataset(path)
+        # Every pass reads the columnar cache file instead of parsing the CSV file again
+        data.write_columnar_cache()
+        return data.filtered(filter_text) if filter_text else data
+    return source
+
+
+# Rough memory needed by a training job: a few copies of a chunk of features,
+# plus the whole frame for in-memory datasets, which are sent to the worker
+def estimate_memory(data, chunk_rows=CHUNK_ROWS):
+    memory = int(chunk_rows * (len(data.columns) + HASH_FEATURES) * 8 * 4)
+    if not isinstance(data, LazyDataset):
+        memory += int(data.memory_usage(deep=True).sum())
+    return memory
+
+
+## ===============================================
+## Features
+## ===============================================
+
+# Numeric and datetime columns are standardized (missing values become the
+# mean), text columns are hashed with their column name
+class ChunkFeatures:
+    def __init__(self, chunk, target):
+        self.numeric = [col for col in chunk.columns if col != target and (ptypes.is_numeric_dtype(chunk[col])
+                                                                            or ptypes.is_datetime64_any_dtype(chunk[col]))]
+        self.text = [col for col in chunk.columns if col != target and col not in self.numeric]
+        self.count = np.zeros(len(self.numeric))
+        self.mean = np.zeros(len(self.numeric))
+        self.m2 = np.zeros(len(self.numeric))
+
+    def _numeric_values(self, chunk):
+        columns = []
+        for col in self.numeric:
+            series = chunk[col]
+            if ptypes.is_datetime64_any_dtype(series):
+                series = series.astype('int64').where(series.notna()) / 1e9
+            columns.append(series.to_numpy(dtype='float64', na_value=np.nan))
+        return np.column_stack(columns) if columns else np.empty((len(chunk), 0))
+
+    # Merge the mean and variance of a chunk (Chan et al.)
+    def partial_fit(self, chunk):
+        values = self._numeric_values(chunk)
+        count = (~np.isnan(values)).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / np.maximum(count, 1), 0.0)
+            m2 = np.nansum((values - mean) ** 2, axis=0)
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(total > 0, self.mean + delta * count / np.maximum(total, 1), 0.0)
+            self.m2 = self.m2 + m2 + np.where(total > 0, delta ** 2 * self.count * count / np.maximum(total, 1), 0.0)
+        self.count = total
+
+    def transform(self, chunk):
+        values = self._numeric_values(chunk)
+        std = np.sqrt(self.m2 / np.maximum(self.count, 1))
+        values = np.nan_to_num((values - self.mean) / np.where(std > 0, std, 1.0))
+        blocks = [sparse.csr_matrix(values)]
+        if self.text:
+            rows, cols = [], []
+            for i, col in enumerate(self.text):
+                series = chunk[col]
+                present = series.notna().to_numpy()
+                hashes = pd.util.hash_array(series[present].astype(str).to_numpy(dtype=object), hash_key=f'{i:016d}')
+                rows.append(np.flatnonzero(present))
+                cols.append((hashes % HASH_FEATURES).astype(np.int64))
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            blocks.append(sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(chunk), HASH_FEATURES)))
+        return sparse.hstack(blocks, format='csr')
+
+
+# A trained model with its features, predicting from DataFrames with the training columns
+class IncrementalModel:
+    def __init__(self, name, model, features, target, target_mean=0.0, target_std=1.0):
+        self.name = name
+        self.model = model
+        self.features = features
+        self.target = target
+        self.target_mean = target_mean
+        self.target_std = target_std
+
+    def predict(self, frame):
+        X = self.features.transform(frame)
+        prediction = self.model.predict(X.toarray() if self.name in DENSE_MODELS else X)
+        if ptypes.is_float_dtype(prediction):
+            prediction = prediction * self.target_std + self.target_mean
+        return prediction
+
+
+## ===============================================
+## Training
+## ===============================================
+
+# Rows of a chunk held out for scoring, from their position in the dataset
+def _holdout_mask(start, length):
+    positions = np.arange(start, start + length, dtype=np.uint64)
+    return (positions * np.uint64(0x9E3779B1) % np.uint64(2**32)) < np.uint64(HOLDOUT_FRACTION * 2**32)
+
+
+# Features, target and holdout mask of each chunk, for the rows with a known target
+def _training_chunks(data, features, target, chunk_rows, classification):
+    start = 0
+    for chunk in iter_chunks(data, chunk_rows):
+        length = len(chunk)
+        chunk = chunk.reset_index(drop=True)
+        known = chunk[target].notna().to_numpy()
+        holdout = _holdout_mask(start, length)[known]
+        chunk = chunk[known]
+        y = chunk[target].astype(str).to_numpy() if classification else chunk[target].to_numpy(dtype='float64')
+        yield features.transform(chunk), y, holdout
+        start += length
+
+
+def train_incremental(source, target, experiment, model_path='incremental_model.pkl', chunk_rows=CHUNK_ROWS,
+                      epochs=EPOCHS, seed=0):
+    data = open_source(source)
+    classification = experiment == 'Classification'
+    models = _classifiers() if classification else _regressors()
+
+    with span('automl.incremental') as record:
+        set_size(record, data)
+
+        # First pass: scaling of the numeric columns, classes or target scaling
+        features, classes, y_count, y_mean, y_m2 = None, set(), 0, 0.0, 0.0
+        for chunk in iter_chunks(data, chunk_rows):
+            if features is None:
+                features = ChunkFeatures(chunk, target)
+            features.partial_fit(chunk)
+            y = chunk[target].dropna()
+            if classification:
+                classes.update(y.astype(str).unique())
+                if len(classes) > MAX_CLASSES:
+                    raise ValueError(f'The target has more than {MAX_CLASSES} classes, choose Regression or another target.')
+            elif len(y):
+                y = y.to_numpy(dtype='float64')
+                count = y_count + len(y)
+                delta = y.mean() - y_mean
+                y_m2 += ((y - y.mean()) ** 2).sum() + delta ** 2 * y_count * len(y) / count
+                y_mean += delta * len(y) / count
+                y_count = count
+        if features is None:
+            raise ValueError('The dataset has no rows.')
+        classes = np.array(sorted(classes), dtype=object)
+        if classification and len(classes) < 2:
+            raise ValueError('The target needs at least two classes.')
+        y_std = float(np.sqrt(y_m2 / y_count)) if y_count and y_m2 > 0 else 1.0
+
+        # Training passes; the rows are shuffled within each chunk
+        rng = np.random.default_rng(seed)
+        fit_seconds = dict.fromkeys(models, 0.0)
+        rows = chunks = 0
+        start = time.perf_counter()
+        for _ in range(epochs):
+            for X, y, holdout in _training_chunks(data, features, target, chunk_rows, classification):
+                train = np.flatnonzero(~holdout)
+                if len(train) == 0:
+                    continue
+                train = rng.permutation(train)
+                X_train, y_train = X[train], y[train]
+                if not classification:
+                    y_train = (y_train - y_mean) / y_std
+                X_dense = None
+                for name, model in models.items():
+                    fit_start = time.perf_counter()
+                    if name in DENSE_MODELS:
+                        X_dense = X_train.toarray() if X_dense is None else X_dense
+                        model.partial_fit(X_dense, y_train, classes=classes)
+                    elif classification:
+                        model.partial_fit(X_train, y_train, classes=classes)
+                    else:
+                        model.partial_fit(X_train, y_train)
+                    fit_seconds[name] += time.perf_counter() - fit_start
+                rows += len(train)
+                chunks += 1
+        train_seconds = time.perf_counter() - start
+
+        # Scoring pass on the held-out rows
+        scores = {name: np.zeros(3) for name in models}
+        # Count, sum and sum of squares of the held-out targets (centered), for R2
+        held_out = np.zeros(3)
+        for X, y, holdout in _training_chunks(data, features, target, chunk_rows, classification):
+            if not holdout.any():
+                continue
+            X_test, y_test = X[holdout], y[holdout]
+            if not classification:
+                held_out += [len(y_test), (y_test - y_mean).sum(), ((y_test - y_mean) ** 2).sum()]
+            for name, model in models.items():
+                prediction = model.predict(X_test.toarray() if name in DENSE_MODELS else X_test)
+                if classification:
+                    scores[name] += [len(y_test), (prediction == y_test).sum(), 0]
+                else:
+                    error = prediction * y_std + y_mean - y_test
+                    scores[name] += [len(y_test), (error ** 2).sum(), np.abs(error).sum()]
+
+    comparison = []
+    for name, (n, a, b) in scores.items():
+        row = {'Model': name}
+        if classification:
+            row['Accuracy'] = a / n if n else np.nan
+        else:
+            total = held_out[2] - held_out[1] ** 2 / held_out[0] if held_out[0] else 0.0
+            row['R2'] = 1 - a / total if total > 0 else np.nan
+            row['MAE'] = b / n if n else np.nan
+        row['Fit time (s)'] = fit_seconds[name]
+        comparison.append(row)
+    metric = 'Accuracy' if classification else 'R2'
+    comparison = pd.DataFrame(comparison).sort_values(metric, ascending=False, na_position='last').reset_index(drop=True)
+
+    best = comparison['Model'].iloc[0]
+    model = IncrementalModel(best, models[best], features, target,
+                             *(() if classification else (y_mean, y_std)))
+    with span('automl.save_model'):
+        with open(model_path, 'wb') as f:
+            pickle.dump(model, f)
+    return {'comparison': comparison, 'model': model, 'model_path': model_path, 'rows': rows, 'chunks': chunks,
+            'epochs': epochs, 'train_seconds': train_seconds,
+            'rows_per_second': rows / train_seconds if train_seconds > 0 else np.nan}
@@ -0,0 +1,244 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Hot-path instrumentation: named spans around each stage of a rerun with
+# wall time, CPU time, peak RSS growth and rows/columns processed.
+# Spans of the current rerun are kept per script thread for the debug panel,
+# every span is logged as a JSON line and added to process-wide totals that
+# can be exported in the Prometheus text format. One section per rerun can be
+# run under cProfile. Jobs run in worker processes (job_scheduler.py) record
+# their spans and profile there and send them back with their result.
+
+logger = logging.getLogger('data_express.spans')
+
+# Sections that can be wrapped in cProfile from the debug panel
+SECTIONS = ['load_data', 'filter', 'classify_columns', 'profiling', 'visual_exploration',
+            'hypothesis_test', 'two_way_anova', 'automl', 'warmup', 'export']
+
+# Write the Prometheus metrics to this file after each rerun (node_exporter textfile collector)
+METRICS_FILE = os.environ.get('DATA_EXPRESS_METRICS_FILE')
+
+_totals = {}
+_totals_lock = threading.Lock()
+_recent = deque(maxlen=1000)
+_local = threading.local()
+
+
+def peak_rss():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return 0
+
+
+class Run:
+    def __init__(self, profile_section=None):
+        self.spans = []
+        self.profile_section = profile_section
+        self.profile_stats = None
+        self.profiling = False
+        self.stack = []
+
+
+# Start recording the spans of a rerun on this script thread
+def start_run(profile_section=None):
+    _local.run = Run(profile_section)
+    return _local.run
+
+
+def current_run():
+    run = getattr(_local, 'run', None)
+    if run is None:
+        run = start_run()
+    return run
+
+
+@contextmanager
+def span(name, rows=None, cols=None):
+    run = current_run()
+    record = {'name': name, 'parent': run.stack[-1] if run.stack else None, 'rows': rows, 'cols': cols}
+    section = name.split('.')[0]
+    # Only the first matching span of the rerun is profiled, nested spans run inside it
+    profile = run.profile_section in (name, section) and run.profile_stats is None and not run.profiling
+    profiler = cProfile.Profile() if profile else None
+
+    run.stack.append(name)
+    rss_before = peak_rss()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    if profiler is not None:
+        run.profiling = True
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            run.profiling = False
+            # A job profiled in a worker process while the span waited for it replaces the wait
+            if run.profile_stats is None:
+                run.profile_stats = profiler
+        record['wall_seconds'] = time.perf_counter() - wall_before
+        # process_time is process-wide, concurrent sessions add to it
+        record['cpu_seconds'] = time.process_time() - cpu_before
+        record['peak_rss_delta_bytes'] = max(0, peak_rss() - rss_before)
+        record['timestamp'] = time.time()
+        run.stack.pop()
+        run.spans.append(record)
+        _recent.append(record)
+        _add_to_totals(record)
+        logger.info(json.dumps(record, default=str))
+
+
+# Fill in the rows and columns of a span once the result is known
+def set_size(record, data):
+    try:
+        record['rows'], record['cols'] = data.shape
+    except (AttributeError, ValueError):
+        record['rows'] = len(data)
+
+
+def _add_to_totals(record):
+    with _totals_lock:
+        totals = _totals.setdefault(record['name'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                      'rows': 0, 'max_peak_rss_delta_bytes': 0})
+        totals['count'] += 1
+        totals['wall_seconds'] += record['wall_seconds']
+        totals['cpu_seconds'] += record['cpu_seconds']
+        totals['rows'] += record['rows'] or 0
+        totals['max_peak_rss_delta_bytes'] = max(totals['max_peak_rss_delta_bytes'], record['peak_rss_delta_bytes'])
+
+
+## ===============================================
+## Jobs in worker processes
+## ===============================================
+
+# Run a job in a worker process with a run of its own, under cProfile when the
+# submitting thread was profiling a section; returns the result with the spans
+# and profile stats of the job (see record_job_spans and merge_job)
+def run_instrumented(fn, profile, args, kwargs):
+    run = start_run()
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    stats = None
+    if profiler is not None:
+        profiler.create_stats()
+        stats = profiler.stats
+    return result, run.spans, stats
+
+
+# Profile stats collected in a worker process, read by pstats.Stats like a cProfile.Profile
+class WorkerProfile:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# Add the spans of a job to the span log and the process-wide totals, once per job
+def record_job_spans(spans):
+    for record in spans:
+        _recent.append(record)
+        _add_to_totals(record)
+        logger.info(json.dumps(record, default=str))
+
+
+# Show the spans of a finished job in the current run, under the span waiting
+# for it, and its profile stats if that span is the profiled section
+def merge_job(spans, profile_stats):
+    run = current_run()
+    for record in spans:
+        run.spans.append(dict(record, parent=record['parent'] or (run.stack[-1] if run.stack else None)))
+    if profile_stats is not None and run.profiling:
+        run.profile_stats = WorkerProfile(profile_stats)
+
+
+## ===============================================
+## Exports
+## ===============================================
+
+def run_table(run=None):
+    import pandas as pd
+    run = run or current_run()
+    table = pd.DataFrame(run.spans, columns=['name', 'parent', 'wall_seconds', 'cpu_seconds',
+                                             'peak_rss_delta_bytes', 'rows', 'cols'])
+    table['peak_rss_delta_mb'] = table.pop('peak_rss_delta_bytes') / 2**20
+    return table
+
+
+def spans_json():
+    return '\n'.join(json.dumps(record, default=str) for record in list(_recent))
+
+
+def prometheus_text():
+    with _totals_lock:
+        totals = {name: dict(values) for name, values in _totals.items()}
+    metrics = [('data_express_span_runs_total', 'counter', 'Number of times a span ran', 'count'),
+               ('data_express_span_wall_seconds_total', 'counter', 'Wall time spent in a span', 'wall_seconds'),
+               ('data_express_span_cpu_seconds_total', 'counter', 'Process CPU time spent in a span', 'cpu_seconds'),
+               ('data_express_span_rows_total', 'counter', 'Rows processed by a span', 'rows'),
+               ('data_express_span_peak_rss_delta_bytes', 'gauge', 'Largest growth of peak RSS during a span',
+                'max_peak_rss_delta_bytes')]
+    lines = []
+    for metric, kind, help_text, field in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name in sorted(totals):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{metric}{{span="{label}"}} {totals[name][field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics_file():
+    if METRICS_FILE:
+        with open(METRICS_FILE + '.tmp', 'w') as f:
+            f.write(prometheus_text())
+        os.replace(METRICS_FILE + '.tmp', METRICS_FILE)
+
+
+# cProfile stats of the profiled section as a .prof file and a text summary
+def profile_outputs(run=None):
+    run = run or current_run()
+    if run.profile_stats is None:
+        return None, None
+    text = io.StringIO()
+    stats = pstats.Stats(run.profile_stats, stream=text)
+    stats.sort_stats('cumulative').print_stats(30)
+    fd, path = tempfile.mkstemp(suffix='.prof')
+    os.close(fd)
+    try:
+        stats.dump_stats(path)
+        with open(path, 'rb') as f:
+            prof = f.read()
+    finally:
+        os.remove(path)
+    return prof, text.getvalue()
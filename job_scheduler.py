@@ -0,0 +1,202 @@
+import os
+import time
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataset_cache import DatasetCache
+from instrumentation import current_run, run_instrumented, record_job_spans
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Scheduler for CPU-heavy jobs (full profiles, AutoML, batch tests) shared by
+# every session of the app process. Jobs run in a bounded pool of worker
+# processes so they do not hold the GIL of the script threads. Queued jobs
+# start in priority order (interactive before batch, then first come first
+# served) as long as their user is below the per-user limit and their memory
+# estimate fits under the ceiling; jobs larger than the ceiling are refused.
+# Jobs submitted with a key are shared: the same key returns the queued,
+# running or recently finished job instead of starting another one.
+# The spans of a job, and its cProfile stats when it was submitted from a
+# profiled section, come back with its result (see instrumentation.py).
+
+INTERACTIVE = 0
+BATCH = 1
+
+MAX_WORKERS = int(os.environ.get('DATA_EXPRESS_JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+JOBS_PER_USER = int(os.environ.get('DATA_EXPRESS_JOBS_PER_USER', 1))
+
+
+# Memory ceiling for the estimates of running jobs, in bytes (None: no ceiling)
+def default_memory_ceiling():
+    if 'DATA_EXPRESS_JOB_MEMORY_MB' in os.environ:
+        return int(os.environ['DATA_EXPRESS_JOB_MEMORY_MB']) * 2**20
+    if psutil is not None:
+        return int(psutil.virtual_memory().total * 0.75)
+    return None
+
+
+class JobRejected(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, fn, args, kwargs, user, priority, memory, key, profile=False):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.user = user
+        self.priority = priority
+        self.memory = memory
+        self.key = key
+        self.profile = profile
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.spans = []
+        self.profile_stats = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+class JobScheduler:
+    def __init__(self, max_workers=MAX_WORKERS, jobs_per_user=JOBS_PER_USER, memory_ceiling=None):
+        self.max_workers = max_workers
+        self.jobs_per_user = jobs_per_user
+        self.memory_ceiling = memory_ceiling
+        self._queue = []
+        self._running = []
+        self._by_key = {}
+        self._finished = DatasetCache(max_entries=32)
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._pool = None
+
+    def submit(self, fn, *args, user=None, priority=INTERACTIVE, memory=0, key=None, **kwargs):
+        if self.memory_ceiling is not None and memory > self.memory_ceiling:
+            raise JobRejected(f'The job needs about {memory / 2**20:.0f} MB, more than the '
+                              f'{self.memory_ceiling / 2**20:.0f} MB allowed for jobs on this server.')
+        with self._lock:
+            if key is not None:
+                job = self._by_key.get(key) or self._finished.get(key)
+                if job is not None:
+                    # A queued batch job (e.g. from the warm-up) becomes interactive when a user asks for it
+                    if job.state == 'queued' and priority < job.priority:
+                        job.priority = priority
+                        self._dispatch()
+                    return job
+            job = Job(next(self._ids), fn, args, kwargs, user, priority, memory, key, profile=current_run().profiling)
+            self._queue.append(job)
+            if key is not None:
+                self._by_key[key] = job
+            self._dispatch()
+        return job
+
+    # 1-based position of a queued job in start order, 0 once it started
+    def position(self, job):
+        with self._lock:
+            return self._queue.index(job) + 1 if job in self._queue else 0
+
+    def status(self):
+        with self._lock:
+            return {'queued': len(self._queue), 'running': len(self._running), 'workers': self.max_workers,
+                    'reserved_memory': sum(job.memory for job in self._running)}
+
+    def _admissible(self, job):
+        if sum(running.user == job.user for running in self._running) >= self.jobs_per_user:
+            return False
+        reserved = sum(running.memory for running in self._running)
+        if self.memory_ceiling is not None and reserved + job.memory > self.memory_ceiling:
+            return False
+        # The estimate must also fit in the memory available right now, unless nothing else runs
+        if psutil is not None and self._running and job.memory > psutil.virtual_memory().available:
+            return False
+        return True
+
+    def _dispatch(self):
+        with self._lock:
+            self._queue.sort(key=lambda job: (job.priority, job.id))
+            for job in list(self._queue):
+                if len(self._running) >= self.max_workers:
+                    break
+                if self._admissible(job):
+                    self._queue.remove(job)
+                    self._start(job)
+
+    def _start(self, job):
+        if self._pool is None:
+            # Forking the multithreaded server process could copy held locks
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        job.state = 'running'
+        job.started = time.time()
+        self._running.append(job)
+        try:
+            future = self._pool.submit(run_instrumented, job.fn, job.profile, job.args, job.kwargs)
+        except BrokenProcessPool as e:
+            # A worker of the pool died since the last job finished: the next job gets a new pool
+            self._pool = None
+            job.error = e
+            job.state = 'failed'
+            self._finish(job)
+            return
+        # The arguments are no longer needed once sent to the worker
+        job.args, job.kwargs = (), {}
+        future.add_done_callback(lambda future: self._complete(job, future))
+
+    def _complete(self, job, future):
+        with self._lock:
+            try:
+                job.result, job.spans, job.profile_stats = future.result()
+                job.state = 'done'
+                record_job_spans(job.spans)
+            except Exception as e:
+                job.error = e
+                job.state = 'failed'
+                # A worker died (e.g. out of memory): start a new pool for the next jobs
+                if isinstance(e, BrokenProcessPool):
+                    self._pool = None
+            self._finish(job)
+            self._dispatch()
+
+    # Releases the worker, memory and user slot of a job and wakes up its waiters
+    def _finish(self, job):
+        job.finished = time.time()
+        self._running.remove(job)
+        if job.key is not None:
+            self._by_key.pop(job.key, None)
+            # Failed jobs are not kept so they can be retried
+            if job.state == 'done':
+                self._finished.put(job.key, job)
+        job._done.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# The scheduler shared by every session of the app process
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(memory_ceiling=default_memory_ceiling())
+        return _scheduler
+
+
+# Rough memory needed by a job working on a DataFrame: its in-memory size
+# times a factor for the copies and intermediate results of the job
+def estimate_memory(data, factor):
+    return int(data.memory_usage(deep=True).sum() * factor)
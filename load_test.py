@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from unittest.mock import MagicMock
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from benchmark import SCHEMA_SETTINGS, synthesize, environment
+from instrumentation import peak_rss
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Load test of the Streamlit app with concurrent headless sessions (AppTest),
+# all in this process like the sessions of one server. Every session runs a
+# scripted flow: open the dataset, type a filter and refine it, run the
+# independent samples test and open the profiling section. Each step is one
+# rerun of the script; the rerun latencies (p50/p95/p99), the throughput in
+# reruns per second and the peak memory (this process and its job workers)
+# are reported per number of concurrent sessions. Nothing leaves the machine.
+#
+#   python load_test.py --sessions 1 2 4 8 --rows 100000 --output load.json
+#
+# AppTest cannot drive the file uploader, so toyota.csv (or a scaled synthetic
+# variant of it) is opened through the local file path of out-of-core mode;
+# --source sample opens the bundled sample dataset in memory instead.
+
+# Seconds a single rerun may take before the session is reported as failed
+RERUN_TIMEOUT = 600
+
+# Interval between memory samples, in seconds
+RSS_INTERVAL = 0.05
+
+
+def widget(at, kind, label):
+    for element in at.get(kind):
+        if label in element.label:
+            return element
+    raise LookupError(f'No {kind} labelled {label!r}')
+
+
+def option(element, text):
+    return next(choice for choice in element.options if text in choice)
+
+
+# AppTest installs a mock runtime for each rerun and removes it afterwards,
+# which breaks the reruns of the other sessions running at the same time:
+# one mock runtime is shared by every session instead, as in a server
+@contextlib.contextmanager
+def shared_runtime():
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    saved = Runtime.__dict__['instance'], Runtime.__dict__['exists']
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    try:
+        yield runtime
+    finally:
+        Runtime.instance, Runtime.exists = saved
+
+
+# Steps of one session as (name, widget changes before the rerun)
+def session_steps(at, source, path, settings, report_type, warm_up):
+    steps = [('open', lambda: None)]
+    if not warm_up:
+        steps.append(('warm_up_off', lambda: widget(at, 'checkbox', 'Warm up').uncheck()))
+    if source == 'sample':
+        steps.append(('load', lambda: widget(at, 'checkbox', 'Load sample dataset').check()))
+    else:
+        steps.append(('out_of_core', lambda: widget(at, 'checkbox', 'Out-of-core').check()))
+        steps.append(('load', lambda: widget(at, 'text_input', 'Local file path').input(path)))
+    steps += [
+        ('filter', lambda: widget(at, 'text_input', 'filter_input').input(settings['filter'])),
+        ('refine', lambda: widget(at, 'text_input', 'filter_input').input(settings['filter'] + settings['refine'])),
+        ('statistics', lambda: widget(at, 'radio', 'MENU').set_value('Statistical experimentation')),
+        ('statistics_filter', lambda: widget(at, 'text_input', 'filter_input').input(settings['filter'])),
+        ('experiment', lambda: widget(at, 'radio', 'experiment').set_value(
+            option(widget(at, 'radio', 'experiment'), 'Independent samples'))),
+        ('columns', lambda: (widget(at, 'selectbox', 'Select categorical column').set_value(settings['cat_1']),
+                             widget(at, 'selectbox', 'Select interval/ratio column').set_value(settings['num_1']))),
+        ('independent_test', lambda: next(button for button in at.get('button') if button.label == 'Analyze').click()),
+        ('profiling', lambda: widget(at, 'radio', 'MENU').set_value('Data summarization and profiling')),
+        ('report', lambda: widget(at, 'radio', 'Report type').set_value(report_type)),
+    ]
+    return steps
+
+
+# Run the flow of one session, appending (step, seconds) per rerun and the errors
+def run_session(app, source, path, settings, report_type, warm_up, iterations, start, latencies, errors):
+    start.wait()
+    for _ in range(iterations):
+        at = AppTest.from_file(app, default_timeout=RERUN_TIMEOUT)
+        for step, change in session_steps(at, source, path, settings, report_type, warm_up):
+            try:
+                change()
+                began = time.perf_counter()
+                at.run()
+                latencies.append((step, time.perf_counter() - began))
+            except Exception as e:
+                errors.append(f'{step}: {type(e).__name__}: {e}')
+                break
+            if len(at.exception):
+                errors.append(f'{step}: {at.exception[0].message}')
+                break
+
+
+# Peak resident memory of this process and its children (the job workers) while running
+class MemorySampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        process = psutil.Process()
+        while not self._done.is_set():
+            try:
+                rss = process.memory_info().rss + sum(child.memory_info().rss for child in process.children(recursive=True))
+            except psutil.Error:
+                rss = 0
+            self.peak = max(self.peak, rss)
+            self._done.wait(RSS_INTERVAL)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_level(sessions, args, path, settings):
+    latencies, errors = [], []
+    start = threading.Event()
+    threads = [threading.Thread(target=run_session, name=f'load-test-session-{i}',
+                                args=(args.app, args.source, path, settings, args.report_type, not args.no_warm_up,
+                                      args.iterations, start, latencies, errors))
+               for i in range(sessions)]
+    sampler = MemorySampler() if psutil is not None else None
+    if sampler is not None:
+        sampler.start()
+    for thread in threads:
+        thread.start()
+    began = time.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - began
+    if sampler is not None:
+        sampler.stop()
+
+    seconds = np.array([latency for _, latency in latencies])
+    steps = pd.DataFrame(latencies, columns=['step', 'seconds']).groupby('step', sort=False)['seconds']
+    result = {'sessions': sessions, 'reruns': len(seconds), 'wall_seconds': wall,
+              'throughput': len(seconds) / wall if wall > 0 else None,
+              'peak_rss_mb': (sampler.peak if sampler is not None else peak_rss()) / 2**20,
+              'errors': errors}
+    for percentile in (50, 95, 99):
+        result[f'p{percentile}'] = float(np.percentile(seconds, percentile)) if len(seconds) else None
+    result['steps'] = {step: {'p50': float(values.quantile(0.5)), 'p95': float(values.quantile(0.95))}
+                       for step, values in steps}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the Data Express app with concurrent headless sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8], help='Concurrency levels')
+    parser.add_argument('--iterations', type=int, default=1, help='Flows run by each session')
+    parser.add_argument('--source', choices=['toyota', 'sample'], default='toyota',
+                        help='toyota.csv through the local file path, or the sample dataset in memory')
+    parser.add_argument('--rows', type=int, default=0,
+                        help='Scale toyota.csv to this many bootstrapped rows (0: the original file)')
+    parser.add_argument('--report-type', default='Full profile report', help='Report type opened in the profiling section')
+    parser.add_argument('--no-warm-up', action='store_true', help='Uncheck the background warm-up in every session')
+    parser.add_argument('--target-seconds', type=float, default=1.0, help='Rerun latency target for the p95')
+    parser.add_argument('--app', default='app.py')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='JSON output file, - for stdout')
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    settings = SCHEMA_SETTINGS['students' if args.source == 'sample' else 'toyota']
+    report = {'environment': environment(), 'settings': vars(args), 'levels': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(here, 'toyota.csv')
+        if args.source == 'toyota' and args.rows:
+            path = os.path.join(workdir, f'toyota_{args.rows}.csv')
+            synthesize(pd.read_csv(os.path.join(here, 'toyota.csv')), args.rows, seed=args.seed).to_csv(path, index=False)
+
+        # The caches are shared by the levels as by the sessions of a server: the first level starts cold
+        with shared_runtime():
+            for sessions in args.sessions:
+                result = run_level(sessions, args, path, settings)
+                report['levels'].append(result)
+                if result['reruns']:
+                    print(f'{sessions} sessions: p50 {result["p50"]:.3f}s  p95 {result["p95"]:.3f}s  p99 {result["p99"]:.3f}s  '
+                          f'{result["throughput"]:.2f} reruns/s  peak RSS {result["peak_rss_mb"]:.0f} MB  '
+                          f'{len(result["errors"])} errors', file=sys.stderr)
+                for error in result['errors']:
+                    print(f'  {error}', file=sys.stderr)
+
+    within = [level['sessions'] for level in report['levels'] if level['p95'] is not None and level['p95'] <= args.target_seconds
+              and not level['errors']]
+    report['max_sessions_within_target'] = max(within) if within else 0
+    print(f'Most concurrent sessions with a p95 rerun latency within {args.target_seconds}s: '
+          f'{report["max_sessions_within_target"]}', file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
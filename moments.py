@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Streaming moment accumulators for the assumption checks.
+# Moments keeps the count, mean and 2nd to 4th central sums of squares of
+# every group; accumulators of different chunks merge with the pairwise
+# update formulas of Chan et al. / Pebay, so a column or a groupby can be
+# summarized in one pass over chunks of rows. D'Agostino and Pearson's test
+# only needs n, skewness and kurtosis, and Levene's test needs the moments of
+# the absolute deviations from each group's center.
+
+
+class Moments:
+    def __init__(self, index, n, mean, m2, m3, m4):
+        self.index = pd.Index(index)
+        self.n = np.asarray(n, dtype='float64')
+        self.mean = np.asarray(mean, dtype='float64')
+        self.m2 = np.asarray(m2, dtype='float64')
+        self.m3 = np.asarray(m3, dtype='float64')
+        self.m4 = np.asarray(m4, dtype='float64')
+
+    # Moments of each group of values in one vectorized groupby
+    @classmethod
+    def from_groups(cls, keys, values):
+        frame = pd.DataFrame({'key': np.asarray(keys), 'x': np.asarray(values, dtype='float64')}).dropna()
+        groups = frame.groupby('key', sort=True)['x']
+        deviations = frame['x'] - groups.transform('mean')
+        powers = pd.DataFrame({'key': frame['key'], 'd2': deviations ** 2, 'd3': deviations ** 3,
+                               'd4': deviations ** 4}).groupby('key', sort=True).sum()
+        return cls(powers.index, groups.count(), groups.mean(), powers['d2'], powers['d3'], powers['d4'])
+
+    @classmethod
+    def from_values(cls, values, name='value'):
+        return cls.from_groups(np.full(len(values), name, dtype=object), values)
+
+    def _aligned(self, index):
+        positions = self.index.get_indexer(index)
+        found = positions >= 0
+        positions = np.where(found, positions, 0)
+        return [np.where(found, array[positions], 0.0) if len(array) else np.zeros(len(index))
+                for array in (self.n, self.mean, self.m2, self.m3, self.m4)]
+
+    def merge(self, other):
+        index = self.index.union(other.index)
+        na, ma, m2a, m3a, m4a = self._aligned(index)
+        nb, mb, m2b, m3b, m4b = other._aligned(index)
+        n = na + nb
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mb - ma
+            safe_n = np.where(n > 0, n, 1)
+            mean = ma + delta * nb / safe_n
+            m2 = m2a + m2b + delta ** 2 * na * nb / safe_n
+            m3 = (m3a + m3b + delta ** 3 * na * nb * (na - nb) / safe_n ** 2
+                  + 3 * delta * (na * m2b - nb * m2a) / safe_n)
+            m4 = (m4a + m4b + delta ** 4 * na * nb * (na ** 2 - na * nb + nb ** 2) / safe_n ** 3
+                  + 6 * delta ** 2 * (na ** 2 * m2b + nb ** 2 * m2a) / safe_n ** 2
+                  + 4 * delta * (na * m3b - nb * m3a) / safe_n)
+        return Moments(index, n, mean, m2, m3, m4)
+
+    def variance(self, ddof=1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.n - ddof)
+
+    # Biased sample skewness and excess kurtosis, as scipy.stats.skew and kurtosis
+    def skewness(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+    def kurtosis(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.n * self.m4 / self.m2 ** 2 - 3
+
+
+# Accumulate the moments of (keys, values) chunks
+def accumulate(chunks):
+    moments = Moments([], [], [], [], [], [])
+    for keys, values in chunks:
+        moments = moments.merge(Moments.from_groups(keys, values))
+    return moments
+
+
+## ===============================================
+## Tests from moments
+## ===============================================
+
+# D'Agostino and Pearson's test per group, as scipy.stats.normaltest
+# (NaN for groups with fewer than 8 values)
+def normaltest(moments):
+    n = moments.n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Skewness test
+        b2 = moments.skewness()
+        y = b2 * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+        beta2 = (3.0 * (n ** 2 + 27 * n - 70) * (n + 1) * (n + 3)) / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+        w2 = -1 + np.sqrt(2 * (beta2 - 1))
+        delta = 1 / np.sqrt(0.5 * np.log(w2))
+        alpha = np.sqrt(2.0 / (w2 - 1))
+        y = np.where(y == 0, 1, y)
+        z_skew = delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+
+        # Kurtosis test
+        b2 = moments.kurtosis() + 3
+        expected = 3.0 * (n - 1) / (n + 1)
+        var_b2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.) * (n + 3) * (n + 5))
+        x = (b2 - expected) / np.sqrt(var_b2)
+        sqrt_beta1 = 6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) * np.sqrt((6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3)))
+        a = 6.0 + 8.0 / sqrt_beta1 * (2.0 / sqrt_beta1 + np.sqrt(1 + 4.0 / (sqrt_beta1 ** 2)))
+        term1 = 1 - 2 / (9.0 * a)
+        denom = 1 + x * np.sqrt(2 / (a - 4.0))
+        term2 = np.sign(denom) * np.where(denom == 0.0, np.nan, ((1 - 2.0 / a) / np.abs(denom)) ** (1 / 3.0))
+        z_kurt = (term1 - term2) / np.sqrt(2 / (9.0 * a))
+
+        statistic = z_skew ** 2 + z_kurt ** 2
+    statistic = np.where(n >= 8, statistic, np.nan)
+    return statistic, stats.chi2.sf(statistic, 2)
+
+
+# Levene's test from the moments of the absolute deviations from each
+# group's center (median for the default Brown-Forsythe variant)
+def levene(deviation_moments):
+    n, means = deviation_moments.n, deviation_moments.mean
+    k, total = len(n), n.sum()
+    grand_mean = np.sum(n * means) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = (total - k) / (k - 1) * np.sum(n * (means - grand_mean) ** 2) / np.sum(deviation_moments.m2)
+    return statistic, stats.f.sf(statistic, k - 1, total - k)
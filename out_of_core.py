@@ -0,0 +1,317 @@
+import os
+import copy
+import glob
+import hashlib
+import tempfile
+import duckdb
+from dataset_cache import DatasetCache
+from filter_engine import tokenize, set_dataset_key
+
+# Out-of-core datasets for files larger than memory.
+# The file stays on disk and is registered in DuckDB as a lazily scanned view
+# named data. Filtering, counts, paging and group aggregates run as streaming
+# queries, and only the small results a view needs are fetched into pandas.
+
+SPILL_DIR = os.path.join(tempfile.gettempdir(), 'data_express')
+SUPPORTED_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst', '.parquet')
+
+# Summaries and samples of (filtered) out-of-core datasets, shared by every session
+_summary_cache = DatasetCache(max_entries=32)
+_sample_cache = DatasetCache(max_entries=8)
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _string_literal(text):
+    return "'" + str(text).replace("'", "''") + "'"
+
+
+# Translate the SQLite WHERE clause typed by the user to DuckDB:
+# `col` and [col] identifiers become "col", LIKE becomes ILIKE since
+# SQLite's LIKE is case-insensitive, and strftime(format, value) becomes
+# DuckDB's strftime(value, format), reading text values as timestamps the
+# way SQLite does
+def translate_filter(filter_text):
+    tokens = tokenize(filter_text)
+    parts, last, i = [], 0, 0
+    while i < len(tokens):
+        kind, text, start, end = tokens[i]
+        call = _strftime_arguments(tokens, i) if kind == 'word' and text.upper() == 'STRFTIME' else None
+        if call is not None:
+            (fmt_start, fmt_end), (value_start, value_end), close = call
+            fmt = translate_filter(filter_text[fmt_start:fmt_end])
+            value = translate_filter(filter_text[value_start:value_end])
+            parts.append(filter_text[last:start])
+            parts.append(f'strftime(CAST({value} AS TIMESTAMP), {fmt})')
+            last, i = tokens[close][3], close + 1
+            continue
+        parts.append(filter_text[last:start])
+        if kind == 'quoted' and text[0] in '`[':
+            text = quote(text[1:-1])
+        elif kind == 'word' and text.upper() == 'LIKE':
+            text = 'ILIKE'
+        parts.append(text)
+        last = end
+        i += 1
+    parts.append(filter_text[last:])
+    return ''.join(parts).strip()
+
+
+# Text ranges of the two arguments of the strftime call at tokens[i] and the
+# index of its closing parenthesis; None for other argument counts (modifiers)
+def _strftime_arguments(tokens, i):
+    if i + 1 >= len(tokens) or tokens[i + 1][1] != '(':
+        return None
+    depth, commas = 0, []
+    for j in range(i + 1, len(tokens)):
+        text = tokens[j][1]
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+            if depth == 0:
+                if len(commas) != 1 or commas[0] == i + 2 or commas[0] == j - 1:
+                    return None
+                comma = tokens[commas[0]]
+                return (tokens[i + 2][2], comma[2]), (comma[3], tokens[j][2]), j
+        elif text == ',' and depth == 1:
+            commas.append(j)
+    return None
+
+
+# Write an uploaded file to disk once so DuckDB can scan it lazily
+def spill_upload(uploaded_file):
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    digest = hashlib.blake2b(digest_size=16)
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(1 << 20), b''):
+        digest.update(chunk)
+    extension = next((ext for ext in SUPPORTED_EXTENSIONS if uploaded_file.name.lower().endswith(ext)),
+                     os.path.splitext(uploaded_file.name)[1])
+    path = os.path.join(SPILL_DIR, digest.hexdigest() + extension)
+    if not os.path.exists(path):
+        uploaded_file.seek(0)
+        with open(path + '.part', 'wb') as f:
+            for chunk in iter(lambda: uploaded_file.read(1 << 20), b''):
+                f.write(chunk)
+        os.replace(path + '.part', path)
+    uploaded_file.seek(0)
+    return path
+
+
+# A file on disk scanned by DuckDB, optionally restricted by a filter.
+# len() and the query methods apply the filter; filtered() returns a view.
+# The path may be a glob pattern of Parquet files with the same columns.
+class LazyDataset:
+    def __init__(self, path):
+        if not path.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise ValueError(f'Out-of-core mode supports {", ".join(SUPPORTED_EXTENSIONS)} files')
+        self.path = path
+        files = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        if not files:
+            raise FileNotFoundError(f'No files match {path}')
+        stats = [(os.path.abspath(file), os.stat(file)) for file in files]
+        self.key = hashlib.blake2b('|'.join(f'{file}|{stat.st_size}|{stat.st_mtime_ns}' for file, stat in stats).encode(),
+                                   digest_size=16).hexdigest()
+        self.filter_text = ''
+        self._con = duckdb.connect()
+        # CSV files already converted to a columnar cache file are scanned from it
+        if path.lower().endswith('.parquet') or os.path.exists(self.columnar_cache_path()):
+            self._con.execute(f'CREATE VIEW data AS SELECT * FROM read_parquet({_string_literal(self.scan_path())})')
+        else:
+            self._con.execute(f'CREATE VIEW data AS SELECT * FROM read_csv_auto({_string_literal(path)})')
+        schema = self.query('DESCRIBE data')
+        self.columns = schema['column_name'].tolist()
+        self.column_types = dict(zip(schema['column_name'], schema['column_type']))
+        self._count = None
+
+    def columnar_cache_path(self):
+        return os.path.join(SPILL_DIR, self.key + '.parquet')
+
+    def scan_path(self):
+        return self.path if self.path.lower().endswith('.parquet') else self.columnar_cache_path()
+
+    # Convert a CSV file to a Parquet cache file once and scan it from then on;
+    # every filtered view shares the connection and switches with it
+    def write_columnar_cache(self):
+        if self.path.lower().endswith('.parquet'):
+            return self.path
+        cache_path = self.columnar_cache_path()
+        if not os.path.exists(cache_path):
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            self._con.cursor().execute(f'COPY (SELECT * FROM read_csv_auto({_string_literal(self.path)})) '
+                                       f'TO {_string_literal(cache_path + ".part")} (FORMAT parquet)')
+            os.replace(cache_path + '.part', cache_path)
+        self._con.cursor().execute(f'CREATE OR REPLACE VIEW data AS SELECT * FROM read_parquet({_string_literal(cache_path)})')
+        return cache_path
+
+    # View of the dataset restricted by a filter; the count query also
+    # validates the filter so syntax errors surface here
+    def filtered(self, filter_text):
+        view = copy.copy(self)
+        view.filter_text = filter_text.strip()
+        view._count = None
+        len(view)
+        return view
+
+    def __len__(self):
+        if self._count is None:
+            self._count = int(self.query(f'SELECT COUNT(*) AS n FROM data{self._where()}')['n'].iloc[0])
+        return self._count
+
+    # Each query gets its own cursor, DuckDB connections are not thread-safe
+    def query(self, sql, params=None):
+        return self._con.cursor().execute(sql, params or []).df()
+
+    def _where(self, *extra):
+        conditions = [f'({translate_filter(self.filter_text)})'] if self.filter_text else []
+        conditions += [condition for condition in extra if condition]
+        return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    def _not_null(self, columns):
+        return ' AND '.join(f'{quote(col)} IS NOT NULL' for col in columns)
+
+    def numeric_columns(self):
+        numeric = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+                   'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE', 'REAL')
+        return [col for col in self.columns
+                if self.column_types[col] in numeric or self.column_types[col].startswith('DECIMAL')]
+
+    def _search(self, search_text):
+        if not search_text:
+            return None
+        text_cols = [col for col in self.columns if self.column_types[col] == 'VARCHAR']
+        pattern = _string_literal('%' + search_text.replace('%', r'\%').replace('_', r'\_') + '%')
+        return '(' + ' OR '.join([f"{quote(col)} ILIKE {pattern} ESCAPE '\\'" for col in text_cols] or ['FALSE']) + ')'
+
+    # Number of rows whose text columns contain the search text
+    def matches(self, search_text=''):
+        if not search_text:
+            return len(self)
+        return int(self.query(f'SELECT COUNT(*) AS n FROM data{self._where(self._search(search_text))}')['n'].iloc[0])
+
+    # One page of rows in display order
+    def page(self, sort_column=None, ascending=True, offset=0, limit=100, search_text=''):
+        order = ''
+        if sort_column is not None:
+            order = f' ORDER BY {quote(sort_column)} {"ASC" if ascending else "DESC"} NULLS LAST'
+        return self.query(f'SELECT * FROM data{self._where(self._search(search_text))}{order} '
+                          f'LIMIT {int(limit)} OFFSET {int(offset)}')
+
+    # Column summary computed by DuckDB in one scan
+    # (or merged from the summaries of appended rows, see seed_summary)
+    def summary(self):
+        def compute():
+            result = self.query(f'SUMMARIZE SELECT * FROM data{self._where()}')
+            return result[['column_name', 'column_type', 'min', 'max', 'approx_unique', 'null_percentage']]
+        return _summary_cache.get_or_compute((self.key, self.filter_text), compute)
+
+    # Approximate distinct counts, used to classify categorical columns
+    def distinct_counts(self):
+        select = ', '.join(f'approx_count_distinct({quote(col)}) AS {quote(col)}' for col in self.columns)
+        return self.query(f'SELECT {select} FROM data{self._where()}').iloc[0].to_dict()
+
+    # Distinct non-null values of a column
+    def distinct_values(self, column):
+        col = quote(column)
+        return self.query(f'SELECT DISTINCT {col} FROM data{self._where(f"{col} IS NOT NULL")}')[column]
+
+    # Count, mean, standard deviation, min and max of a column per group
+    def group_aggregates(self, group_columns, value_column):
+        groups = ', '.join(quote(col) for col in group_columns)
+        value = quote(value_column)
+        sql = (f'SELECT {groups}, COUNT({value}) AS count, AVG({value}) AS mean, STDDEV_SAMP({value}) AS std, '
+               f'MIN({value}) AS min, MAX({value}) AS max '
+               f'FROM data{self._where(self._not_null(group_columns + [value_column]))} '
+               f'GROUP BY {groups} ORDER BY count DESC')
+        return self.query(sql)
+
+    # Median of each column over the rows with no missing values in any of them
+    def medians(self, columns):
+        select = ', '.join(f'MEDIAN({quote(col)}) AS {quote(col)}' for col in columns)
+        return self.query(f'SELECT {select} FROM data{self._where(self._not_null(columns))}').iloc[0]
+
+    # Median of a column per group
+    def group_medians(self, group_column, value_column):
+        group, value = quote(group_column), quote(value_column)
+        result = self.query(f'SELECT {group}, MEDIAN({value}) AS median '
+                            f'FROM data{self._where(self._not_null([group_column, value_column]))} GROUP BY {group}')
+        return result.set_index(group_column)['median']
+
+    # Random sample of n rows with no missing values in the given columns
+    def sample(self, columns, n):
+        select = ', '.join(quote(col) for col in columns)
+        # SAMPLE applies before WHERE, so the filtered rows are sampled in a subquery
+        sql = (f'SELECT * FROM (SELECT {select} FROM data{self._where(self._not_null(columns))}) '
+               f'USING SAMPLE reservoir({int(n)} ROWS)')
+        return self.query(sql)
+
+    # Random sample of up to n rows per group
+    def group_sample(self, group_columns, columns, n):
+        select = ', '.join(quote(col) for col in columns)
+        partition = ', '.join(quote(col) for col in group_columns)
+        sql = (f'SELECT {select} FROM (SELECT {select}, ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY random()) AS _rn '
+               f'FROM data{self._where(self._not_null(columns))}) WHERE _rn <= {int(n)}')
+        return self.query(sql)
+
+    # The most repeated rows with their number of copies
+    def duplicate_rows(self, limit=20):
+        select = ', '.join(quote(col) for col in self.columns)
+        return self.query(f'SELECT {select}, COUNT(*) AS copies FROM data{self._where()} GROUP BY ALL '
+                          f'HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC LIMIT {int(limit)}')
+
+    # Stream the rows as DataFrames of about chunk_rows rows
+    def chunks(self, chunk_rows=500_000, columns=None):
+        select = ', '.join(quote(col) for col in columns) if columns else '*'
+        cursor = self._con.cursor()
+        cursor.execute(f'SELECT {select} FROM data{self._where()}')
+        # DuckDB fetches in vectors of 2048 rows
+        vectors = max(1, chunk_rows // 2048)
+        while True:
+            chunk = cursor.fetch_df_chunk(vectors)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+    # Stream the rows as Arrow record batches of about chunk_rows rows, all with the schema of the result
+    def record_batches(self, chunk_rows=500_000):
+        cursor = self._con.cursor()
+        cursor.execute(f'SELECT * FROM data{self._where()}')
+        return cursor.fetch_record_batch(chunk_rows)
+
+    # Materialize the rows into pandas, for views that need a frame
+    def materialize(self, columns=None, limit=None):
+        select = ', '.join(quote(col) for col in columns) if columns else '*'
+        sql = f'SELECT {select} FROM data{self._where()}'
+        if limit is not None:
+            sql = f'SELECT * FROM ({sql}) USING SAMPLE reservoir({int(limit)} ROWS)'
+        return self.query(sql)
+
+    # Random sample of up to limit rows, drawn once per dataset and filter so
+    # the views built on it (profile, visual exploration) can be reused
+    def sample_rows(self, limit):
+        def compute():
+            sample = self.materialize(limit=limit)
+            set_dataset_key(sample, f'{self.key}|{self.filter_text}|sample{int(limit)}')
+            return sample
+        return _sample_cache.get_or_compute((self.key, self.filter_text, limit), compute)
+
+
+# Cache a column summary of the whole dataset computed elsewhere, e.g. merged
+# from the summaries of the rows appended to it
+def seed_summary(data, summary):
+    _summary_cache.put((data.key, data.filter_text), summary)
+
+
+# Stream the rows of an in-memory or out-of-core dataset as DataFrames of up to
+# chunk_rows rows, optionally of the given columns only
+def iter_chunks(data, chunk_rows, columns=None):
+    if isinstance(data, LazyDataset):
+        yield from data.chunks(chunk_rows, columns)
+        return
+    if columns is not None:
+        data = data[columns]
+    for start in range(0, len(data), chunk_rows):
+        yield data.iloc[start:start + chunk_rows]
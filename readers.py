@@ -0,0 +1,144 @@
+import io
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+
+# Readers for every uploadable dataset format.
+# Compressed CSV and JSON Lines files are decompressed as a stream by Arrow's
+# codecs while pandas parses them, so the inflated text is never held in
+# memory at once. Parquet and Arrow IPC files are read into Arrow tables and
+# converted with split blocks, releasing each Arrow column as it is
+# converted; numeric columns without nulls need no copy.
+
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
+TEXT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+BINARY_FORMATS = {'.xlsx': 'xlsx', '.parquet': 'parquet', '.feather': 'arrow', '.arrow': 'arrow', '.ipc': 'arrow'}
+
+# Extensions for st.file_uploader, which only looks at the last one
+UPLOAD_TYPES = ['csv', 'xlsx', 'gz', 'bz2', 'zst', 'parquet', 'feather', 'arrow', 'ipc', 'jsonl', 'ndjson']
+
+# JSON Lines are parsed in chunks of lines so the raw text is not read at once
+JSON_CHUNK_LINES = 100_000
+
+# Several files are parsed in worker processes when they add up to this many bytes
+PARALLEL_MIN_BYTES = 32 * 2**20
+
+# Memory estimate of parsing a file, as a multiple of its size
+READ_MEMORY_FACTOR = 10
+
+
+# Format and compression of a file name, e.g. ('csv', 'gzip') for data.csv.gz
+def file_format(name):
+    name = name.lower()
+    base, extension = os.path.splitext(name)
+    compression = COMPRESSIONS.get(extension)
+    if compression is not None:
+        base, extension = os.path.splitext(base)
+        if extension in TEXT_FORMATS:
+            return TEXT_FORMATS[extension], compression
+    elif extension in TEXT_FORMATS:
+        return TEXT_FORMATS[extension], None
+    elif extension in BINARY_FORMATS:
+        return BINARY_FORMATS[extension], None
+    raise ValueError(f'Unsupported file type: {name}')
+
+
+def _arrow_to_pandas(table):
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+# Read a path or an uploaded file object of any supported format
+def read_file(source, sheet_name=0, header=0):
+    name = source if isinstance(source, str) else source.name
+    kind, compression = file_format(name)
+    if kind == 'xlsx':
+        return pd.read_excel(source, header=header, sheet_name=sheet_name, engine='openpyxl')
+    if kind == 'parquet':
+        return _arrow_to_pandas(pq.read_table(source))
+    if kind == 'arrow':
+        # Files on disk are memory-mapped instead of read
+        return _arrow_to_pandas(feather.read_table(source, memory_map=isinstance(source, str)))
+
+    if compression is not None:
+        if not isinstance(source, str):
+            source.seek(0)
+        stream = pa.CompressedInputStream(pa.OSFile(source) if isinstance(source, str) else pa.PythonFile(source, mode='r'),
+                                          compression)
+        with stream:
+            return _read_text(stream, kind)
+    return _read_text(source, kind)
+
+
+def _read_text(source, kind):
+    if kind == 'csv':
+        return pd.read_csv(source)
+    with pd.read_json(source, lines=True, chunksize=JSON_CHUNK_LINES) as reader:
+        return pd.concat(reader, ignore_index=True)
+
+
+## ===============================================
+## Several files or sheets as one dataset
+## ===============================================
+
+# In-memory copy of an uploaded file that can be sent to a worker process
+class NamedBytesIO(io.BytesIO):
+    def __init__(self, content, name):
+        super().__init__(content)
+        self.name = name
+
+
+# Parse one file or sheet, given as (name, content, sheet_name, header) with content None for paths
+def read_part(name, content, sheet_name, header):
+    return read_file(name if content is None else NamedBytesIO(content, name), sheet_name, header)
+
+
+def part_size(part):
+    name, content = part[0], part[1]
+    return len(content) if content is not None else os.path.getsize(name)
+
+
+# Files and sheets to read, as arguments of read_part, and the source label of each.
+# Uploaded files are kept as bytes so they can be sent to worker processes.
+def file_parts(sources, sheet_names=None, header=0):
+    parts, labels = [], []
+    for source in sources:
+        name = source if isinstance(source, str) else source.name
+        content = None if isinstance(source, str) else source.getvalue()
+        sheets = (sheet_names or [0]) if file_format(name)[0] == 'xlsx' else [0]
+        for sheet in sheets:
+            parts.append((name, content, sheet, header))
+            if len(sheets) == 1:
+                labels.append(os.path.basename(name))
+            else:
+                labels.append(str(sheet) if len(sources) == 1 else f'{os.path.basename(name)}:{sheet}')
+    return parts, labels
+
+
+# Concatenate frames whose columns match up to case and surrounding spaces,
+# in the order columns first appear, with a first column naming each frame's source
+def align_frames(frames, labels, source_column='source'):
+    names = {}
+    aligned = []
+    for frame in frames:
+        renamed = {}
+        for col in frame.columns:
+            renamed[col] = names.setdefault(str(col).strip().lower(), col)
+        aligned.append(frame.rename(columns=renamed))
+    columns = {col for frame in aligned for col in frame.columns}
+    while source_column in columns:
+        source_column += '_'
+    for frame, label in zip(aligned, labels):
+        frame.insert(0, source_column, label)
+    return pd.concat(aligned, ignore_index=True, sort=False)
+
+
+# Read several files, or several sheets of the workbooks among them, and
+# concatenate them into one dataset. read_parts(parts) returns the frames of
+# the parts, e.g. parsed by jobs of the scheduler; by default they are read
+# one after the other.
+def read_many(sources, sheet_names=None, header=0, source_column='source', read_parts=None):
+    parts, labels = file_parts(sources, sheet_names, header)
+    frames = read_parts(parts) if read_parts is not None else [read_part(*part) for part in parts]
+    return align_frames(frames, labels, source_column)
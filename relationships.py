@@ -0,0 +1,145 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key
+import contingency
+
+# Relationship matrices between columns, without ydata-profiling:
+# - Pearson and Spearman correlations of numeric columns with pairwise-complete
+#   rows, from a few matrix products per block of columns
+# - Cramer's V between categorical columns, from the contingency tables shared
+#   with the association tests (see contingency)
+# - the correlation ratio (eta) of each numeric column on each categorical column
+# Blocks of columns and column pairs are split across threads for wide tables;
+# NumPy releases the GIL in the products and bincounts.
+
+# Non-numeric columns with up to this many distinct values are treated as categorical
+MAX_CATEGORIES = 50
+
+# Columns per block of the correlation products
+BLOCK_COLUMNS = 256
+
+# Column pairs per thread task for eta
+PAIRS_PER_TASK = 16
+
+_relationship_cache = DatasetCache(max_entries=16)
+
+
+# Pearson correlation of every pair of columns over the rows where both are
+# present, with the number of those rows. Columns are centered first so the
+# one-pass sums do not lose precision to large means.
+def pearson_matrix(values, workers=None):
+    values = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        centered = values - np.nanmean(np.where(valid.any(axis=0), values, 0), axis=0)
+    x = np.where(valid, centered, 0.0)
+    x2 = x * x
+    m = valid.astype('float64')
+    k = values.shape[1]
+    r = np.empty((k, k))
+    n = np.empty((k, k))
+
+    def block(start):
+        cols = slice(start, min(start + BLOCK_COLUMNS, k))
+        count = m.T @ m[:, cols]
+        # Sums of column i (rows) and column j (columns) over the rows where both are present
+        sum_i, sum_j = x.T @ m[:, cols], m.T @ x[:, cols]
+        sq_i, sq_j = x2.T @ m[:, cols], m.T @ x2[:, cols]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = x.T @ x[:, cols] - sum_i * sum_j / count
+            var_i = sq_i - sum_i ** 2 / count
+            var_j = sq_j - sum_j ** 2 / count
+            r[:, cols] = np.clip(cov / np.sqrt(var_i * var_j), -1, 1)
+        n[:, cols] = count
+
+    starts = range(0, k, BLOCK_COLUMNS)
+    if len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(block, starts))
+    else:
+        for start in starts:
+            block(start)
+    r[n < 2] = np.nan
+    return r, n
+
+
+# Average ranks of the non-null values of each column, NaN stays NaN
+def rank_columns(values):
+    return pd.DataFrame(values).rank(method='average').to_numpy(dtype='float64')
+
+
+# Spearman correlation as the Pearson correlation of the ranks. Each column is
+# ranked once over all its values; with missing values this differs slightly
+# from re-ranking the rows complete for each pair.
+def spearman_matrix(values, workers=None):
+    return pearson_matrix(rank_columns(values), workers)
+
+
+# Correlation ratio of a numeric column on a factor-coded column
+def correlation_ratio(codes, levels, values):
+    both = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[both], values[both]
+    if len(values) < 2:
+        return np.nan
+    values = values - values.mean()
+    counts = np.bincount(codes, minlength=levels)
+    sums = np.bincount(codes, weights=values, minlength=levels)
+    present = counts > 0
+    total = (values ** 2).sum()
+    if total == 0:
+        return np.nan
+    between = (sums[present] ** 2 / counts[present]).sum()
+    return float(np.sqrt(min(between / total, 1.0)))
+
+
+def _pairs_in_threads(fn, pairs, workers=None):
+    tasks = [pairs[i:i + PAIRS_PER_TASK] for i in range(0, len(pairs), PAIRS_PER_TASK)]
+    if len(tasks) > 1:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            return [value for chunk in pool.map(lambda task: [fn(*pair) for pair in task], tasks) for value in chunk]
+    return [fn(*pair) for pair in pairs]
+
+
+# Numeric and categorical columns considered for the matrices
+def relationship_columns(data, max_categories=MAX_CATEGORIES):
+    numeric, categorical = [], []
+    for col in data.columns:
+        series = data[col]
+        if ptypes.is_numeric_dtype(series) and not ptypes.is_bool_dtype(series):
+            numeric.append(col)
+        elif series.nunique() <= max_categories:
+            categorical.append(col)
+    return numeric, categorical
+
+
+def compute_relationships(data, workers=None):
+    numeric, categorical = relationship_columns(data)
+    result = {}
+    values = data[numeric].to_numpy(dtype='float64', na_value=np.nan)
+    for name, fn in [('pearson', pearson_matrix), ('spearman', spearman_matrix)]:
+        matrix, _ = fn(values, workers)
+        result[name] = pd.DataFrame(matrix, index=numeric, columns=numeric)
+
+    tables = contingency.pair_tables(data, categorical)
+    cramers = pd.DataFrame(np.eye(len(categorical)), index=categorical, columns=categorical)
+    for (a, b), table in tables.items():
+        cramers.loc[a, b] = cramers.loc[b, a] = contingency.cramers_v(table.to_numpy())
+    result['cramers_v'] = cramers
+
+    factors = {col: pd.factorize(data[col]) for col in categorical}
+    codes = {col: (c.astype(np.int64), len(levels)) for col, (c, levels) in factors.items()}
+
+    columns = {col: values[:, i] for i, col in enumerate(numeric)}
+    pairs = [(a, b) for a in categorical for b in numeric]
+    eta = _pairs_in_threads(lambda a, b: correlation_ratio(*codes[a], columns[b]), pairs, workers)
+    result['eta'] = pd.DataFrame(np.array(eta).reshape(len(categorical), len(numeric)), index=categorical, columns=numeric)
+    return result
+
+
+# Relationship matrices of a DataFrame, cached per (filtered) dataset
+def relationships(data, workers=None):
+    return _relationship_cache.get_or_compute(dataset_key(data), lambda: compute_relationships(data, workers))
@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key
+from out_of_core import iter_chunks
+
+# Approximate per-column statistics for large datasets, built in one streaming
+# pass over chunks of rows with bounded memory per column:
+# - HyperLogLog for distinct counts (about 1.6% standard error at precision 12)
+# - KLL for quantiles of numeric columns (rank error about 1% at k=200)
+# - Misra-Gries for the most frequent values (count error at most n / (capacity + 1))
+# Every sketch can be merged with a sketch of other chunks of the same column,
+# so chunks can be sketched in parallel or as they arrive.
+
+# Datasets with at least this many rows are classified and summarized from sketches
+SKETCH_MIN_ROWS = 1_000_000
+
+CHUNK_ROWS = 500_000
+
+_sketch_cache = DatasetCache(max_entries=16)
+
+
+class HyperLogLog:
+    def __init__(self, precision=12):
+        # The remaining 64 - precision hash bits must fit a float64 mantissa
+        if not 12 <= precision <= 18:
+            raise ValueError('HyperLogLog precision must be between 12 and 18')
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    # Add 64-bit hashes of the values
+    def update(self, hashes):
+        if len(hashes) == 0:
+            return
+        p = np.uint64(self.precision)
+        buckets = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        rest = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        # Position of the first 1 bit in the remaining 64 - p bits; frexp's
+        # exponent is the bit length, exact since rest < 2^52
+        ranks = (64 - self.precision) - np.frexp(rest.astype('float64'))[1] + 1
+        np.maximum.at(self.registers, buckets, ranks.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        # Linear counting is more accurate for small cardinalities
+        if raw <= 2.5 * m and zeros > 0:
+            return m * np.log(m / zeros)
+        return raw
+
+
+# KLL quantile sketch: a stack of compactors where items at level h weigh 2^h.
+# Full compactors sort their items and promote every other one to the next level.
+class KLLSketch:
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays at this level
+                keep = items[:len(items) % 2]
+                pairs = items[len(keep):]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        ranks = np.asarray(qs) * cumulative[-1]
+        positions = np.minimum(np.searchsorted(cumulative, ranks, side='left'), len(items) - 1)
+        return items[order][positions]
+
+
+# Misra-Gries summary of the most frequent values. Counts are lower bounds
+# and undercount by at most `error`; when nothing was ever evicted the
+# counts (and the number of distinct values) are exact.
+class HeavyHitters:
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.error = 0
+
+    # Keep at most capacity counters by subtracting the (capacity + 1)-th
+    # largest count from every counter
+    def _reduce(self, counts):
+        if len(counts) <= self.capacity:
+            return counts, 0
+        cut = int(counts.nlargest(self.capacity + 1).iloc[-1])
+        return counts[counts > cut] - cut, cut
+
+    # Add the counts of values in a chunk; the chunk is reduced first so
+    # only small summaries are ever aligned
+    def update(self, value_counts):
+        value_counts, cut = self._reduce(value_counts)
+        self.counts, merge_cut = self._reduce(self.counts.add(value_counts, fill_value=0).astype('int64'))
+        self.error += cut + merge_cut
+
+    def merge(self, other):
+        self.counts, cut = self._reduce(self.counts.add(other.counts, fill_value=0).astype('int64'))
+        self.error += other.error + cut
+        return self
+
+    @property
+    def exact(self):
+        return self.error == 0
+
+    def top(self, n=10):
+        return self.counts.nlargest(n)
+
+
+class ColumnSketch:
+    def __init__(self, numeric, precision=12, k=200, capacity=64):
+        self.numeric = numeric
+        self.rows = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.distinct = HyperLogLog(precision)
+        self.frequent = HeavyHitters(capacity)
+        self.quantile_sketch = KLLSketch(k) if numeric else None
+
+    def update(self, series):
+        valid = series.dropna()
+        self.rows += len(series)
+        self.nulls += len(series) - len(valid)
+        if len(valid) == 0:
+            return
+        self.distinct.update(pd.util.hash_pandas_object(valid, index=False).to_numpy())
+        self.frequent.update(valid.value_counts(sort=False))
+        if self.numeric:
+            values = valid.to_numpy(dtype='float64')
+            self.quantile_sketch.update(values)
+            self.total += values.sum()
+            self.minimum = values.min() if self.minimum is None else min(self.minimum, values.min())
+            self.maximum = values.max() if self.maximum is None else max(self.maximum, values.max())
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.total += other.total
+        for bound, pick in [('minimum', min), ('maximum', max)]:
+            values = [v for v in (getattr(self, bound), getattr(other, bound)) if v is not None]
+            setattr(self, bound, pick(values) if values else None)
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+        if self.numeric:
+            self.quantile_sketch.merge(other.quantile_sketch)
+        return self
+
+    # Exact while the heavy hitters summary holds every value, estimated after
+    def distinct_count(self):
+        if self.frequent.exact:
+            return len(self.frequent.counts)
+        return max(int(round(self.distinct.estimate())), self.frequent.capacity + 1)
+
+
+class DatasetSketch:
+    def __init__(self, dtypes, **kwargs):
+        self.columns = {col: ColumnSketch(ptypes.is_numeric_dtype(dtype) and not ptypes.is_bool_dtype(dtype), **kwargs)
+                        for col, dtype in dtypes.items()}
+
+    def update(self, chunk):
+        for col, sketch in self.columns.items():
+            sketch.update(chunk[col])
+        return self
+
+    def merge(self, other):
+        for col, sketch in self.columns.items():
+            sketch.merge(other.columns[col])
+        return self
+
+    @property
+    def rows(self):
+        return next(iter(self.columns.values())).rows if self.columns else 0
+
+    def distinct_counts(self):
+        return {col: sketch.distinct_count() for col, sketch in self.columns.items()}
+
+    # One row of approximate statistics per column
+    def summary(self, qs=(0.01, 0.25, 0.5, 0.75, 0.99)):
+        rows = []
+        for col, sketch in self.columns.items():
+            row = {'column': col, 'non-null': sketch.rows - sketch.nulls, 'missing': sketch.nulls,
+                   'distinct (approx.)': sketch.distinct_count()}
+            if sketch.numeric:
+                valid = sketch.rows - sketch.nulls
+                row.update({'mean': sketch.total / valid if valid else np.nan, 'min': sketch.minimum})
+                row.update({f'p{round(q * 100)}': value for q, value in zip(qs, sketch.quantile_sketch.quantiles(qs))})
+                row['max'] = sketch.maximum
+            top = sketch.frequent.top(1)
+            row['most frequent'] = None if top.empty else f'{top.index[0]} ({top.iloc[0]})'
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    # Most frequent values of a column with lower bounds of their counts
+    def top_values(self, col, n=10):
+        return self.columns[col].frequent.top(n).rename('count (lower bound)').rename_axis(col).reset_index()
+
+
+# Sketch a sequence of DataFrame chunks with the same columns
+def build_sketch(chunks, dtypes, **kwargs):
+    sketch = DatasetSketch(dtypes, **kwargs)
+    for chunk in chunks:
+        sketch.update(chunk)
+    return sketch
+
+
+# Sketch of an in-memory or out-of-core dataset, cached per dataset
+def dataset_sketch(data, chunk_rows=CHUNK_ROWS):
+    if isinstance(data, pd.DataFrame):
+        return _sketch_cache.get_or_compute(dataset_key(data),
+                                            lambda: build_sketch(iter_chunks(data, chunk_rows), data.dtypes))
+    # Out-of-core datasets stream their (filtered) rows from DuckDB
+    def compute():
+        sketch = None
+        for chunk in data.chunks(chunk_rows):
+            sketch = (sketch or DatasetSketch(chunk.dtypes)).update(chunk)
+        return sketch or DatasetSketch({})
+    return _sketch_cache.get_or_compute((data.key, data.filter_text), compute)
+
+
+# Cache a sketch of a dataset computed elsewhere, e.g. merged from the
+# sketches of the rows appended to it; the sketch must not be updated afterwards
+def seed_sketch(data, sketch):
+    _sketch_cache.put(dataset_key(data) if isinstance(data, pd.DataFrame) else (data.key, data.filter_text), sketch)
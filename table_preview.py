@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key, column_kind, get_index, SortedIndex
+
+# Server-side paging, sorting and searching for the dataset preview.
+# Only the rows of the visible page are sent to the browser; the row orders
+# and search hits over the full (filtered) dataset are cached per dataset.
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+_summary_cache = DatasetCache(max_entries=32)
+_order_cache = DatasetCache(max_entries=64)
+_search_cache = DatasetCache(max_entries=64)
+
+
+# Per-column summary shown above the preview table
+def column_summary(data):
+    def compute():
+        rows = []
+        for col in data.columns:
+            series = data[col]
+            is_numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+            rows.append({'column': col,
+                         'type': str(series.dtype),
+                         'non-null': int(series.notna().sum()),
+                         'distinct': int(series.nunique()),
+                         'min': series.min() if is_numeric else None,
+                         'max': series.max() if is_numeric else None})
+        return pd.DataFrame(rows)
+    return _summary_cache.get_or_compute(dataset_key(data), compute)
+
+
+# Row positions of the dataset sorted by a column, nulls last
+def sort_order(data, column, ascending=True):
+    def compute():
+        if column_kind(data[column]) is not None:
+            # Reuse the filter index, it is the column already sorted
+            index = get_index(data, column, SortedIndex)
+            rows = index.row_ids if ascending else index.row_ids[::-1]
+            nulls = np.ones(len(data), dtype=bool)
+            nulls[index.row_ids] = False
+            return np.concatenate([rows, np.flatnonzero(nulls)])
+        order = data[column].reset_index(drop=True).sort_values(
+            ascending=ascending, kind='stable', na_position='last').index
+        return order.to_numpy()
+    return _order_cache.get_or_compute((dataset_key(data), column, ascending), compute)
+
+
+# Row positions whose text columns contain the search text (case-insensitive)
+def search_rows(data, text):
+    def compute():
+        mask = np.zeros(len(data), dtype=bool)
+        for col in data.columns:
+            series = data[col]
+            if pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                mask |= series.astype(str).str.contains(text, case=False, regex=False).to_numpy() & series.notna().to_numpy()
+            else:
+                mask |= (series.astype(str).str.lower() == text.lower()).to_numpy()
+        return np.flatnonzero(mask)
+    return _search_cache.get_or_compute((dataset_key(data), text), compute)
+
+
+# Row positions to display, in display order, after search and sort
+def view_rows(data, sort_column=None, ascending=True, search_text=''):
+    rows = np.arange(len(data)) if sort_column is None else sort_order(data, sort_column, ascending)
+    if search_text:
+        hits = np.zeros(len(data), dtype=bool)
+        hits[search_rows(data, search_text)] = True
+        rows = rows[hits[rows]]
+    return rows
+
+
+# The rows of one page, indexed by their position in the dataset
+def page(data, rows, page_number, page_size):
+    start = (page_number - 1) * page_size
+    return data.take(rows[start:start + page_size])
+
+
+def page_count(n_rows, page_size):
+    return max(1, -(-n_rows // page_size))
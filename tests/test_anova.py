@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+from statsmodels.formula.api import ols
+from anova import cell_statistics, cells_from_aggregates, two_way_anova_table
+
+# The closed-form two-way ANOVA against sm.stats.anova_lm(typ=2)
+
+
+def design(levels_1, levels_2, counts, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i, a in enumerate(levels_1):
+        for j, b in enumerate(levels_2):
+            n = counts[i][j]
+            rows.append(pd.DataFrame({'a': [a] * n, 'b': [b] * n,
+                                      'y': rng.normal(i + 0.5 * j + 0.3 * i * j, 1.0, n)}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def statsmodels_table(data):
+    model = ols('y ~ C(a) + C(b) + C(a):C(b)', data=data).fit()
+    return sm.stats.anova_lm(model, typ=2)
+
+
+def assert_same_table(table, expected):
+    np.testing.assert_allclose(table['sum_sq'].to_numpy(), expected['sum_sq'].to_numpy(), rtol=1e-9)
+    np.testing.assert_allclose(table['df'].to_numpy(), expected['df'].to_numpy())
+    np.testing.assert_allclose(table['F'].to_numpy()[:3], expected['F'].to_numpy()[:3], rtol=1e-9)
+    np.testing.assert_allclose(table['PR(>F)'].to_numpy()[:3], expected['PR(>F)'].to_numpy()[:3], rtol=1e-7, atol=1e-300)
+    assert table.iloc[3][['F', 'PR(>F)']].isna().all()
+
+
+def test_balanced_design_matches_statsmodels():
+    data = design(['x', 'y', 'z'], ['p', 'q'], [[10, 10], [10, 10], [10, 10]])
+    table = two_way_anova_table(cell_statistics(data, 'a', 'b', 'y'), 'a', 'b')
+    assert list(table.index) == ['C(a)', 'C(b)', 'C(a):C(b)', 'Residual']
+    assert_same_table(table, statsmodels_table(data))
+
+
+def test_unbalanced_design_matches_statsmodels():
+    data = design(['x', 'y', 'z'], ['p', 'q', 'r'], [[5, 12, 3], [20, 2, 9], [7, 7, 30]], seed=1)
+    table = two_way_anova_table(cell_statistics(data, 'a', 'b', 'y'), 'a', 'b')
+    assert_same_table(table, statsmodels_table(data))
+
+
+# Out-of-core datasets build the cells from count, mean and standard deviation per group
+def test_cells_from_aggregates_match_cell_statistics():
+    data = design(['x', 'y'], ['p', 'q', 'r'], [[4, 9, 6], [11, 3, 8]], seed=2)
+    aggregates = data.groupby(['a', 'b'])['y'].agg(['count', 'mean', 'std']).reset_index()
+    table = two_way_anova_table(cells_from_aggregates(aggregates, 'a', 'b'), 'a', 'b')
+    assert_same_table(table, statsmodels_table(data))
+
+
+@pytest.mark.parametrize('names', [('fuel type', 'gear-box', 'price (EUR)'), ("owner's", 'a:b', 'y + 1')])
+def test_factor_names_need_not_be_formula_terms(names):
+    data = design(['x', 'y', 'z'], ['p', 'q'], [[6, 9], [4, 12], [8, 5]], seed=3)
+    renamed = data.rename(columns=dict(zip(['a', 'b', 'y'], names)))
+    table = two_way_anova_table(cell_statistics(renamed, *names), names[0], names[1])
+    assert list(table.index) == [f'C({names[0]})', f'C({names[1]})', f'C({names[0]}):C({names[1]})', 'Residual']
+    assert_same_table(table, statsmodels_table(data))
+
+
+# With an empty cell the degrees of freedom come from the rank of the cell design:
+# 3 x 3 levels with 8 non-empty cells leave 8 - 5 = 3 interaction degrees of freedom
+def test_empty_cell_takes_degrees_of_freedom_from_the_cell_design():
+    data = design(['x', 'y', 'z'], ['p', 'q', 'r'], [[5, 6, 7], [8, 0, 6], [7, 9, 5]], seed=4)
+    table = two_way_anova_table(cell_statistics(data, 'a', 'b', 'y'), 'a', 'b')
+    assert list(table['df']) == [2.0, 2.0, 3.0, len(data) - 8]
+    # anova_lm's Wald tests inflate the sums of squares of a rank-deficient design;
+    # Type II sums of squares are differences of the residuals of the nested OLS fits
+    ssr = {formula: ols(f'y ~ {formula}', data=data).fit().ssr
+           for formula in ['C(a)', 'C(b)', 'C(a) + C(b)', 'C(a) + C(b) + C(a):C(b)']}
+    expected = [ssr['C(b)'] - ssr['C(a) + C(b)'], ssr['C(a)'] - ssr['C(a) + C(b)'],
+                ssr['C(a) + C(b)'] - ssr['C(a) + C(b) + C(a):C(b)'], ssr['C(a) + C(b) + C(a):C(b)']]
+    np.testing.assert_allclose(table['sum_sq'].to_numpy(), expected, rtol=1e-9)
+
+
+def test_single_level_factor_gives_nan_p_values():
+    data = design(['x'], ['p', 'q'], [[10, 12]])
+    table = two_way_anova_table(cell_statistics(data, 'a', 'b', 'y'), 'a', 'b')
+    assert table.loc['C(a)', 'df'] == 0
+    assert np.isnan(table.loc['C(a)', 'PR(>F)'])
+    assert not np.isnan(table.loc['C(b)', 'PR(>F)'])
@@ -0,0 +1,45 @@
+import os
+from streamlit.testing.v1 import AppTest
+
+# Headless runs of the Machine Learning section of app_with_ML.py
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def widget(at, kind, label):
+    return next(element for element in at.get(kind) if label in element.label)
+
+
+def open_machine_learning(monkeypatch, out_of_core):
+    monkeypatch.syspath_prepend(APP_DIR)
+    # The sample dataset is opened from the working directory
+    monkeypatch.chdir(APP_DIR)
+    at = AppTest.from_file(os.path.join(APP_DIR, 'app_with_ML.py'), default_timeout=600)
+    at.run()
+    widget(at, 'checkbox', 'Warm up').uncheck().run()
+    if out_of_core:
+        widget(at, 'checkbox', 'Out-of-core').check().run()
+        widget(at, 'text_input', 'Local file path').input(os.path.join(APP_DIR, 'toyota.csv')).run()
+    else:
+        widget(at, 'checkbox', 'Load sample dataset').check().run()
+    widget(at, 'radio', 'MENU').set_value('Machine Learning').run()
+    assert not at.exception
+    return at
+
+
+# PyCaret needs the rows in memory: out-of-core datasets are only offered incremental training
+def test_out_of_core_dataset_trains_incrementally(monkeypatch):
+    at = open_machine_learning(monkeypatch, out_of_core=True)
+    assert widget(at, 'radio', 'Training mode').options == ['Incremental (chunked, for large datasets)']
+
+    widget(at, 'radio', 'experiment type').set_value('Regression').run()
+    widget(at, 'selectbox', 'Target').set_value('price').run()
+    next(button for button in at.button if button.label == 'Train Model').click().run()
+    assert not at.exception
+    assert any(metric.label == 'Training throughput' for metric in at.metric)
+
+
+def test_in_memory_dataset_offers_automl(monkeypatch):
+    at = open_machine_learning(monkeypatch, out_of_core=False)
+    assert widget(at, 'radio', 'Training mode').options == ['AutoML (PyCaret, in memory)',
+                                                             'Incremental (chunked, for large datasets)']
@@ -0,0 +1,159 @@
+import os
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from pandasql import sqldf
+import data_sources
+from data_sources import SQLiteTable, WatchedFolder, load_frame, open_store
+from filter_engine import filter_row_ids
+
+# Incremental refresh of watched folders and SQLite tables: each refresh reads
+# only what was added since the last one, and the store, its statistics and the
+# in-memory frame end up the same as loading all the data at once
+
+
+@pytest.fixture(autouse=True)
+def sources_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_sources, 'SOURCES_DIR', str(tmp_path / 'sources'))
+    monkeypatch.setattr(data_sources, 'SETTLE_SECONDS', 0)
+    return tmp_path / 'sources'
+
+
+def batch(rows, seed):
+    rng = np.random.default_rng(seed)
+    price = rng.normal(15000, 4000, rows).round(2)
+    price[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({'model': rng.choice(['Yaris', 'Aygo', 'Corolla'], rows),
+                         'year': rng.integers(2000, 2021, rows), 'price': price})
+
+
+# Files are ingested oldest first: each new file is given a later modification time
+def write_file(folder, name, frame, age=None):
+    path = os.path.join(folder, name)
+    if name.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+    modified = time.time() - (age if age is not None else 100 - len(os.listdir(folder)))
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_watched_folder_reads_only_new_files(tmp_path):
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    first, second = batch(200, 0), batch(150, 1)
+    write_file(folder, 'a.csv', first)
+    source = WatchedFolder(str(folder))
+    result = source.refresh(force=True)
+    assert (result['rows'], result['files'], result['rejected']) == (200, ['a.csv'], {})
+
+    write_file(folder, 'b.parquet', second)
+    write_file(folder, 'notes.txt', pd.DataFrame({'x': [1]}))
+    result = source.refresh(force=True)
+    assert (result['rows'], result['parts'], result['files']) == (150, 1, ['b.parquet'])
+    assert source.refresh(force=True)['rows'] == 0
+    # Refreshes without force wait REFRESH_SECONDS between checks
+    write_file(folder, 'c.csv', batch(10, 2))
+    assert source.refresh()['rows'] == 0
+
+    expected = pd.concat([first, second], ignore_index=True)
+    pd.testing.assert_frame_equal(load_frame(source), expected)
+    assert len(open_store(source)) == len(expected) == source.state['rows']
+
+
+# The statistics merged refresh by refresh are those of all the rows
+def test_store_summary_matches_the_rows(tmp_path):
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    batches = [batch(300, seed) for seed in range(3)]
+    source = WatchedFolder(str(folder))
+    for i, frame in enumerate(batches):
+        write_file(folder, f'{i}.csv', frame)
+        source.refresh(force=True)
+    data = pd.concat(batches, ignore_index=True)
+    summary = open_store(source).summary().set_index('column_name')
+    assert summary.loc['price', 'null_percentage'] == pytest.approx(100 * data['price'].isna().mean())
+    assert float(summary.loc['price', 'min']) == data['price'].min()
+    assert float(summary.loc['price', 'max']) == data['price'].max()
+    assert summary.loc['model', 'approx_unique'] == 3
+    assert summary.loc['year', 'approx_unique'] == data['year'].nunique()
+
+
+def test_rejected_files_are_retried_once_they_change(tmp_path):
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    write_file(folder, 'a.csv', batch(50, 0))
+    source = WatchedFolder(str(folder))
+    source.refresh(force=True)
+    write_file(folder, 'b.csv', batch(50, 1).rename(columns={'price': 'cost'}))
+    result = source.refresh(force=True)
+    assert result['rows'] == 0 and 'columns differ' in result['rejected']['b.csv']
+    # An unchanged rejected file is neither read again nor reported again
+    assert source.refresh(force=True)['rejected'] == {}
+    write_file(folder, 'b.csv', batch(50, 1), age=1)
+    result = source.refresh(force=True)
+    assert (result['rows'], result['files'], result['rejected']) == (50, ['b.csv'], {})
+
+
+# The state is kept with the store, so a new source object (e.g. after a
+# restart) carries on where the last refresh stopped
+def test_state_survives_a_new_source_object(tmp_path):
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    write_file(folder, 'a.csv', batch(50, 0))
+    WatchedFolder(str(folder)).refresh(force=True)
+    source = WatchedFolder(str(folder))
+    assert source.state['rows'] == 50
+    assert source.refresh(force=True)['rows'] == 0
+
+
+def create_table(database, frame):
+    con = sqlite3.connect(database)
+    frame.to_sql('listings', con, index=False, if_exists='append')
+    con.close()
+
+
+@pytest.mark.parametrize('key_column', ['', 'listing_id'])
+def test_sqlite_table_reads_only_new_rows(tmp_path, monkeypatch, key_column):
+    monkeypatch.setattr(data_sources, 'CHUNK_ROWS', 64)
+    database = str(tmp_path / 'cars.db')
+    first, second = batch(200, 0), batch(100, 1)
+    first.insert(0, 'listing_id', np.arange(200) * 2)
+    second.insert(0, 'listing_id', 400 + np.arange(100) * 2)
+    create_table(database, first)
+    source = SQLiteTable(database, 'listings', key_column)
+    result = source.refresh(force=True)
+    # One part file per batch of CHUNK_ROWS rows
+    assert (result['rows'], result['parts']) == (200, 4)
+    create_table(database, second)
+    result = source.refresh(force=True)
+    assert (result['rows'], result['parts']) == (100, 2)
+    assert source.refresh(force=True)['rows'] == 0
+    pd.testing.assert_frame_equal(load_frame(source), pd.concat([first, second], ignore_index=True))
+    assert data_sources.sqlite_tables(database) == ['listings']
+
+
+# The in-memory frame grows by the new parts, and filters on it use the
+# indexes built before the refresh, extended with the new rows
+def test_loaded_frame_grows_with_its_indexes(tmp_path):
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    write_file(folder, 'a.csv', batch(500, 0))
+    source = WatchedFolder(str(folder))
+    source.refresh(force=True)
+    before = load_frame(source)
+    assert load_frame(source) is before
+    filter_text = "year >= 2015 AND model = 'Aygo'"
+    filter_row_ids(before, filter_text)
+
+    write_file(folder, 'b.csv', batch(300, 1))
+    source.refresh(force=True)
+    after = load_frame(source)
+    assert len(after) == 800
+    pd.testing.assert_frame_equal(after.head(500), before)
+    table = after.assign(_ref_row=np.arange(len(after)))
+    expected = sqldf(f'SELECT _ref_row FROM data WHERE {filter_text}', {'data': table})['_ref_row'].to_numpy()
+    np.testing.assert_array_equal(filter_row_ids(after, filter_text), expected)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+import duplicates
+from duplicates import find_duplicates, minhash_signatures, normalized_text
+from out_of_core import LazyDataset
+
+# Exact duplicates against pandas' duplicated(), near-duplicates against the
+# Jaccard similarity of the character shingles of the texts
+
+
+def listings(rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'model': rng.choice(['Yaris', 'Aygo', 'Corolla'], rows),
+        'year': rng.integers(2015, 2018, rows),
+        'price': rng.choice([9999.0, 12500.0, np.nan], rows),
+        'fuel': rng.choice(['Petrol', None], rows),
+    })
+
+
+def shingles(text):
+    return {text[i:i + duplicates.SHINGLE_SIZE] for i in range(max(1, len(text) - duplicates.SHINGLE_SIZE + 1))}
+
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+@pytest.mark.parametrize('chunk_rows', [100, 1000, 10_000])
+def test_exact_duplicates_match_pandas(chunk_rows):
+    data = listings()
+    report = find_duplicates(data, chunk_rows=chunk_rows)
+    np.testing.assert_array_equal(report.exact, data.duplicated().to_numpy())
+    assert report.exact_count == data.duplicated().sum()
+    assert report.near_count is None and report.near_groups() is None
+
+
+def test_exact_groups_are_the_largest_groups_with_their_first_row():
+    data = listings()
+    groups = find_duplicates(data, chunk_rows=500).exact_groups(limit=5)
+    sizes = data.groupby(list(data.columns), dropna=False).size().sort_values(ascending=False)
+    assert list(groups['count']) == list(sizes.head(5))
+    for first_row, count in zip(groups['first_row'], groups['count']):
+        same = (data.eq(data.iloc[first_row]) | (data.isna() & data.iloc[first_row].isna())).all(axis=1)
+        assert same.sum() == count
+        assert same.idxmax() == first_row
+
+
+# The share of equal MinHash values estimates the Jaccard similarity of the shingles
+def test_signature_agreement_estimates_jaccard():
+    rng = np.random.default_rng(1)
+    words = ['red', 'blue', 'hybrid', 'manual', 'one owner', 'low mileage', 'full service history', 'new tyres']
+    pairs = []
+    for _ in range(300):
+        a = ' '.join(rng.choice(words, 6))
+        b = ' '.join(rng.choice(words, 6)) if rng.random() < 0.5 else a[:-rng.integers(1, 15)]
+        pairs.append((a, b))
+    signatures = minhash_signatures([text for pair in pairs for text in pair])
+    estimates = (signatures[0::2] == signatures[1::2]).mean(axis=1)
+    exact = np.array([jaccard(a, b) for a, b in pairs])
+    assert np.mean(np.abs(estimates - exact)) < 0.05
+
+
+def test_near_duplicates_group_similar_texts():
+    base = ['Toyota Yaris 1.5 hybrid, one owner, full service history, very clean',
+            'Corolla estate with tow bar and winter tyres, recent cambelt',
+            'Aygo x-play, low mileage, city car, cheap to insure, long MOT']
+    texts = [base[0], base[1], base[0].upper(), '  ' + base[0].replace(' ', '   '),
+             base[0].replace('very clean', 'very clean!'), base[2], base[1].replace('tow bar', 'towbar'),
+             'A completely different description of another car']
+    data = pd.DataFrame({'description': texts, 'row': np.arange(len(texts))})
+    report = find_duplicates(data, ['description'], threshold=0.8)
+    # No two rows are equal on every column
+    assert report.exact_count == 0
+    # Copies up to case and whitespace, and the edited copies of the first two texts
+    assert jaccard(texts[0].lower(), texts[4].lower()) > 0.9 and jaccard(texts[1].lower(), texts[6].lower()) > 0.9
+    np.testing.assert_array_equal(report.near, [False, False, True, True, True, False, True, False])
+    groups = report.near_groups()
+    assert list(groups['rows']) == [4, 2]
+    assert list(groups['distinct_texts']) == [2, 2]
+
+
+def test_normalized_text_joins_columns():
+    frame = pd.DataFrame({'a': ['Red  Car', None], 'b': [' Manual', 'Auto']})
+    assert list(normalized_text(frame, ['a', 'b'])) == ['red car manual', 'auto']
+
+
+def test_out_of_core_dataset_gives_the_same_report(tmp_path):
+    data = listings(2000, seed=2)
+    data['description'] = data['model'] + ' ' + data['year'].astype(str) + ' ' + data['fuel'].fillna('')
+    path = str(tmp_path / 'listings.parquet')
+    data.to_parquet(path, index=False)
+    expected = find_duplicates(data, ['description'])
+    report = find_duplicates(LazyDataset(path), ['description'], chunk_rows=300)
+    assert report.exact_count == expected.exact_count == data.duplicated().sum()
+    assert report.near_count == expected.near_count
@@ -0,0 +1,105 @@
+import os
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import export
+from export import export_chunks, export_file
+from out_of_core import LazyDataset
+
+# Round trips of streamed exports: the file read back is the exported frame,
+# whatever the number of chunks it was written in
+
+
+def frame(rows=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = rng.normal(15000, 4000, rows).round(2)
+    price[rng.random(rows) < 0.1] = np.nan
+    model = rng.choice(['Yaris', 'Aygo, 5 door', 'C-HR "GR"', 'Corolla\nEstate'], rows).astype(object)
+    model[rng.random(rows) < 0.1] = None
+    # Missing from the whole first chunk
+    mileage = np.where(np.arange(rows) < 300, np.nan, rng.integers(0, 100_000, rows)).astype('float64')
+    return pd.DataFrame({
+        'year': rng.integers(2000, 2021, rows),
+        'price': price,
+        'model': model,
+        'mileage': mileage,
+        'automatic': rng.random(rows) < 0.5,
+        'sold': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10**8, rows), unit='s'),
+    })
+
+
+def exported(data, fmt, chunk_rows=256, index=False):
+    return io.BytesIO(b''.join(export_chunks(data, fmt, chunk_rows, index)))
+
+
+@pytest.mark.parametrize('chunk_rows', [256, 10_000])
+def test_csv_round_trip(chunk_rows):
+    data = frame()
+    result = pd.read_csv(exported(data, 'CSV', chunk_rows), parse_dates=['sold'])
+    pd.testing.assert_frame_equal(result, data)
+
+
+@pytest.mark.parametrize('chunk_rows', [256, 10_000])
+def test_parquet_round_trip(chunk_rows):
+    data = frame()
+    pd.testing.assert_frame_equal(pd.read_parquet(exported(data, 'Parquet', chunk_rows)), data)
+
+
+def test_xlsx_round_trip():
+    data = frame(300)
+    result = pd.read_excel(exported(data, 'Excel (XLSX)'), sheet_name=None)
+    assert list(result) == ['Sheet1']
+    pd.testing.assert_frame_equal(result['Sheet1'], data)
+
+
+def test_xlsx_continues_on_new_sheets(monkeypatch):
+    monkeypatch.setattr(export, 'XLSX_MAX_ROWS', 120)
+    data = frame(300)
+    sheets = pd.read_excel(exported(data, 'Excel (XLSX)', chunk_rows=100), sheet_name=None)
+    assert list(sheets) == ['Sheet1', 'Sheet2', 'Sheet3']
+    assert [len(sheet) for sheet in sheets.values()] == [120, 120, 60]
+    pd.testing.assert_frame_equal(pd.concat(sheets.values(), ignore_index=True), data)
+
+
+@pytest.mark.parametrize('fmt, read', [('CSV', pd.read_csv), ('Parquet', pd.read_parquet),
+                                       ('Excel (XLSX)', pd.read_excel)])
+def test_empty_frame_keeps_its_columns(fmt, read):
+    data = frame().head(0)
+    assert list(read(exported(data, fmt)).columns) == list(data.columns)
+
+
+# Result tables keep their index as columns, and non-text column names are written as text
+def test_result_table_keeps_its_index():
+    table = pd.DataFrame([[1.0, 0.03], [0.03, 1.0]], index=pd.Index(['a', 'b'], name='group'), columns=[1, 2])
+    result = pd.read_parquet(exported(table, 'Parquet', index=True))
+    pd.testing.assert_frame_equal(result, table.reset_index().rename(columns=str))
+    result = pd.read_csv(exported(table, 'CSV', index=True))
+    pd.testing.assert_frame_equal(result, table.reset_index().rename(columns=str))
+
+
+def test_out_of_core_export_round_trip(tmp_path):
+    data = frame()
+    path = str(tmp_path / 'cars.parquet')
+    data.to_parquet(path, index=False)
+    dataset = LazyDataset(path).filtered('year >= 2010')
+    expected = data[data['year'] >= 2010].reset_index(drop=True)
+    result = pd.read_parquet(exported(dataset, 'Parquet', chunk_rows=100))
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+    result = pd.read_csv(exported(dataset, 'CSV', chunk_rows=100), parse_dates=['sold'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_export_file_is_written_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'EXPORT_DIR', str(tmp_path))
+    data = frame(100)
+    path = export_file(data, 'CSV', name='cars', chunk_rows=30)
+    assert path.startswith(str(tmp_path)) and path.endswith('.csv')
+    pd.testing.assert_frame_equal(pd.read_csv(path, parse_dates=['sold']), data)
+    modified = os.stat(path).st_mtime_ns
+    assert export_file(data, 'CSV', name='cars') == path
+    assert os.stat(path).st_mtime_ns == modified
+    # Another filter of the data, or another format, is another file
+    assert export_file(data.head(50), 'CSV', name='cars') != path
+    assert export_file(data, 'Parquet', name='cars') != path
+    assert not list(tmp_path.glob('*.partial'))
@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandasql import sqldf
+import filter_engine
+from filter_engine import HashIndex, SortedIndex, extend_indexes, filter_data, filter_row_ids
+
+# The indexed filter engine against pandasql running the same WHERE clause
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    filter_engine.clear_index_cache()
+    yield
+    filter_engine.clear_index_cache()
+
+
+def dataset(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = rng.normal(20000, 6000, rows).round(2)
+    price[rng.random(rows) < 0.05] = np.nan
+    model = rng.choice(['Yaris', 'Aygo', 'Corolla', 'C-HR', "Land Cruiser 'LC'"], rows).astype(object)
+    model[rng.random(rows) < 0.05] = None
+    return pd.DataFrame({
+        'year': rng.integers(2000, 2021, rows),
+        'price': price,
+        'model': model,
+        'fuel type': rng.choice(['Petrol', 'Diesel', 'Hybrid'], rows),
+        'automatic': rng.random(rows) < 0.4,
+    })
+
+
+# Row ids of the rows sqldf returns for the filter, in their original order
+def sqldf_row_ids(data, filter_text):
+    table = data.assign(_ref_row=np.arange(len(data)))
+    return sqldf(f'SELECT _ref_row FROM data WHERE {filter_text}', {'data': table})['_ref_row'].to_numpy()
+
+
+def assert_same_rows(data, filter_text):
+    expected = sqldf_row_ids(data, filter_text)
+    np.testing.assert_array_equal(filter_row_ids(data, filter_text), expected)
+    return expected
+
+
+FILTERS = [
+    'year = 2015',
+    'year == 2015',
+    'year <> 2015',
+    'year != 2015',
+    'year >= 2018',
+    'year < 2003',
+    '2010 <= year',
+    'price > 25000.5',
+    'price <= 1e4',
+    'price <> 20000',
+    'price BETWEEN 15000 AND 18000',
+    'year IN (2001, 2005, 2019)',
+    "model = 'Yaris'",
+    "model <> 'Yaris'",
+    "model IN ('Aygo', 'C-HR', 'Supra')",
+    "model > 'B'",
+    "model = 'Land Cruiser ''LC'''",
+    "MODEL = 'Corolla'",
+    '"fuel type" = \'Hybrid\'',
+    '[fuel type] IN (\'Petrol\', \'Diesel\')',
+    'year = 2015 AND price < 20000',
+    "year BETWEEN 2005 AND 2010 AND model = 'Aygo' and price > 10000",
+]
+
+
+@pytest.mark.parametrize('filter_text', FILTERS)
+def test_indexed_predicates_match_sqldf(filter_text):
+    assert_same_rows(dataset(), filter_text)
+
+
+# Terms the indexes do not answer run in SQLite, over the rows the indexed terms left
+@pytest.mark.parametrize('filter_text', [
+    'automatic = 1',
+    'price IS NULL',
+    'model IS NOT NULL AND year > 2010',
+    "model LIKE 'C%' AND price > 20000",
+    'year = 2015 OR year = 2016',
+    'year + 1 > 2019 AND automatic',
+    'year = 2015 AND price > (SELECT avg(price) FROM data)',
+    'rowid <= 100 AND year > 2010',
+    "year > '2010'",
+])
+def test_fallback_terms_match_sqldf(filter_text):
+    assert_same_rows(dataset(), filter_text)
+
+
+# pandasql returns the rows in table order: the filtered frame must be the same
+def test_filter_data_returns_the_sqldf_frame():
+    data = dataset(500)
+    filter_text = "year >= 2010 AND model IN ('Yaris', 'Aygo')"
+    expected = sqldf(f'SELECT * FROM data WHERE {filter_text}', {'data': data})
+    result = filter_data(data, filter_text)
+    pd.testing.assert_frame_equal(result.astype({'automatic': int}), expected, check_dtype=False)
+
+
+def test_empty_filter_returns_the_dataset():
+    data = dataset(100)
+    assert filter_data(data, '  ') is data
+
+
+def test_indexes_are_built_once_per_column():
+    data = dataset()
+    filter_row_ids(data, 'year > 2010')
+    filter_row_ids(data, 'year < 2005')
+    keys = [key for key, _ in filter_engine._index_cache.items()]
+    assert keys.count((filter_engine.dataset_key(data), 'year', 'SortedIndex')) == 1
+
+
+@pytest.mark.parametrize('index_type', [SortedIndex, HashIndex])
+def test_appended_index_matches_a_rebuilt_index(index_type):
+    data = dataset(3000, seed=1)
+    before, after = data.iloc[:2000].reset_index(drop=True), data
+    values = {col: filter_engine._column_values(data[col], filter_engine.column_kind(data[col]))
+              for col in ('year', 'model')}
+    for col in values:
+        appended = index_type(values[col][:2000]).appended(values[col][2000:], 2000)
+        rebuilt = index_type(values[col])
+        np.testing.assert_array_equal(appended.row_ids, rebuilt.row_ids)
+    # Filters on the grown dataset use the extended indexes
+    filter_row_ids(before, "year > 2010 AND model = 'Yaris'")
+    extend_indexes(before, after)
+    assert_same_rows(after, "year > 2010 AND model = 'Yaris'")
+
+
+## Refinement of a previous filter
+
+# Each filter of a session of edits, each checked against sqldf
+@pytest.mark.parametrize('filters', [
+    ['year > 2010', 'year > 2010 AND price < 20000', "year > 2010 AND price < 20000 AND model = 'Yaris'",
+     'year > 2010', 'price < 20000', 'PRICE  <  20000 and YEAR > 2010'],
+    ["model LIKE 'C%'", "model LIKE 'C%' AND automatic", "model LIKE 'C%' AND automatic AND year < 2010",
+     "model LIKE 'C%' OR automatic"],
+    ['year > 2010', 'year > 2010 AND rowid <= 300', 'year > 2010 AND rowid <= 300 AND price > 15000'],
+    ['year > 2010', 'year > 2010 AND price > (SELECT avg(price) FROM data)'],
+])
+def test_refined_filters_match_sqldf(filters):
+    data = dataset()
+    for filter_text in filters:
+        assert_same_rows(data, filter_text)
+
+
+# The extra term of a refined filter only runs over the rows of the previous result
+def test_refinement_evaluates_the_new_term_over_the_previous_rows(monkeypatch):
+    data = dataset()
+    evaluated = []
+    evaluate_sql = filter_engine.evaluate_sql
+    def recording_evaluate_sql(data, clauses, row_ids=None):
+        evaluated.append((clauses, None if row_ids is None else len(row_ids)))
+        return evaluate_sql(data, clauses, row_ids)
+    monkeypatch.setattr(filter_engine, 'evaluate_sql', recording_evaluate_sql)
+
+    previous = filter_row_ids(data, "model LIKE 'C%'")
+    rows = filter_row_ids(data, "model LIKE 'C%' AND automatic")
+    assert evaluated == [(["model LIKE 'C%'"], None), (['automatic'], len(previous))]
+    np.testing.assert_array_equal(rows, sqldf_row_ids(data, "model LIKE 'C%' AND automatic"))
+    # An exact repeat, in other spacing and keyword case, is answered from the cache
+    filter_row_ids(data, "model like 'C%'   and automatic")
+    assert len(evaluated) == 2
+
+
+# A filter on rowid numbers the rows of the table it runs on, so it is not
+# refined from, nor evaluated over, a subset of the rows
+def test_rowid_filters_are_not_refined():
+    data = dataset()
+    assert_same_rows(data, 'rowid <= 300')
+    assert_same_rows(data, 'rowid <= 300 AND year > 2010')
+    assert_same_rows(data, 'year > 2010')
+    assert_same_rows(data, 'year > 2010 AND rowid <= 300')
+
+
+## Date filters
+
+def dated_dataset(rows=1500, seed=2):
+    rng = np.random.default_rng(seed)
+    moments = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 8 * 365 * 86400, rows), unit='s')
+    sold = pd.Series(moments).dt.strftime('%Y-%m-%d %H:%M:%S').astype(object)
+    sold[rng.random(rows) < 0.05] = None
+    return pd.DataFrame({'sold': sold, 'day': pd.Series(moments).dt.strftime('%Y-%m-%d'),
+                         'registered': pd.Series(moments).dt.floor('min'), 'price': rng.normal(100, 10, rows)})
+
+
+@pytest.mark.parametrize('filter_text', [
+    "strftime('%Y', sold) = '2018'",
+    "strftime('%Y', sold) <> '2018'",
+    "strftime('%Y', sold) IN ('2015', '2021')",
+    "strftime('%m', sold) BETWEEN '03' AND '05'",
+    "strftime('%m', sold) < '03'",
+    "strftime('%d', day) >= '28'",
+    "strftime('%H', sold) > '20'",
+    "strftime('%w', day) = '0'",
+    "strftime('%j', sold) <= '031'",
+    "strftime('%Y', registered) = '2019' AND strftime('%m', registered) = '12'",
+    "strftime('%Y', sold) = '2018' AND price > 100",
+    # Literals of another width compare as text in SQLite
+    "strftime('%m', sold) = '3'",
+    "strftime('%m', sold) > 3",
+    "strftime('%Y-%m', sold) = '2018-06'",
+    "registered >= '2020-01-01' AND registered < '2020-03-01'",
+    "registered BETWEEN '2016-02-01' AND '2016-02-29 23:59:59'",
+    "day > '2022-06-30'",
+])
+def test_date_filters_match_sqldf(filter_text):
+    assert_same_rows(dated_dataset(), filter_text)
+
+
+def test_date_parts_are_derived_once():
+    data = dated_dataset()
+    filter_row_ids(data, "strftime('%Y', sold) = '2018'")
+    filter_row_ids(data, "strftime('%Y', sold) > '2018'")
+    keys = [key for key, _ in filter_engine._date_cache.items()]
+    assert keys.count((filter_engine.dataset_key(data), 'sold')) == 1
+    assert keys.count((filter_engine.dataset_key(data), 'sold', '%Y')) == 1
+
+
+# Only columns SQLite reads as the same dates are parsed: datetime64 columns and
+# text columns of valid ISO 8601 dates; SQLite rolls 2024-02-30 over to March
+def test_detect_date_columns():
+    data = dated_dataset(200)
+    data['invalid'] = ['2024-02-30'] + ['2024-03-01'] * 199
+    data['local'] = '01/03/2024'
+    assert filter_engine.detect_date_columns(data) == ['sold', 'day', 'registered']
+    assert_same_rows(data, "strftime('%m', invalid) = '03'")
@@ -0,0 +1,145 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from instrumentation import span
+from job_scheduler import BATCH, INTERACTIVE, JobRejected, JobScheduler
+
+# Admission control of the job scheduler. The worker pool is replaced by one
+# whose futures the tests finish by hand, so the order in which jobs start
+# can be checked without processes; the last test runs jobs in real workers.
+
+MB = 2**20
+
+
+class ManualPool:
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, job_fn, profile, args, kwargs):
+        future = Future()
+        future.args = args
+        self.futures.append(future)
+        return future
+
+
+def scheduler(**kwargs):
+    jobs = JobScheduler(**kwargs)
+    jobs._pool = ManualPool()
+    return jobs
+
+
+def submit(jobs, name, **kwargs):
+    return jobs.submit(print, name, **kwargs)
+
+
+def started(jobs):
+    return [future.args[0] for future in jobs._pool.futures if not future.done()]
+
+
+def test_workers_bound_running_jobs_and_queue_runs_in_priority_order():
+    jobs = scheduler(max_workers=2, jobs_per_user=10)
+    first = submit(jobs, 'first', user='a')
+    submit(jobs, 'second', user='a')
+    submit(jobs, 'batch', user='a', priority=BATCH)
+    submit(jobs, 'interactive', user='a', priority=INTERACTIVE)
+    assert started(jobs) == ['first', 'second']
+    assert jobs.status()['queued'] == 2
+    assert jobs.position(first) == 0
+    jobs._pool.futures[0].set_result((1, [], None))
+    assert first.done and first.state == 'done' and first.result == 1
+    assert started(jobs) == ['second', 'interactive']
+    jobs._pool.futures[1].set_result((2, [], None))
+    assert started(jobs) == ['interactive', 'batch']
+
+
+def test_per_user_limit_lets_other_users_go_first():
+    jobs = scheduler(max_workers=4, jobs_per_user=1)
+    submit(jobs, 'a1', user='a')
+    a2 = submit(jobs, 'a2', user='a')
+    submit(jobs, 'b1', user='b')
+    assert started(jobs) == ['a1', 'b1']
+    assert jobs.position(a2) == 1
+    jobs._pool.futures[0].set_result((None, [], None))
+    assert started(jobs) == ['b1', 'a2']
+
+
+def test_memory_ceiling_refuses_larger_jobs_and_queues_the_rest():
+    jobs = scheduler(max_workers=4, jobs_per_user=10, memory_ceiling=100 * MB)
+    with pytest.raises(JobRejected):
+        jobs.submit(print, 'huge', memory=101 * MB)
+    submit(jobs, 'big', user='a', memory=60 * MB)
+    waiting = submit(jobs, 'waiting', user='b', memory=50 * MB)
+    submit(jobs, 'small', user='c', memory=30 * MB)
+    # A smaller job that fits may start before a queued larger one
+    assert started(jobs) == ['big', 'small']
+    assert jobs.status()['reserved_memory'] == 90 * MB
+    jobs._pool.futures[0].set_result((None, [], None))
+    assert started(jobs) == ['small', 'waiting']
+    assert waiting.state == 'running'
+
+
+def test_keyed_jobs_are_shared():
+    jobs = scheduler(max_workers=1, jobs_per_user=10)
+    submit(jobs, 'running', user='a')
+    warm_up = submit(jobs, 'profile', user=None, priority=BATCH, key='profile')
+    other = submit(jobs, 'other', user='b', priority=INTERACTIVE)
+    # A user asking for the queued warm-up job moves it up to interactive priority
+    assert jobs.submit(print, 'profile', user='a', key='profile') is warm_up
+    assert warm_up.priority == INTERACTIVE
+    assert jobs.position(warm_up) == 1 and jobs.position(other) == 2
+    jobs._pool.futures[0].set_result((None, [], None))
+    jobs._pool.futures[1].set_result(('report', [], None))
+    # Finished keyed jobs are kept and returned without running again
+    assert jobs.submit(print, 'profile', key='profile') is warm_up
+    assert len(jobs._pool.futures) == 3
+
+
+def test_failed_jobs_release_their_slot_and_are_not_kept():
+    jobs = scheduler(max_workers=1, jobs_per_user=1, memory_ceiling=100 * MB)
+    failing = submit(jobs, 'failing', user='a', memory=80 * MB, key='k')
+    queued = submit(jobs, 'queued', user='a', memory=80 * MB)
+    jobs._pool.futures[0].set_exception(ValueError('no numeric columns'))
+    assert failing.done and failing.state == 'failed'
+    assert isinstance(failing.error, ValueError)
+    assert queued.state == 'running'
+    # The failed job can be retried
+    retry = jobs.submit(print, 'retry', user='a', key='k')
+    assert retry is not failing
+
+
+# A worker that died (e.g. out of memory) breaks the pool: the job fails and
+# the next job starts in a new pool
+def test_broken_pool_fails_the_job_and_is_rebuilt():
+    jobs = scheduler(max_workers=1, jobs_per_user=1)
+    crashed = submit(jobs, 'crashed', user='a', key='k')
+    jobs._pool.futures[0].set_exception(BrokenProcessPool('worker died'))
+    assert crashed.state == 'failed' and jobs._pool is None
+
+    class BrokenPool:
+        def submit(self, *args):
+            raise BrokenProcessPool('worker died')
+
+    jobs._pool = BrokenPool()
+    refused = jobs.submit(print, 'refused', user='a', key='k', memory=MB)
+    assert refused.done and refused.state == 'failed'
+    assert isinstance(refused.error, BrokenProcessPool)
+    assert jobs.status() == {'queued': 0, 'running': 0, 'workers': 1, 'reserved_memory': 0}
+    assert jobs._pool is None and 'k' not in jobs._by_key
+
+
+def square(x):
+    with span('square'):
+        return x * x
+
+
+def test_jobs_run_in_worker_processes():
+    jobs = JobScheduler(max_workers=1, jobs_per_user=1)
+    try:
+        submitted = [jobs.submit(square, x, user='a') for x in range(3)]
+        for job in submitted:
+            assert job.wait(120)
+        assert [job.result for job in submitted] == [0, 1, 4]
+        assert [record['name'] for record in submitted[0].spans] == ['square']
+        assert submitted[0].args == ()
+    finally:
+        jobs._pool.shutdown()
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+import moments
+from moments import Moments
+
+# The streaming moment accumulators and the tests computed from them against scipy.stats
+
+
+def grouped(rows=30_000, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = rng.choice(['a', 'b', 'c', 'd'], rows, p=[0.5, 0.3, 0.15, 0.05])
+    scale = pd.Series({'a': 1.0, 'b': 2.0, 'c': 0.5, 'd': 3.0})[keys].to_numpy()
+    values = np.where(keys == 'b', rng.exponential(scale), rng.normal(10, scale)) + 1e6
+    values[rng.random(rows) < 0.02] = np.nan
+    return keys, values
+
+
+def chunked(keys, values, count):
+    return zip(np.array_split(keys, count), np.array_split(values, count))
+
+
+def by_group(keys, values):
+    frame = pd.DataFrame({'key': keys, 'x': values}).dropna()
+    return {key: group.to_numpy() for key, group in frame.groupby('key')['x']}
+
+
+@pytest.mark.parametrize('chunks', [1, 3, 17])
+def test_merged_moments_match_scipy(chunks):
+    keys, values = grouped()
+    result = moments.accumulate(chunked(keys, values, chunks))
+    groups = by_group(keys, values)
+    assert list(result.index) == sorted(groups)
+    expected = [groups[key] for key in result.index]
+    np.testing.assert_array_equal(result.n, [len(x) for x in expected])
+    np.testing.assert_allclose(result.mean, [x.mean() for x in expected], rtol=1e-12)
+    np.testing.assert_allclose(result.variance(), [x.var(ddof=1) for x in expected], rtol=1e-8)
+    np.testing.assert_allclose(result.variance(ddof=0), [x.var() for x in expected], rtol=1e-8)
+    np.testing.assert_allclose(result.skewness(), [stats.skew(x) for x in expected], rtol=1e-6)
+    np.testing.assert_allclose(result.kurtosis(), [stats.kurtosis(x) for x in expected], rtol=1e-6)
+
+
+# Chunks may hold only some of the groups, or none of their values
+def test_merge_with_missing_groups():
+    left = Moments.from_groups(['a', 'a', 'b'], [1.0, 2.0, 5.0])
+    right = Moments.from_groups(['c', 'a', 'c'], [4.0, 3.0, np.nan])
+    empty = Moments.from_groups([], [])
+    result = left.merge(empty).merge(right)
+    assert list(result.index) == ['a', 'b', 'c']
+    np.testing.assert_array_equal(result.n, [3, 1, 1])
+    np.testing.assert_allclose(result.mean, [2.0, 5.0, 4.0])
+    np.testing.assert_allclose(result.m2, [2.0, 0.0, 0.0])
+
+
+@pytest.mark.parametrize('chunks', [1, 5])
+def test_normaltest_matches_scipy(chunks):
+    keys, values = grouped(seed=1)
+    result = moments.accumulate(chunked(keys, values, chunks))
+    statistic, p_values = moments.normaltest(result)
+    groups = by_group(keys, values)
+    expected = [stats.normaltest(groups[key]) for key in result.index]
+    np.testing.assert_allclose(statistic, [e.statistic for e in expected], rtol=1e-6)
+    np.testing.assert_allclose(p_values, [e.pvalue for e in expected], rtol=1e-5, atol=1e-300)
+
+
+def test_normaltest_needs_eight_values():
+    statistic, p_values = moments.normaltest(Moments.from_values(np.arange(7.0)))
+    assert np.isnan(statistic).all() and np.isnan(p_values).all()
+    statistic, _ = moments.normaltest(Moments.from_values(np.random.default_rng(2).normal(size=8)))
+    assert not np.isnan(statistic).any()
+
+
+# Levene's test is the one-way ANOVA of the absolute deviations from each group's center
+@pytest.mark.parametrize('center', ['median', 'mean'])
+def test_levene_matches_scipy(center):
+    keys, values = grouped(seed=3)
+    groups = by_group(keys, values)
+    centers = pd.Series({key: getattr(np, center)(x) for key, x in groups.items()})
+    deviations = moments.accumulate((k, np.abs(v - centers.reindex(k).to_numpy()))
+                                    for k, v in chunked(keys, values, 4))
+    statistic, p_value = moments.levene(deviations)
+    expected = stats.levene(*[groups[key] for key in deviations.index], center=center)
+    assert statistic == pytest.approx(expected.statistic, rel=1e-8)
+    assert p_value == pytest.approx(expected.pvalue, rel=1e-6)
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sketches import HeavyHitters, HyperLogLog, KLLSketch, build_sketch
+
+# The sketches against exact statistics, within their stated error bounds:
+# HyperLogLog's standard error is 1.04 / sqrt(2^precision), KLL's rank error
+# about 1% at k=200 and Misra-Gries undercounts by at most n / (capacity + 1)
+
+
+def hashes(values):
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+@pytest.mark.parametrize('distinct', [50, 3000, 20_000, 400_000])
+def test_hyperloglog_distinct_count_within_error(distinct):
+    sketch = HyperLogLog(precision=12)
+    values = np.random.default_rng(distinct).integers(0, distinct, distinct * 3)
+    values[:distinct] = np.arange(distinct)
+    sketch.update(hashes(values))
+    standard_error = 1.04 / np.sqrt(2 ** 12)
+    assert abs(sketch.estimate() - distinct) <= 4 * standard_error * distinct
+
+
+def test_hyperloglog_merge_equals_the_sketch_of_the_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    left.update(hashes(np.arange(0, 60_000)))
+    right.update(hashes(np.arange(40_000, 100_000)))
+    union.update(hashes(np.arange(0, 100_000)))
+    np.testing.assert_array_equal(left.merge(right).registers, union.registers)
+
+
+def test_hyperloglog_rejects_unsupported_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=20)
+
+
+# Largest distance between the requested and the actual rank of the answers
+def rank_error(values, qs, answers):
+    ordered = np.sort(values)
+    low = np.searchsorted(ordered, answers, side='left') / len(values)
+    high = np.searchsorted(ordered, answers, side='right') / len(values)
+    # Tied values cover a range of ranks
+    return np.max(np.maximum(0, np.maximum(low - qs, qs - high)))
+
+
+QS = np.array([0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999])
+
+
+@pytest.mark.parametrize('values', [
+    np.random.default_rng(0).normal(0, 1, 300_000),
+    np.random.default_rng(1).lognormal(3, 2, 300_000),
+    np.random.default_rng(2).integers(0, 20, 300_000).astype('float64'),
+])
+def test_kll_quantiles_within_rank_error(values):
+    sketch = KLLSketch(k=200, seed=0)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    assert sketch.n == len(values)
+    assert rank_error(values, QS, sketch.quantiles(QS)) <= 0.02
+    # Its memory stays bounded
+    assert sum(len(level) for level in sketch.levels) < 3 * 200
+
+
+def test_kll_merged_sketches_within_rank_error():
+    values = np.random.default_rng(3).exponential(5, 400_000)
+    parts = [KLLSketch(k=200, seed=seed) for seed in range(4)]
+    for part, chunk in zip(parts, np.array_split(values, 4)):
+        part.update(chunk)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    assert merged.n == len(values)
+    assert rank_error(values, QS, merged.quantiles(QS)) <= 0.02
+
+
+def test_kll_ignores_nan_and_empty_sketch_gives_nan():
+    sketch = KLLSketch()
+    assert np.isnan(sketch.quantiles([0.5])).all()
+    sketch.update([1.0, np.nan, 3.0])
+    assert sketch.n == 2
+
+
+def test_heavy_hitters_undercount_within_bound():
+    rng = np.random.default_rng(4)
+    values = pd.Series(np.concatenate([rng.zipf(1.5, 200_000), rng.integers(10**6, 10**7, 50_000)]))
+    summary = HeavyHitters(capacity=64)
+    for chunk in np.array_split(values, 10):
+        summary.update(chunk.value_counts(sort=False))
+    exact = values.value_counts()
+    assert not summary.exact
+    assert len(summary.counts) <= 64
+    assert summary.error <= len(values) / (64 + 1)
+    for value, count in summary.counts.items():
+        assert exact[value] - summary.error <= count <= exact[value]
+    # Every value more frequent than the bound is kept
+    for value in exact[exact > summary.error].index:
+        assert value in summary.counts.index
+
+
+def test_heavy_hitters_exact_with_few_values():
+    values = pd.Series(['a'] * 5 + ['b'] * 3 + ['c'])
+    summary = HeavyHitters(capacity=8)
+    summary.update(values.iloc[:4].value_counts())
+    summary.merge(HeavyHitters(capacity=8))
+    other = HeavyHitters(capacity=8)
+    other.update(values.iloc[4:].value_counts())
+    summary.merge(other)
+    assert summary.exact
+    pd.testing.assert_series_equal(summary.top(3), values.value_counts(), check_names=False)
+
+
+def frame(rows=200_000, seed=5):
+    rng = np.random.default_rng(seed)
+    price = rng.normal(100, 20, rows)
+    price[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({'price': price, 'model': rng.choice(['a', 'b', 'c', None], rows),
+                         'id': np.arange(rows)})
+
+
+def test_dataset_sketch_summary():
+    data = frame()
+    sketch = build_sketch(np.array_split(data, 5), data.dtypes)
+    summary = sketch.summary().set_index('column')
+    assert sketch.rows == len(data)
+    assert summary.loc['price', 'missing'] == data['price'].isna().sum()
+    assert summary.loc['price', 'min'] == data['price'].min()
+    assert summary.loc['price', 'max'] == data['price'].max()
+    assert summary.loc['price', 'mean'] == pytest.approx(data['price'].mean())
+    # Few distinct values are counted exactly, many are estimated
+    assert summary.loc['model', 'distinct (approx.)'] == 3
+    assert summary.loc['id', 'distinct (approx.)'] == pytest.approx(len(data), rel=0.07)
+    top = sketch.top_values('model', 3)
+    assert dict(zip(top['model'], top['count (lower bound)'])) == data['model'].value_counts().to_dict()
+
+
+def test_merged_dataset_sketches_match_one_pass():
+    data = frame(50_000)
+    halves = [build_sketch([half], data.dtypes) for half in np.array_split(data, 2)]
+    merged = halves[0].merge(halves[1])
+    whole = build_sketch([data], data.dtypes)
+    assert merged.rows == whole.rows
+    assert merged.distinct_counts() == pytest.approx(whole.distinct_counts(), rel=0.05)
+    np.testing.assert_array_equal(merged.columns['id'].distinct.registers, whole.columns['id'].distinct.registers)
@@ -0,0 +1,114 @@
+import os
+import time
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Hyperparameter tuning of the model chosen by compare_models, with Optuna
+# over the data and folds prepared by the PyCaret experiment:
+# - trials run until a time budget is spent, optionally in parallel worker processes
+#   sharing one study stored in SQLite
+# - each trial reports its running mean score after every fold, and the
+#   median pruner stops trials scoring below the median of earlier trials
+# - studies are kept per dataset, target and model, so a later tuning run
+#   starts from the trials of the previous ones (TPE samples from them)
+# The search spaces are PyCaret's tuning distributions of each model.
+
+TUNING_DIR = os.environ.get('DATA_EXPRESS_TUNING_DIR', os.path.join(tempfile.gettempdir(), 'data_express_tuning'))
+
+# Tuning runs inside a job of the shared scheduler (job_scheduler), which
+# counts it as one worker: more tuning processes are extra workers outside its
+# limits, so they are opt-in and reserved in the job's memory estimate
+TUNING_WORKERS = int(os.environ.get('DATA_EXPRESS_TUNING_WORKERS', 1))
+
+TIME_BUDGET = 60
+
+# Trials are not pruned before this many trials completed, nor before their second fold
+PRUNER_STARTUP_TRIALS = 5
+PRUNER_WARMUP_FOLDS = 1
+
+# Metric optimized per experiment type, as named in PyCaret's results and by scikit-learn
+METRICS = {'Classification': ('Accuracy', 'accuracy'), 'Regression': ('R2', 'r2')}
+
+
+def _storage(study_path):
+    import optuna
+    # Several processes write to the same file
+    return optuna.storages.RDBStorage(f'sqlite:///{study_path}', engine_kwargs={'connect_args': {'timeout': 60}})
+
+
+def _pruner():
+    import optuna
+    return optuna.pruners.MedianPruner(n_startup_trials=PRUNER_STARTUP_TRIALS, n_warmup_steps=PRUNER_WARMUP_FOLDS)
+
+
+# Run trials of the study until the deadline; returns the number of trials run
+def _run_trials(study_path, study_name, distributions, estimator, X, y, folds, scoring, deadline):
+    import optuna
+    from sklearn.base import clone
+    from sklearn.metrics import get_scorer
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=study_name, storage=_storage(study_path), pruner=_pruner())
+    scorer = get_scorer(scoring)
+    splits = list(folds.split(X, y))
+    trials = 0
+    while time.time() < deadline:
+        trial = study.ask(distributions)
+        scores = []
+        try:
+            for fold, (train, test) in enumerate(splits):
+                model = clone(estimator).set_params(**trial.params)
+                model.fit(X.iloc[train], y.iloc[train])
+                scores.append(scorer(model, X.iloc[test], y.iloc[test]))
+                trial.report(sum(scores) / len(scores), fold)
+                # Trials still running at the deadline are cut short like pruned ones
+                if trial.should_prune() or (time.time() >= deadline and fold < len(splits) - 1):
+                    study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+                    break
+            else:
+                study.tell(trial, sum(scores) / len(scores))
+        except Exception:
+            study.tell(trial, state=optuna.trial.TrialState.FAIL)
+        trials += 1
+    return trials
+
+
+# Tune the model of a PyCaret experiment within the time budget (in seconds).
+# study_key names the dataset and target whose earlier studies are continued.
+# Returns the parameters of the best trial of the study, its mean cross-validated
+# score and the trials of this run.
+def tune(exp, model, experiment, study_key, time_budget=TIME_BUDGET, workers=TUNING_WORKERS):
+    import optuna
+    from pycaret.internal.distributions import get_optuna_distributions
+    model_id = exp._get_model_id(model)
+    distributions = get_optuna_distributions(exp.models(internal=True).loc[model_id, 'Tune Distributions'])
+    X, y = exp.get_config('X_train_transformed'), exp.get_config('y_train_transformed')
+    _, scoring = METRICS[experiment]
+
+    os.makedirs(TUNING_DIR, exist_ok=True)
+    study_name = f'{study_key}-{model_id}'
+    study_path = os.path.join(TUNING_DIR, hashlib.blake2b(study_name.encode(), digest_size=16).hexdigest() + '.db')
+    study = optuna.create_study(study_name=study_name, storage=_storage(study_path), direction='maximize',
+                                pruner=_pruner(), load_if_exists=True)
+    previous = len(study.trials)
+
+    args = (study_path, study_name, distributions, model, X, y, exp.get_config('fold_generator'), scoring,
+            time.time() + time_budget)
+    workers = max(1, workers)
+    if workers > 1:
+        # Spawned workers, as for the other process pools of the app
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(_run_trials, *zip(*[args] * workers)))
+    else:
+        _run_trials(*args)
+
+    study = optuna.load_study(study_name=study_name, storage=_storage(study_path))
+    trials = study.trials_dataframe(attrs=('number', 'value', 'state', 'duration', 'params'))
+    trials = trials[trials['number'] >= previous].reset_index(drop=True)
+    completed = [trial for trial in study.trials if trial.state == optuna.trial.TrialState.COMPLETE]
+    if not completed:
+        return {'model_id': model_id, 'params': None, 'score': None, 'trials': trials, 'previous_trials': previous}
+    best = max(completed, key=lambda trial: trial.value)
+    return {'model_id': model_id, 'params': best.params, 'score': best.value, 'trials': trials,
+            'previous_trials': previous}
@@ -0,0 +1,128 @@
+import threading
+import pandas as pd
+import analysis_engine as engine
+from dataset_cache import DatasetCache
+from filter_engine import dataset_key, column_kind, get_index, indexed_columns, SortedIndex
+from job_scheduler import BATCH, JobRejected, get_scheduler, estimate_memory
+from out_of_core import LazyDataset
+from sketches import SKETCH_MIN_ROWS, dataset_sketch
+from table_preview import column_summary
+from instrumentation import span, set_size
+
+# Background warm-up of the shared caches right after a dataset loads, so the
+# sections open without paying for their first computation: the columnar
+# cache file (out-of-core CSV files), column classification, column summaries
+# and sketches, indexes of the columns filtered on recently, and the profile
+# report (queued as a batch job) when the profiled data is small.
+# Each dataset is warmed up once per process; sessions opening the same
+# dataset see the same progress.
+
+STEPS = ['columnar cache', 'classification', 'summaries', 'filter indexes', 'profile']
+
+# Memory estimate of a profile job, as a multiple of the profiled data's size
+PROFILE_MEMORY_FACTOR = 10
+
+_warmups = DatasetCache(max_entries=16)
+_warmups_lock = threading.Lock()
+
+
+# Data profiled for a dataset (a fixed sample of out-of-core datasets) and the key of its profile job
+def profile_source(data, sample_rows):
+    if isinstance(data, LazyDataset):
+        return data.sample_rows(sample_rows), ('profile', data.key, data.filter_text)
+    return data, ('profile', dataset_key(data))
+
+
+def submit_profile(data, sample_rows, priority, user=None):
+    frame, key = profile_source(data, sample_rows)
+    return get_scheduler().submit(engine.profile_html, frame, priority=priority, user=user,
+                                  memory=estimate_memory(frame, PROFILE_MEMORY_FACTOR), key=key)
+
+
+class WarmUp:
+    def __init__(self):
+        self.status = {step: 'pending' for step in STEPS}
+
+    @property
+    def done(self):
+        return all(status != 'pending' for status in self.status.values())
+
+    def progress(self):
+        return sum(status != 'pending' for status in self.status.values()), len(STEPS)
+
+    def _step(self, step, fn, data):
+        try:
+            with span(f'warmup.{step.replace(" ", "_")}') as record:
+                set_size(record, data)
+                self.status[step] = fn(data) or 'done'
+        except Exception as e:
+            self.status[step] = f'failed ({type(e).__name__})'
+
+    def run(self, data, sample_rows, user=None):
+        self._step('columnar cache', _columnar_cache, data)
+        self._step('classification', _classification, data)
+        self._step('summaries', _summaries, data)
+        self._step('filter indexes', _filter_indexes, data)
+        self._step('profile', lambda data: _profile(data, sample_rows, user), data)
+
+
+def _columnar_cache(data):
+    if not isinstance(data, LazyDataset):
+        return 'skipped (in memory)'
+    data.write_columnar_cache()
+
+
+def _classification(data):
+    engine.classify_columns(data)
+
+
+def _summaries(data):
+    if isinstance(data, LazyDataset):
+        data.summary()
+    else:
+        column_summary(data)
+    dataset_sketch(data)
+
+
+# Indexes of the columns recently filtered on, in this or an earlier version of
+# the dataset; other columns are indexed by the first filter using them
+def _filter_indexes(data):
+    if isinstance(data, LazyDataset):
+        return 'skipped (DuckDB filters)'
+    columns = indexed_columns(data)
+    if not columns:
+        return 'skipped (no filtered columns)'
+    for col, index_type in columns:
+        # Skip columns whose kind no longer takes the fast path or this index
+        kind = column_kind(data[col])
+        if kind is None or (kind == 'datetime' and index_type is not SortedIndex):
+            continue
+        get_index(data, col, index_type)
+
+
+# The profile is only queued; its result stays in the scheduler's cache
+def _profile(data, sample_rows, user):
+    # Large in-memory datasets show the sketch summary by default
+    if isinstance(data, pd.DataFrame) and len(data) >= SKETCH_MIN_ROWS:
+        return 'skipped (sketch summary)'
+    # Out-of-core datasets are profiled on a sample of sample_rows rows; larger
+    # in-memory datasets are only profiled when the report is opened
+    if len(data) > sample_rows and not isinstance(data, LazyDataset):
+        return 'skipped (large)'
+    try:
+        submit_profile(data, sample_rows, BATCH, user)
+    except JobRejected:
+        return 'skipped (too large)'
+    return 'queued'
+
+
+# Start the warm-up of a dataset in a background thread, once per dataset
+def start_warm_up(data, sample_rows, user=None):
+    key = (data.key, data.filter_text) if isinstance(data, LazyDataset) else dataset_key(data)
+    with _warmups_lock:
+        warmup = _warmups.get(key)
+        if warmup is None:
+            warmup = _warmups.put(key, WarmUp())
+            threading.Thread(target=warmup.run, args=(data, sample_rows, user),
+                             name='data-express-warmup', daemon=True).start()
+    return warmup